@@ -1,15 +1,38 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
-import sqlite3
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, flash
 import json
 import os
+import hmac
+import re
+import time
+import atexit
 from functools import wraps
-from datetime import datetime, timedelta
+from datetime import datetime, date, timedelta
 import requests
 from db import (
     init_database, get_service_status, update_service_status, 
-    save_service_token, get_service_token, add_log
+    save_service_token, get_service_token, add_log, get_connection, transaction,
+    get_dashboard_stats, get_service_config, save_service_config, list_orders, get_order_status_counts,
+    update_order, rebuild_stats, format_timestamp, get_sync_state, ORDER_STATUSES
 )
-from core import AIEngine, ResponseManager, ConnectionTester, generate_quick_buttons, WhatsAppReporter, ShopifyIntegration
+from logsink import log_sink, prune_logs, LOG_RETENTION_INTERVAL
+from jobqueue import JobQueue, WorkerPool, QueueFull
+from batch_replies import CommentBatchProcessor
+from ingest import ingest, mark_throttled
+from ratelimit import get_rate_limiter, event_keys, purge_rate_limits
+from webhook_auth import get_webhook_guard, WebhookRejected
+from product_search import get_product_index
+from events import broker, agent_topic, publish_order_change, stream, purge_events
+from dispatch import get_dispatcher, DISPATCH_STRATEGY
+from reports import get_report_engine, render_report
+from outbox import get_sender as get_outbox_sender, get_delivery_status, record_statuses
+from scheduler import Scheduler, STATS_REBUILD_AT, STATS_REBUILD_DAYS
+from core import (
+    get_response_manager, generate_quick_buttons,
+    WhatsAppReporter, REPORT_SCHEDULE, REPORT_PHONE
+)
+from shopify_sync import ShopifyClient, ShopifySyncError, sync_catalog, SHOPIFY_SYNC_INTERVAL
+from sheets_sync import sync_orders, SHEETS_SYNC_INTERVAL, SYNC_NAME as SHEETS_SYNC_NAME
+from health import get_health, run_checks, HEALTH_CHECK_INTERVAL, PROBES
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
@@ -27,6 +50,15 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def agent_required(f):
+    """واجهة المندوب: المعرف من الجلسة بعد الدخول بكلمة المرور وليس من الرابط"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'agent_id' not in session:
+            return redirect(url_for('agent_login'))
+        return f(*args, **kwargs)
+    return decorated_function
+
 # الصفحة الرئيسية للدخول
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -49,51 +81,16 @@ def logout():
 @app.route('/admin/dashboard')
 @login_required
 def dashboard():
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    # إحصائيات اليوم
-    today = datetime.now().date()
-    
-    # عدد الرسائل اليوم
-    cursor.execute('''
-        SELECT COUNT(*) FROM inbox 
-        WHERE DATE(created_time) = ?
-    ''', (today,))
-    today_messages = cursor.fetchone()[0]
-    
-    # عدد التعليقات اليوم
-    cursor.execute('''
-        SELECT COUNT(*) FROM comments 
-        WHERE DATE(created_time) = ?
-    ''', (today,))
-    today_comments = cursor.fetchone()[0]
-    
-    # عدد الطلبات
-    cursor.execute('SELECT COUNT(*) FROM orders WHERE status = ?', ('new',))
-    new_orders = cursor.fetchone()[0]
-    
-    # عدد المناديب النشطين
-    cursor.execute('SELECT COUNT(*) FROM agents WHERE status = 1')
-    active_agents = cursor.fetchone()[0]
-    
-    # حالة الخدمات
-    services = {
-        'facebook': get_service_status('facebook'),
-        'whatsapp': get_service_status('whatsapp'),
-        'googlesheet': get_service_status('googlesheet'),
-        'openai': get_service_status('openai'),
-        'deepseek': get_service_status('deepseek')
-    }
-    
-    conn.close()
+    # العدادات تحدث مع كل إدخال - القراءة هنا صف واحد مهما كبر السجل
+    stats = get_dashboard_stats()
     
     return render_template('dashboard.html', 
-                         today_messages=today_messages,
-                         today_comments=today_comments,
-                         new_orders=new_orders,
-                         active_agents=active_agents,
-                         services=services)
+                         today_messages=stats['today_messages'],
+                         today_comments=stats['today_comments'],
+                         new_orders=stats['new_orders'],
+                         active_agents=stats['active_agents'],
+                         services=stats['services'],
+                         health=get_health())
 
 # إدارة فيسبوك
 @app.route('/admin/facebook')
@@ -116,6 +113,19 @@ def facebook_connect():
     
     return redirect(fb_auth_url)
 
+@app.route('/admin/facebook/webhook', methods=['POST'])
+@login_required
+def facebook_webhook_settings():
+    """حفظ App Secret و Verify Token المستخدمين في التحقق من Webhook"""
+    data = request.json or {}
+    config = get_service_config('facebook')
+    for key in ('app_secret', 'verify_token'):
+        if data.get(key):
+            config[key] = data[key]
+    save_service_config('facebook', config)
+    get_webhook_guard().secrets.invalidate()
+    return jsonify({'status': 'success', 'signature_check': bool(config.get('app_secret'))})
+
 @app.route('/admin/facebook/callback')
 def facebook_callback():
     code = request.args.get('code')
@@ -143,6 +153,13 @@ def whatsapp_connect():
     
     if phone_number and access_token:
         save_service_token('whatsapp', access_token)
+        # دمج مع الإعدادات المحفوظة حتى لا يضيع app_secret / verify_token
+        config = get_service_config('whatsapp')
+        # رقم استلام التقارير المجدولة (افتراضياً رقم الربط نفسه)
+        config['report_phone'] = request.json.get('report_phone') or phone_number
+        if request.json.get('phone_number_id'):
+            config['phone_number_id'] = request.json['phone_number_id']
+        save_service_config('whatsapp', config)
         update_service_status('whatsapp', True)
         add_log('info', 'WhatsApp Business connected', 'whatsapp')
         return jsonify({'status': 'success'})
@@ -182,6 +199,42 @@ def googlesheet_callback():
     
     return redirect(url_for('googlesheet_settings'))
 
+@app.route('/api/googlesheet/config', methods=['POST'])
+@login_required
+def googlesheet_config():
+    """حفظ جدول الطلبات (المعرف أو الرابط كاملاً) واسم الورقة ثم مزامنة كاملة في الخلفية"""
+    data = request.json or {}
+    sheet = (data.get('orders_sheet') or '').strip()
+    match = re.search(r'/spreadsheets/d/([\w-]+)', sheet)
+    if match:
+        sheet = match.group(1)
+    if not sheet:
+        return jsonify({'status': 'error', 'message': 'Missing spreadsheet'}), 400
+    
+    config = get_service_config('googlesheet')
+    config['orders_sheet'] = sheet
+    if data.get('orders_tab'):
+        config['orders_tab'] = data['orders_tab']
+    save_service_config('googlesheet', config)
+    try:
+        job_queue.enqueue('sheets_sync', {'full': True})
+    except QueueFull:
+        # الإعدادات محفوظة - المزامنة الدورية أو زر المزامنة يكملان لاحقاً
+        return jsonify({'status': 'error', 'message': 'تم حفظ الجدول لكن طابور المهام ممتلئ، حاول المزامنة لاحقاً',
+                        'orders_sheet': sheet})
+    return jsonify({'status': 'success', 'orders_sheet': sheet})
+
+@app.route('/api/googlesheet/sync', methods=['GET', 'POST'])
+@login_required
+def googlesheet_sync():
+    """POST: مزامنة الطلبات الآن (في الخلفية) - GET: حالة آخر مزامنة"""
+    if request.method == 'POST':
+        try:
+            job_queue.enqueue('sheets_sync', {'full': bool((request.json or {}).get('full'))})
+        except QueueFull:
+            return jsonify({'status': 'error', 'message': 'طابور المهام ممتلئ، حاول لاحقاً'})
+    return jsonify({'status': 'success', 'sync': get_sync_state(SHEETS_SYNC_NAME)})
+
 # إدارة الذكاء الاصطناعي
 @app.route('/admin/ai')
 @login_required
@@ -203,27 +256,63 @@ def update_ai():
     
     return jsonify({'status': 'error', 'message': 'Missing data'})
 
+@app.route('/admin/ai/cache-stats')
+@login_required
+def ai_cache_stats():
+    return jsonify(get_response_manager().ai.cache.stats())
+
+# آخر السجلات من الذاكرة (بدون قاعدة البيانات)
+@app.route('/admin/logs/recent')
+@login_required
+def recent_logs():
+    limit = request.args.get('limit', 100, type=int)
+    level = request.args.get('level')
+    return jsonify({'logs': log_sink.recent(limit, level), 'stats': log_sink.stats()})
+
+# حالة المهام الدورية
+@app.route('/admin/scheduler')
+@login_required
+def scheduler_status():
+    return jsonify(scheduler.status())
+
+@app.route('/admin/ratelimit')
+@login_required
+def ratelimit_status():
+    """الحدود الحالية وعدد الطلبات المسموحة/المرفوضة لكل نطاق (منذ بدء العملية)"""
+    return jsonify(get_rate_limiter().status())
+
 # إدارة الطلبات
 @app.route('/admin/orders')
 @login_required
 def orders():
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT o.*, a.name as agent_name 
-        FROM orders o 
-        LEFT JOIN agents a ON o.agent_id = a.agent_id
-        ORDER BY o.created_at DESC
-    ''')
-    orders = cursor.fetchall()
-    
+    # الصفحة تحمل الطلبات على دفعات من /api/orders - هنا العدادات والمناديب فقط
+    cursor = get_connection().cursor()
     cursor.execute('SELECT * FROM agents WHERE status = 1')
     agents = cursor.fetchall()
     
-    conn.close()
-    
-    return render_template('orders.html', orders=orders, agents=agents)
+    return render_template('orders.html', counts=get_order_status_counts(), agents=agents)
+
+@app.route('/api/orders')
+@login_required
+def api_orders():
+    """قائمة الطلبات بترقيم keyset: ?status=&agent=&from=&to=&q=&sort=newest|oldest&cursor=&limit="""
+    try:
+        date_from = request.args.get('from')
+        date_to = request.args.get('to')
+        page = list_orders(
+            status=request.args.get('status') or None,
+            agent_id=request.args.get('agent') or None,
+            date_from=date.fromisoformat(date_from) if date_from else None,
+            date_to=date.fromisoformat(date_to) if date_to else None,
+            sort=request.args.get('sort', 'newest'),
+            after=request.args.get('cursor') or None,
+            limit=request.args.get('limit', 50, type=int),
+            search=(request.args.get('q') or '').strip() or None
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    return jsonify(page)
 
 @app.route('/admin/orders/assign', methods=['POST'])
 @login_required
@@ -232,25 +321,78 @@ def assign_order():
     order_id = data.get('order_id')
     agent_id = data.get('agent_id')
     
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE orders SET agent_id = ?, status = ? WHERE order_id = ?', 
-                   (agent_id, 'assigned', order_id))
-    conn.commit()
-    conn.close()
+    result = update_order(order_id, 'assigned', agent_id=agent_id)
+    if result is None:
+        return jsonify({'status': 'error', 'message': 'الطلب غير موجود'})
+    on_order_change(*result)
     
     add_log('info', f'Order {order_id} assigned to agent {agent_id}', 'orders')
     return jsonify({'status': 'success'})
 
+@app.route('/admin/orders/update-status', methods=['POST'])
+@login_required
+def update_order_status():
+    data = request.json
+    order_id = data.get('order_id')
+    status = data.get('status')
+    if status not in ORDER_STATUSES:
+        return jsonify({'status': 'error', 'message': 'حالة غير معروفة'})
+    
+    # الرجوع إلى "جديد" يحرر الطلب من المندوب
+    if status == 'new':
+        result = update_order(order_id, status, agent_id=None)
+    else:
+        result = update_order(order_id, status)
+    if result is None:
+        return jsonify({'status': 'error', 'message': 'الطلب غير موجود'})
+    on_order_change(*result)
+    
+    add_log('info', f'Order {order_id} status changed to {status}', 'orders')
+    return jsonify({'status': 'success'})
+
+def on_order_change(before, after, tracked=False):
+    """بعد أي تعديل على طلب: تحديث حمل المناديب في الذاكرة وإشعار المندوب
+    tracked=True إذا كان الموزع قد حدّث الحمل بنفسه (الإسناد التلقائي)"""
+    if not tracked:
+        get_dispatcher().tracker.apply(before, after)
+    if after.get('created_at'):
+        get_report_engine().invalidate(str(after['created_at'])[:10])
+    publish_order_change(before, after)
+
+@app.route('/admin/orders/dispatch', methods=['POST'])
+@login_required
+def dispatch_orders():
+    """إسناد كل الطلبات الجديدة تلقائياً: {strategy: least_loaded|round_robin|zone, limit}"""
+    data = request.json or {}
+    limit = data.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = -1
+        if limit < 1 or isinstance(data['limit'], bool):
+            return jsonify({'status': 'error', 'message': 'limit يجب أن يكون عدداً صحيحاً موجباً'}), 400
+    try:
+        stats, changes = get_dispatcher().dispatch(
+            strategy=data.get('strategy') or DISPATCH_STRATEGY,
+            limit=limit
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    for before, after in changes:
+        on_order_change(before, after, tracked=True)
+    
+    add_log('info', f"Dispatched {stats['assigned']} orders ({stats['strategy']}), {stats['skipped']} skipped", 'orders')
+    return jsonify({'status': 'success', **stats})
+
 # إدارة المناديب
 @app.route('/admin/agents')
 @login_required
 def agents():
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     cursor.execute('SELECT * FROM agents ORDER BY created_at DESC')
     agents = cursor.fetchall()
-    conn.close()
     
     return render_template('agents.html', agents=agents)
 
@@ -262,18 +404,14 @@ def add_agent():
     phone = data.get('phone')
     email = data.get('email')
     password = data.get('password')
-    
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
+    zone = data.get('zone')
     
     agent_id = f"agent_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-    cursor.execute('''
-        INSERT INTO agents (agent_id, name, phone, email, password)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (agent_id, name, phone, email, password))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO agents (agent_id, name, phone, email, password, zone)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (agent_id, name, phone, email, password, zone))
     
     add_log('info', f'New agent added: {name}', 'agents')
     return jsonify({'status': 'success', 'agent_id': agent_id})
@@ -282,38 +420,51 @@ def add_agent():
 @app.route('/admin/test-connection', methods=['POST'])
 @login_required
 def test_connection():
+    """فحص خدمة واحدة الآن بمهلة قصيرة (نفس فحص المُجدول) وحفظ النتيجة في service_health"""
     service = request.json.get('service')
-    tester = ConnectionTester()
-    
-    if service == 'facebook':
-        token = get_service_token('facebook')
-        result = tester.test_facebook_connection(token)
-    elif service == 'whatsapp':
-        token = get_service_token('whatsapp')
-        result = tester.test_whatsapp_connection(token)
-    elif service == 'googlesheet':
-        token = get_service_token('googlesheet')
-        result = tester.test_google_sheets_connection(token)
-    else:
-        result = {'status': 'error', 'message': 'Service not supported'}
-    
-    return jsonify(result)
+    if service not in PROBES:
+        return jsonify({'status': 'error', 'message': 'Service not supported'})
+    
+    status, latency, http_status, error = run_checks([service])[service]
+    if status == 'ok':
+        return jsonify({'status': 'success', 'message': 'الاتصال بنجاح', 'latency_ms': round(latency)})
+    if status == 'not_configured':
+        return jsonify({'status': 'error', 'message': 'الخدمة غير مربوطة'})
+    return jsonify({'status': 'error', 'message': 'فشل الاتصال', 'error': error})
+
+@app.route('/admin/health')
+@login_required
+def service_health():
+    """آخر نتائج فحص الخدمات من الجدول - ?refresh=1 يضيف فحصاً جديداً للطابور دون انتظاره"""
+    if request.args.get('refresh') == '1':
+        try:
+            # ضغطات التحديث المتتالية خلال 30 ثانية فحص واحد
+            job_queue.enqueue('health_check', {}, dedup_key=f'manual:{int(time.time()) // 30}')
+        except QueueFull:
+            pass
+    return jsonify({'status': 'success', 'services': get_health(), 'interval': HEALTH_CHECK_INTERVAL})
 
 # API للمساعد الذكي
 @app.route('/api/ask', methods=['POST'])
+@login_required
 def ask_ai():
+    allowed, scope, retry_after = get_rate_limiter().allow(('ip', request.remote_addr))
+    if not allowed:
+        response = jsonify({'status': 'error', 'message': 'Too many requests'})
+        response.headers['Retry-After'] = str(int(retry_after) + 1)
+        return response, 429
+    
     data = request.json
     question = data.get('question')
     page_context = data.get('page_context', '')
     context_type = data.get('context_type', 'assistant')  # customer, assistant, admin
     
-    manager = ResponseManager()
+    manager = get_response_manager()
     
     if context_type == 'assistant':
         response = manager.process_assistant_query(question, page_context)
     else:
-        ai = AIEngine()
-        response = ai.generate_response(question, page_context, {}, context_type)
+        response = manager.ai.generate_response(question, page_context, {}, context_type)
     
     return jsonify({'response': response})
 
@@ -323,7 +474,7 @@ def ask_ai():
 def generate_daily_report():
     """توليد تقرير يومي"""
     try:
-        manager = ResponseManager()
+        manager = get_response_manager()
         report = manager.generate_daily_report()
         
         return jsonify({
@@ -336,6 +487,23 @@ def generate_daily_report():
             'message': str(e)
         })
 
+@app.route('/api/reports/<period>')
+@login_required
+def get_report(period):
+    """مؤشرات التقرير (daily/weekly/monthly) مع النص - ?day=YYYY-MM-DD لتقرير يوم سابق"""
+    try:
+        day = request.args.get('day')
+        day = date.fromisoformat(day) if day else None
+        report = get_report_engine().build(period, day)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    return jsonify({
+        'status': 'success',
+        'data': report,
+        'report': render_report(report)
+    })
+
 # API لإرسال تقرير واتساب
 @app.route('/api/whatsapp/send-report', methods=['POST'])
 @login_required
@@ -346,18 +514,24 @@ def send_whatsapp_report():
     report_type = data.get('type', 'daily')
     
     try:
-        manager = ResponseManager()
-        reporter = WhatsAppReporter(manager)
+        manager = get_response_manager()
+        reporter = WhatsAppReporter(manager, on_queued=queue_outbox)
         
-        if report_type == 'daily':
-            success = reporter.send_daily_report(phone)
+        if report_type in ('daily', 'weekly', 'monthly'):
+            report_id = reporter.send_report(phone, report_type)
         elif report_type == 'agent':
             agent_data = data.get('agent_data', {})
-            success = reporter.send_agent_performance_report(phone, agent_data)
+            report_id = reporter.send_agent_performance_report(phone, agent_data)
+        elif report_type == 'agents':
+            # تقرير أداء لكل المناديب النشطين دفعة واحدة
+            report_id = reporter.send_agent_reports(data.get('period', 'daily'))
+        else:
+            report_id = None
         
         return jsonify({
-            'status': 'success' if success else 'error',
-            'message': 'تم إرسال التقرير بنجاح' if success else 'فشل إرسال التقرير'
+            'status': 'success' if report_id else 'error',
+            'message': 'تم إضافة التقرير لقائمة الإرسال' if report_id else 'فشل إرسال التقرير',
+            'report_id': report_id
         })
     except Exception as e:
         return jsonify({
@@ -365,53 +539,105 @@ def send_whatsapp_report():
             'message': str(e)
         })
 
+@app.route('/api/whatsapp/reports/<int:report_id>')
+@login_required
+def whatsapp_report_status(report_id):
+    """حالة تسليم تقرير: عدد الرسائل المرسلة/الفاشلة/المعلقة"""
+    status = get_delivery_status(report_id)
+    if status is None:
+        return jsonify({'status': 'error', 'message': 'Report not found'}), 404
+    return jsonify({'status': 'success', 'report': status})
+
+# Webhook لواتساب - تحديثات حالة التسليم للرسائل الصادرة
+@app.route('/webhook/whatsapp', methods=['GET', 'POST'])
+def whatsapp_webhook():
+    if request.method == 'GET':
+        if get_webhook_guard().check_verify_token('whatsapp', request.args.get('hub.verify_token')):
+            return request.args.get('hub.challenge')
+        return 'Invalid verify token', 403
+    
+    data, rejected = read_webhook('whatsapp')
+    if rejected:
+        return rejected
+    statuses = []
+    for entry in data.get('entry', []):
+        for change in entry.get('changes', []):
+            statuses.extend(change.get('value', {}).get('statuses', []))
+    if statuses:
+        record_statuses(statuses)
+    return 'OK'
+
 # API لربط Shopify
 @app.route('/api/shopify/connect', methods=['POST'])
 @login_required
 def connect_shopify():
-    """ربط متجر Shopify"""
+    """ربط متجر Shopify - التحقق من البيانات ثم المزامنة في الخلفية"""
     data = request.json
     store_url = data.get('store_url')
     api_key = data.get('api_key')
     
     try:
-        shopify = ShopifyIntegration(store_url)
-        products = shopify.fetch_products(api_key)
+        products_count = ShopifyClient(store_url, api_key).count_products()
         
-        if products:
-            # تحديث ذاكرة المنتجات
-            manager = ResponseManager()
-            manager.update_shopify_memory(products)
-            
-            return jsonify({
-                'status': 'success',
-                'message': f'تم ربط {len(products)} منتج من Shopify',
-                'products_count': len(products)
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'فشل جلب المنتجات من Shopify'
-            })
+        save_service_token('shopify', api_key)
+        save_service_config('shopify', {'store_url': store_url})
+        update_service_status('shopify', True)
+        job_queue.enqueue('shopify_sync', {'full': True})
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'تم ربط المتجر - جاري مزامنة {products_count} منتج في الخلفية',
+            'products_count': products_count
+        })
+    except ShopifySyncError as e:
+        add_log('error', f'Shopify connect failed: {str(e)}', 'shopify')
+        return jsonify({
+            'status': 'error',
+            'message': 'فشل الاتصال بـ Shopify'
+        })
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         })
 
+@app.route('/api/comments/process-pending', methods=['POST'])
+@login_required
+def process_pending_comments():
+    data = request.json or {}
+    try:
+        job_id = job_queue.enqueue('comment_backlog', {'limit': data.get('limit')})
+    except QueueFull:
+        return jsonify({'status': 'error', 'message': 'طابور المهام ممتلئ، حاول لاحقاً'})
+    
+    return jsonify({'status': 'success', 'job_id': job_id})
+
 # واجهة الموبايل للمناديب
-@app.route('/agent')
+@app.route('/agent', methods=['GET', 'POST'])
 def agent_login():
+    if request.method == 'POST':
+        agent_id = (request.form.get('agent_id') or '').strip()
+        password = request.form.get('password') or ''
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT password FROM agents WHERE agent_id = ? AND status = 1', (agent_id,))
+        row = cursor.fetchone()
+        if row and row[0] and hmac.compare_digest(row[0].encode('utf-8'), password.encode('utf-8')):
+            session['agent_id'] = agent_id
+            return redirect(url_for('agent_dashboard'))
+        flash('بيانات الدخول غير صحيحة', 'error')
     return render_template('agent_login.html')
 
+@app.route('/agent/logout')
+def agent_logout():
+    session.pop('agent_id', None)
+    return redirect(url_for('agent_login'))
+
 @app.route('/agent/dashboard')
+@agent_required
 def agent_dashboard():
-    agent_id = request.args.get('agent_id')
-    if not agent_id:
-        return redirect(url_for('agent_login'))
+    agent_id = session['agent_id']
     
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     
     # جلب الطلبات المسندة للمندوب
     cursor.execute('''
@@ -425,10 +651,63 @@ def agent_dashboard():
     cursor.execute('SELECT * FROM agents WHERE agent_id = ?', (agent_id,))
     agent = cursor.fetchone()
     
-    conn.close()
-    
     return render_template('agent_dashboard.html', orders=orders, agent=agent)
 
+# انتقالات الطلب المسموحة للمندوب: الإجراء -> (الحالات الحالية المقبولة، الحالة الجديدة)
+AGENT_TRANSITIONS = {
+    'accept': (('new', 'assigned'), 'assigned'),
+    'start': (('assigned',), 'in_progress'),
+    'complete': (('in_progress',), 'completed')
+}
+
+@app.route('/agent/orders/<action>', methods=['POST'])
+@agent_required
+def agent_order_action(action):
+    if action not in AGENT_TRANSITIONS:
+        return jsonify({'status': 'error', 'message': 'إجراء غير معروف'}), 404
+    data = request.json or {}
+    order_id = data.get('order_id')
+    agent_id = session['agent_id']
+    if not order_id:
+        return jsonify({'status': 'error', 'message': 'order_id مطلوب'}), 400
+    from_statuses, status = AGENT_TRANSITIONS[action]
+    
+    # قبول طلب جديد غير مسند يسنده للمندوب، وباقي الإجراءات على طلباته فقط
+    if action == 'accept':
+        result = update_order(order_id, status, agent_id=agent_id, expected_statuses=from_statuses,
+                              expected_agents=(None, agent_id))
+    else:
+        result = update_order(order_id, status, expected_statuses=from_statuses, expected_agents=(agent_id,))
+    if result is None:
+        return jsonify({'status': 'error', 'message': 'لا يمكن تنفيذ الإجراء على هذا الطلب'})
+    on_order_change(*result)
+    
+    add_log('info', f'Agent {agent_id}: order {order_id} -> {status}', 'orders')
+    return jsonify({'status': 'success'})
+
+@app.route('/agent/events')
+@agent_required
+def agent_events():
+    """بث SSE لطلبات المندوب - المتصفح يرسل Last-Event-ID تلقائياً عند إعادة الاتصال"""
+    agent_id = session['agent_id']
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = broker.subscribe(agent_topic(agent_id), last_event_id)
+    return Response(stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def read_webhook(service):
+    """جسم الطلب الخام يُقرأ مرة واحدة ويُتحقق من توقيعه قبل تحليله - ترجع (الحمولة، رد الرفض)"""
+    try:
+        payload = get_webhook_guard().authenticate(
+            service, request.content_length, request.headers.get('X-Hub-Signature-256'),
+            lambda: request.get_data(cache=False)
+        )
+    except WebhookRejected as e:
+        return None, (e.reason, e.status)
+    return payload, None
+
 # Webhook لفيسبوك
 @app.route('/webhook/facebook', methods=['GET', 'POST'])
 def facebook_webhook():
@@ -437,40 +716,60 @@ def facebook_webhook():
         verify_token = request.args.get('hub.verify_token')
         challenge = request.args.get('hub.challenge')
         
-        if verify_token == 'your-verify-token':
+        if get_webhook_guard().check_verify_token('facebook', verify_token):
             return challenge
-        return 'Invalid verify token'
+        return 'Invalid verify token', 403
     
     elif request.method == 'POST':
-        # معالجة الأحداث الواردة
-        data = request.json
+        # الطلبات المزيفة تُرفض هنا قبل أي عمل على قاعدة البيانات
+        payload, rejected = read_webhook('facebook')
+        if rejected:
+            return rejected
+        
+        # الحمولة كاملة تُحفظ في معاملة واحدة ثم تضاف مهام الرد للعناصر الجديدة فقط
+        comment_jobs, message_jobs, events = ingest(payload)
         
-        if data.get('object') == 'page':
-            for entry in data.get('entry', []):
-                for event in entry.get('changes', []):
-                    if event.get('field') == 'feed':
-                        # معالجة تعليق جديد
-                        comment_data = {
-                            'comment_id': event.get('value', {}).get('comment_id'),
-                            'post_id': event.get('value', {}).get('post_id'),
-                            'user_name': event.get('value', {}).get('from', {}).get('name'),
-                            'message': event.get('value', {}).get('message'),
-                            'page_id': entry.get('id')
-                        }
-                        
-                        if get_service_status('facebook'):
-                            # معالجة الرد التلقائي في خيط منفصل
-                            from threading import Thread
-                            thread = Thread(target=process_auto_reply, args=(comment_data,))
-                            thread.start()
+        if get_service_status('facebook'):
+            comment_jobs, message_jobs = shed_throttled(comment_jobs, message_jobs)
+            try:
+                job_queue.enqueue_many('facebook_comment', ((job, job['comment_id']) for job in comment_jobs))
+                job_queue.enqueue_many('facebook_message', ((job, job['message_id']) for job in message_jobs))
+            except QueueFull:
+                # الأحداث محفوظة بحالة pending - فيسبوك يعيد الإرسال بعد 503 فتُضاف مهامها حينها
+                add_log('warning', f'Webhook rejected: job queue is full ({events} events stored as pending)',
+                        'facebook')
+                return 'Busy', 503
         
         return 'OK'
 
+def shed_throttled(comment_jobs, message_jobs):
+    """إسقاط الأحداث التي تجاوزت حد العميل أو الصفحة قبل إضافتها للطابور (قبل أي استدعاء للذكاء الاصطناعي)"""
+    jobs = comment_jobs + message_jobs
+    if not jobs:
+        return comment_jobs, message_jobs
+    allowed, throttled = [], []
+    for job, (ok, scope, retry_after) in zip(jobs, get_rate_limiter().allow_many([event_keys(job) for job in jobs])):
+        (allowed if ok else throttled).append(job)
+    if not throttled:
+        return comment_jobs, message_jobs
+    
+    mark_throttled([job['comment_id'] for job in throttled if 'comment_id' in job],
+                   [job['message_id'] for job in throttled if 'message_id' in job])
+    return ([job for job in allowed if 'comment_id' in job],
+            [job for job in allowed if 'message_id' in job])
+
 def process_auto_reply(comment_data):
     try:
-        manager = ResponseManager()
+        manager = get_response_manager()
         reply = manager.process_comment(comment_data)
         
+        # التعليق محفوظ من مرحلة الإدخال - تسجيل الرد حتى لا يعالجه معالج التعليقات المعلقة مجدداً
+        with transaction() as cursor:
+            cursor.execute('''
+                UPDATE comments SET reply_text = ?, status = 'replied', replied_at = ?
+                WHERE comment_id = ? AND status = 'pending'
+            ''', (reply, format_timestamp(), comment_data.get('comment_id')))
+        
         # إرسال الرد عبر Facebook API
         access_token = get_service_token('facebook')
         if access_token:
@@ -479,6 +778,136 @@ def process_auto_reply(comment_data):
             
     except Exception as e:
         add_log('error', f'Auto reply failed: {str(e)}', 'facebook')
+        raise
+
+def process_message_reply(message_data):
+    """الرد على رسالة ماسنجر وحفظ الرد في inbox"""
+    reply = get_response_manager().process_message(message_data)
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE inbox SET reply_text = ?, status = 'replied', replied_at = ?
+            WHERE message_id = ? AND status = 'pending'
+        ''', (reply, format_timestamp(), message_data['message_id']))
+    
+    # إرسال الرد عبر Send API (مبسط مثل ردود التعليقات)
+    access_token = get_service_token('facebook')
+    if access_token:
+        pass
+
+def process_comment_backlog(payload):
+    processor = CommentBatchProcessor(get_response_manager())
+    stats = processor.run(limit=payload.get('limit'))
+    add_log('info', f"Comment backlog processed: {stats['processed']} comments in {stats['groups']} groups", 'facebook')
+
+def process_shopify_sync(payload):
+    stats = sync_catalog(full=payload.get('full', False))
+    if stats is not None:
+        get_response_manager().update_shopify_memory()
+        get_product_index().refresh(force=True)
+
+def process_sheets_sync(payload):
+    """مزامنة الطلبات مع Google Sheets - تعديلات الحالة/المندوب القادمة من الجدول تمر بنفس مسار التعديل اليدوي"""
+    if not get_service_status('googlesheet'):
+        return
+    result = sync_orders(full=payload.get('full', False))
+    if result is None:
+        return
+    stats, changes = result
+    for before, after in changes:
+        on_order_change(before, after)
+
+def process_health_check(payload):
+    results = run_checks()
+    failed = [service for service, (status, *rest) in results.items() if status == 'error']
+    if failed:
+        add_log('warning', f"Health check failed for: {', '.join(failed)}", 'health')
+
+def process_scheduled_report(payload):
+    """التقارير المجدولة تغطي آخر يوم مكتمل (تقرير الشهر يوم 1 = الشهر السابق كاملاً)"""
+    phone = get_service_config('whatsapp').get('report_phone') or REPORT_PHONE
+    if not phone:
+        add_log('warning', f"Scheduled {payload['period']} report skipped: no report phone", 'scheduler')
+        return
+    day = date.fromtimestamp(payload['scheduled_for']) - timedelta(days=1)
+    WhatsAppReporter(get_response_manager(), on_queued=queue_outbox).send_report(phone, payload['period'], day)
+
+def queue_outbox(report_id=None, delay=0):
+    """مهمة إرسال لصندوق واتساب - مهمة معلقة واحدة تكفي لكل التقارير"""
+    try:
+        job_queue.enqueue('outbox_send', {}, dedup_key=f'due:{int(time.time() + delay)}', delay=delay)
+    except QueueFull:
+        # الرسائل محفوظة في outbox - أي تشغيل لاحق سيرسلها
+        add_log('warning', 'Outbox send job not queued: job queue is full', 'whatsapp')
+
+def process_outbox(payload):
+    sender = get_outbox_sender()
+    if sender is None:
+        add_log('warning', 'Outbox not sent: WhatsApp is not configured (token / phone_number_id)', 'whatsapp')
+        return
+    stats, next_attempt = sender.drain()
+    add_log('info', f"Outbox: {stats['sent']} sent, {stats['retry']} retrying, {stats['failed']} failed", 'whatsapp')
+    if next_attempt is not None:
+        queue_outbox(delay=max(0, next_attempt - time.time()))
+
+def process_log_retention(payload):
+    deleted = prune_logs()
+    job_queue.purge_finished()
+    purge_rate_limits()
+    purge_events()
+    add_log('info', f'Log retention removed {deleted} log rows', 'scheduler')
+
+def process_stats_rebuild(payload):
+    """تصحيح أي انحراف في العدادات (آخر أسبوع فقط - ما قبله لا يتغير)"""
+    since_day = (date.today() - timedelta(days=STATS_REBUILD_DAYS)).isoformat()
+    with transaction(immediate=True) as cursor:
+        rebuild_stats(cursor, since_day)
+    get_report_engine().invalidate()
+
+# طابور الردود التلقائية وعماله
+job_queue = JobQueue()
+worker_pool = WorkerPool(
+    job_queue,
+    handlers={
+        'facebook_comment': process_auto_reply,
+        'facebook_message': process_message_reply,
+        'comment_backlog': process_comment_backlog,
+        'shopify_sync': process_shopify_sync,
+        'sheets_sync': process_sheets_sync,
+        'health_check': process_health_check,
+        'scheduled_report': process_scheduled_report,
+        'log_retention': process_log_retention,
+        'stats_rebuild': process_stats_rebuild,
+        'outbox_send': process_outbox
+    },
+    size=int(os.environ.get('AUTO_REPLY_WORKERS', 4))
+)
+
+# المهام الدورية - كل العمليات تسجلها لكن صاحب القفل فقط يضيفها للطابور
+scheduler = Scheduler(job_queue)
+for period, spec in REPORT_SCHEDULE.items():
+    # تقرير فاته موعده بأكثر من SCHEDULER_MISFIRE_GRACE لا يُرسل متأخراً
+    scheduler.add(f'report_{period}', spec, 'scheduled_report', {'period': period}, catch_up=False)
+if SHOPIFY_SYNC_INTERVAL:
+    scheduler.add('shopify_sync', f'every {int(SHOPIFY_SYNC_INTERVAL)}')
+if SHEETS_SYNC_INTERVAL:
+    scheduler.add('sheets_sync', f'every {int(SHEETS_SYNC_INTERVAL)}')
+if HEALTH_CHECK_INTERVAL:
+    scheduler.add('health_check', f'every {int(HEALTH_CHECK_INTERVAL)}')
+scheduler.add('log_retention', f'every {int(LOG_RETENTION_INTERVAL)}')
+scheduler.add('stats_rebuild', STATS_REBUILD_AT)
+
+def start_workers():
+    worker_pool.start()
+    scheduler.start()
+    # بناء فهرس المنتجات وتحديثه في الخلفية حتى لا يدفع أي عميل ثمنه
+    get_product_index().start()
+    atexit.register(scheduler.stop)
+    atexit.register(worker_pool.stop, drain=True,
+                    timeout=float(os.environ.get('WORKER_DRAIN_TIMEOUT', 30)))
+
+# serve.py يستورد التطبيق بدون العمال ثم يشغلهم حسب دور العملية (web / worker / all)
+if os.environ.get('APP_START_WORKERS', '1') == '1':
+    start_workers()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
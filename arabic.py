@@ -0,0 +1,56 @@
+"""
+أدوات توحيد النص العربي
+إزالة التشكيل والتطويل وتوحيد أشكال الألف والياء والتاء المربوطة
+"""
+
+import os
+import re
+from functools import lru_cache
+
+_DIACRITIC_RANGES = ((0x0610, 0x061A), (0x064B, 0x065F), (0x0670, 0x0670), (0x06D6, 0x06ED))
+_PUNCTUATION = re.compile(r'[^\w\s]|_')
+# الحروف العربية فقط - تكرار الأرقام له معنى (1000 ليست 10)
+_REPEATED = re.compile(r'([\u0621-\u064A])\1{2,}')
+_SPACES = re.compile(r'\s+')
+
+_LETTER_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    '٠': '0', '١': '1', '٢': '2', '٣': '3', '٤': '4',
+    '٥': '5', '٦': '6', '٧': '7', '٨': '8', '٩': '9',
+})
+# حذف التشكيل والتطويل في نفس مرور translate بدلاً من تعبيرين منتظمين
+_LETTER_MAP.update({code: None for first, last in _DIACRITIC_RANGES for code in range(first, last + 1)})
+_LETTER_MAP[0x0640] = None
+
+# الرسالة الواحدة تُوحد في عدة مراحل (التصنيف، بحث المنتجات، مفتاح كاش الردود) - تُحسب مرة لآخر الرسائل
+MESSAGE_CACHE_SIZE = int(os.environ.get('MESSAGE_CACHE_SIZE', 8192))
+
+
+def normalize_arabic(text):
+    """توحيد النص: "بكاااام؟" و "بِكَام" تصبح "بكام\""""
+    if not text:
+        return ''
+    text = _PUNCTUATION.sub(' ', text.casefold().translate(_LETTER_MAP))
+    return ' '.join(_REPEATED.sub(r'\1', text).split())
+
+
+def normalize_whitespace(text):
+    """توحيد بسيط (المسافات وحالة الأحرف فقط) للمطابقة الحرفية"""
+    return _SPACES.sub(' ', (text or '').casefold()).strip()
+
+
+def tokenize(text):
+    return normalize_arabic(text).split()
+
+
+@lru_cache(maxsize=MESSAGE_CACHE_SIZE)
+def normalize_message(text):
+    """normalize_arabic مع ذاكرة للرسائل الواردة - النصوص الطويلة (أوصاف المنتجات) تستخدم normalize_arabic"""
+    return normalize_arabic(text)
+
+
+@lru_cache(maxsize=MESSAGE_CACHE_SIZE)
+def message_tokens(text):
+    """كلمات الرسالة الموحدة كـ tuple (لا تُعدل لأنها مشتركة)"""
+    return tuple(normalize_message(text).split())
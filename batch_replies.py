@@ -0,0 +1,121 @@
+"""
+معالجة دفعات التعليقات المعلقة (بعد انقطاع الخدمة أو ربط صفحة جديدة)
+"""
+
+import os
+import json
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from dbpool import get_connection, transaction
+from arabic import normalize_message
+from response_cache import PERSONAL_VARIABLES
+
+BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', 200))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
+
+
+def _in_clause(values):
+    return ','.join('?' * len(values))
+
+
+class CommentBatchProcessor:
+    """الرد على التعليقات المعلقة على دفعات مع دمج الأسئلة المتطابقة"""
+
+    def __init__(self, manager, chunk_size=BATCH_CHUNK_SIZE, concurrency=BATCH_CONCURRENCY):
+        self.manager = manager
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+
+    def run(self, limit=None):
+        """معالجة كل التعليقات المعلقة (أو أول limit منها) - ترجع إحصائيات التشغيل"""
+        stats = {'processed': 0, 'groups': 0, 'chunks': 0}
+        last_id = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='batch-reply') as executor:
+            while limit is None or stats['processed'] < limit:
+                size = self.chunk_size if limit is None else min(self.chunk_size, limit - stats['processed'])
+                rows = self._load_chunk(last_id, size)
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+
+                groups = self._process_chunk(rows, executor)
+                stats['processed'] += len(rows)
+                stats['groups'] += groups
+                stats['chunks'] += 1
+
+        return stats
+
+    def _load_chunk(self, after_id, size):
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT id, comment_id, post_id, user_id, user_name, message
+            FROM comments
+            WHERE status = 'pending' AND id > ?
+            ORDER BY id LIMIT ?
+        ''', (after_id, size))
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _prefetch(self, rows):
+        """جلب قوالب المنشورات وأسماء الصفحات للدفعة كلها باستعلام واحد لكل جدول"""
+        cursor = get_connection().cursor()
+
+        post_ids = sorted({row['post_id'] for row in rows if row['post_id']})
+        posts = {}
+        if post_ids:
+            cursor.execute(f'''
+                SELECT post_id, page_id, auto_reply FROM posts
+                WHERE post_id IN ({_in_clause(post_ids)})
+            ''', post_ids)
+            posts = {post_id: (page_id, auto_reply or '') for post_id, page_id, auto_reply in cursor.fetchall()}
+
+        page_ids = sorted({page_id for page_id, _ in posts.values() if page_id})
+        pages = {}
+        if page_ids:
+            cursor.execute(f'''
+                SELECT page_id, page_name, welcome_message FROM pages
+                WHERE page_id IN ({_in_clause(page_ids)})
+            ''', page_ids)
+            pages = {page_id: (page_name, welcome) for page_id, page_name, welcome in cursor.fetchall()}
+
+        return posts, pages
+
+    def _process_chunk(self, rows, executor):
+        posts, pages = self._prefetch(rows)
+
+        # تجميع التعليقات التي تنتج نفس الطلب للنموذج (نفس المنشور والسياق والرسالة)
+        groups = {}
+        for row in rows:
+            page_id, reply_template = posts.get(row['post_id'], (None, ''))
+            page_name = pages.get(page_id, ('الصفحة', None))[0] or 'الصفحة'
+            comment_data = dict(row, page_id=page_id)
+            message, context, variables = self.manager.build_comment_prompt(
+                comment_data, reply_template=reply_template, page_name=page_name
+            )
+            shared_variables = {k: v for k, v in variables.items() if k not in PERSONAL_VARIABLES}
+            key = (
+                row['post_id'], context, normalize_message(message),
+                json.dumps(shared_variables, ensure_ascii=False, sort_keys=True, default=str)
+            )
+            groups.setdefault(key, []).append((row['id'], message, context, variables))
+
+        # أول تعليق في كل مجموعة يستدعي النموذج والباقي يأتي من ذاكرة الردود
+        results = []
+        for replies in executor.map(self._reply_group, groups.values()):
+            results.extend(replies)
+
+        replied_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with transaction() as cursor:
+            cursor.executemany('''
+                UPDATE comments SET reply_text = ?, status = 'replied', replied_at = ?
+                WHERE id = ? AND status = 'pending'
+            ''', [(reply, replied_at, row_id) for row_id, reply in results])
+
+        return len(groups)
+
+    def _reply_group(self, members):
+        return [
+            (row_id, self.manager.ai.generate_response(message, context, variables))
+            for row_id, message, context, variables in members
+        ]
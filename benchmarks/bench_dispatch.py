@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+قياس زمن الإسناد التلقائي لعدد كبير من الطلبات الجديدة لكل استراتيجية
+
+    python benchmarks/bench_dispatch.py --orders 10000 --agents 50
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dbpool
+import db
+
+CITIES = ['القاهرة', 'الجيزة', 'الإسكندرية', 'المنصورة', 'أسيوط', 'طنطا']
+ZONES = ['القاهرة', 'الجيزة', 'الإسكندرية', 'باقي المحافظات']
+
+
+def populate(orders, agents):
+    start = datetime.now() - timedelta(days=1)
+    with dbpool.transaction() as cursor:
+        cursor.execute("DELETE FROM orders")
+        cursor.execute("DELETE FROM agents")
+        cursor.executemany(
+            'INSERT INTO agents (agent_id, name, status, zone) VALUES (?, ?, 1, ?)',
+            ((f'agent_{i}', f'مندوب {i}', ZONES[i % len(ZONES)]) for i in range(agents))
+        )
+        cursor.executemany(
+            'INSERT INTO orders (order_id, customer_name, product, quantity, status, city, created_at) VALUES (?, ?, ?, 1, ?, ?, ?)',
+            ((f'o{i}', 'عميل', 'منتج', 'new', CITIES[i % len(CITIES)],
+              (start + timedelta(seconds=i)).strftime(db.TIMESTAMP_FORMAT)) for i in range(orders))
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--agents', type=int, default=50)
+    args = parser.parse_args()
+
+    # الحد الأقصى للمندوب يجب أن يستوعب كل الطلبات حتى نقيس الإسناد الكامل
+    os.environ.setdefault('DISPATCH_MAX_OPEN', str(args.orders))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dbpool.configure(os.path.join(tmp, 'bench.db'))
+        db.init_database()
+
+        from dispatch import Dispatcher
+
+        print(f'{"strategy":<16}{"assigned":>10}{"seconds":>10}{"orders/s":>12}{"max load":>10}{"min load":>10}')
+        for strategy in ('least_loaded', 'round_robin', 'zone'):
+            populate(args.orders, args.agents)
+            dispatcher = Dispatcher(ZONES)
+
+            started = time.perf_counter()
+            stats, _ = dispatcher.dispatch(strategy=strategy)
+            elapsed = time.perf_counter() - started
+
+            loads = dispatcher.tracker.snapshot()[0].values()
+            print(f'{strategy:<16}{stats["assigned"]:>10}{elapsed:>10.3f}{stats["assigned"] / elapsed:>12,.0f}'
+                  f'{max(loads):>10}{min(loads):>10}')
+
+        dbpool.close_all()
+
+
+if __name__ == '__main__':
+    main()
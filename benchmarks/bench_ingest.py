@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+قياس مسار إدخال Webhook (أحداث/ثانية): الحمولة كاملة بـ executemany مقابل حفظ كل حدث في معاملة مستقلة
+
+    python benchmarks/bench_ingest.py --payloads 200 --entries 10 --events 10
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dbpool
+import db
+
+PAGES = [f'page_{i}' for i in range(5)]
+
+
+def make_payload(index, entries, events, users):
+    """حمولة صفحة: نصفها تعليقات feed ونصفها رسائل ماسنجر"""
+    now = int(time.time())
+    payload = {'object': 'page', 'entry': []}
+    for e in range(entries):
+        page_id = random.choice(PAGES)
+        changes, messaging = [], []
+        for n in range(events):
+            key = f'{index}_{e}_{n}'
+            user = f'user_{random.randrange(users)}'
+            if n % 2:
+                messaging.append({
+                    'sender': {'id': user}, 'recipient': {'id': page_id}, 'timestamp': now * 1000 + n,
+                    'message': {'mid': f'm_{key}', 'text': 'بكام الفستان ده؟'}
+                })
+            else:
+                changes.append({'field': 'feed', 'value': {
+                    'item': 'comment', 'verb': 'add', 'comment_id': f'c_{key}',
+                    'post_id': f'{page_id}_post_{random.randrange(50)}',
+                    'from': {'id': user, 'name': 'عميل'}, 'message': 'متاح مقاس لارج؟', 'created_time': now
+                }})
+        payload['entry'].append({'id': page_id, 'time': now, 'changes': changes, 'messaging': messaging})
+    return payload
+
+
+def legacy(payload):
+    """حفظ كل حدث في معاملة مستقلة (الطريقة المعتادة لكل حدث على حدة)"""
+    for entry in payload['entry']:
+        for change in entry['changes']:
+            value = change['value']
+            with dbpool.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO comments (comment_id, post_id, user_id, user_name, message, created_time)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (value['comment_id'], value['post_id'], value['from']['id'], value['from']['name'],
+                      value['message'], db.format_timestamp(value['created_time'])))
+        for event in entry['messaging']:
+            created_time = db.format_timestamp(event['timestamp'])
+            with dbpool.transaction() as cursor:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO inbox (message_id, user_id, page_id, message, created_time)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (event['message']['mid'], event['sender']['id'], entry['id'], event['message']['text'],
+                      created_time))
+                cursor.execute('''
+                    INSERT INTO conversations (user_id, page_id, first_seen, last_seen, message_count, last_message)
+                    VALUES (?, ?, ?, ?, 1, ?)
+                    ON CONFLICT (user_id, page_id) DO UPDATE SET
+                        last_seen = MAX(last_seen, excluded.last_seen), message_count = message_count + 1,
+                        last_message = excluded.last_message
+                ''', (event['sender']['id'], entry['id'], created_time, created_time, event['message']['text']))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payloads', type=int, default=200)
+    parser.add_argument('--entries', type=int, default=10)
+    parser.add_argument('--events', type=int, default=10)
+    parser.add_argument('--users', type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(7)
+    payloads = [make_payload(i, args.entries, args.events, args.users) for i in range(args.payloads)]
+    total = args.payloads * args.entries * args.events
+
+    with tempfile.TemporaryDirectory() as tmp:
+        from ingest import ingest
+        from jobqueue import JobQueue
+
+        for name in ('per-event', 'bulk', 'bulk+enqueue', 'bulk (replay)'):
+            if name != 'bulk (replay)':
+                dbpool.configure(os.path.join(tmp, f'{name}.db'))
+                db.init_database()
+            queue = JobQueue(max_pending=0)
+
+            started = time.perf_counter()
+            queued = 0
+            for payload in payloads:
+                if name == 'per-event':
+                    legacy(payload)
+                    continue
+                comment_jobs, message_jobs, _ = ingest(payload)
+                if name != 'bulk':
+                    queued += queue.enqueue_many('facebook_comment', ((j, j['comment_id']) for j in comment_jobs))
+                    queued += queue.enqueue_many('facebook_message', ((j, j['message_id']) for j in message_jobs))
+            elapsed = time.perf_counter() - started
+
+            cursor = dbpool.get_connection().cursor()
+            cursor.execute('SELECT (SELECT COUNT(*) FROM comments), (SELECT COUNT(*) FROM inbox)')
+            comments, messages = cursor.fetchone()
+            print(f'{name:<14} {total} events in {elapsed:.2f}s = {total / elapsed:>9,.0f} events/s '
+                  f'(comments={comments} inbox={messages} jobs queued={queued})')
+
+        dbpool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+مقارنة سرعة ودقة تصنيف النوايا: المسح الخطي القديم مقابل المصنف المجمّع
+
+    python benchmarks/bench_intents.py --messages 200000
+
+مسار الرد يوحد الرسالة في ثلاث مراحل (التصنيف، بحث المنتجات، مفتاح كاش الردود):
+"reply pipeline" يقارن توحيدها في كل مرحلة بالتوحيد مرة واحدة المشترك (normalize_message)
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from arabic import normalize_arabic, normalize_message, message_tokens
+from intents import get_intent_classifier
+
+SAMPLES = [
+    ('بكام القطعة دي؟', 'price'),
+    ('كم سعر الفستان الأحمر', 'price'),
+    ('السعر لو سمحت', 'price'),
+    ('بالسعر ده ينفع ناخد اتنين؟', 'price'),
+    ('المقاس ده متاح؟', 'availability'),
+    ('عندكم اللون الأسود؟', 'availability'),
+    ('متوفرة مقاسات كبيرة؟', 'availability'),
+    ('التوصيل للإسكندرية بكام يوم', 'shipping'),
+    ('مصاريف الشحن كام', 'shipping'),
+    ('الطلب هيوصل امتى', 'shipping'),
+    ('عايز أعرف تفاصيل المنتج', 'product'),
+    ('مساء الخير', 'general'),
+    ('حلو جدا تسلم ايدكم', 'general'),
+    ('كمان واحد من فضلك', 'general'),
+    ('شكرا على الرد السريع', 'general'),
+]
+
+
+def legacy_analyze(message):
+    """نسخة من ResponseManager._analyze_inquiry قبل المصنف المجمّع"""
+    message_lower = message.lower()
+    if any(word in message_lower for word in ['سعر', 'كم', 'بكام', 'السعر']):
+        return 'price'
+    elif any(word in message_lower for word in ['متاح', 'فيه', 'عندك', 'عندكم']):
+        return 'availability'
+    elif any(word in message_lower for word in ['توصيل', 'شحن', 'وصل', 'متى']):
+        return 'shipping'
+    elif any(word in message_lower for word in ['منتج', 'قطعة', 'حاجة', ' item']):
+        return 'product'
+    return 'general'
+
+
+def legacy_pipeline(message):
+    """كل مرحلة توحد الرسالة بنفسها + المسح الخطي للتصنيف"""
+    return legacy_analyze(message), normalize_arabic(message).split(), normalize_arabic(message)
+
+
+def throughput(label, func, messages):
+    started = time.perf_counter()
+    result = func(messages)
+    elapsed = time.perf_counter() - started
+    print(f'{label:<34}{len(messages) / elapsed:>14,.0f} msg/s')
+    return result
+
+
+def accuracy(classify):
+    return sum(classify(text) == expected for text, expected in SAMPLES) / len(SAMPLES) * 100
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=200000)
+    args = parser.parse_args()
+
+    classifier = get_intent_classifier()
+    # إضافة لاحقة رقمية حتى لا تكون كل الرسائل متطابقة بعد التوحيد
+    messages = [f'{random.choice(SAMPLES)[0]} {i % 5000}' for i in range(args.messages)]
+
+    throughput('legacy any() scans', lambda items: [legacy_analyze(m) for m in items], messages)
+    throughput('compiled classify()', lambda items: [classifier.classify(m) for m in items], messages)
+    throughput('compiled classify_many()', classifier.classify_many, messages)
+
+    # الرسائل الحقيقية تتكرر ("بكام؟"، "متاح؟") - مجموعة صغيرة تتكرر عبر الحجم كله
+    repeated = [random.choice(messages[:500]) for _ in range(args.messages)]
+    throughput('classify() repeated traffic', lambda items: [classifier.classify(m) for m in items], repeated)
+
+    pipeline = lambda message: (classifier.classify(message), message_tokens(message), normalize_message(message))
+    normalize_message.cache_clear()
+    message_tokens.cache_clear()
+    throughput('reply pipeline: per stage', lambda items: [legacy_pipeline(m) for m in items], messages)
+    throughput('reply pipeline: shared', lambda items: [pipeline(m) for m in items], messages)
+
+    print(f'\naccuracy on labelled samples: legacy {accuracy(legacy_analyze):.0f}% / '
+          f'compiled {accuracy(classifier.classify):.0f}%')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+قياس زمن إرسال صندوق واتساب مقابل خادم Cloud API وهمي محلي
+(زمن استجابة ثابت + نسبة من ردود 429 لاختبار إعادة المحاولة)
+
+    python benchmarks/bench_outbox.py --messages 500 --latency 0.1 --throttle 0.02
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dbpool
+import db
+
+
+def make_handler(latency, throttle):
+    counter = {'requests': 0, 'throttled': 0}
+    lock = threading.Lock()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time.sleep(latency)
+            with lock:
+                counter['requests'] += 1
+                throttled = random.random() < throttle
+                counter['throttled'] += throttled
+            if throttled:
+                payload = {'error': {'code': 130429, 'message': 'Rate limit hit'}}
+                self.send_response(429)
+            else:
+                payload = {'messages': [{'id': f"wamid.{body['to']}.{counter['requests']}"}]}
+                self.send_response(200)
+            data = json.dumps(payload).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler, counter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--throttle', type=float, default=0.02)
+    parser.add_argument('--rate', type=float, default=80)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    handler, counter = make_handler(args.latency, args.throttle)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dbpool.configure(os.path.join(tmp, 'bench.db'))
+        db.init_database()
+
+        import outbox
+        report_id = outbox.queue_messages('agent', 'bench', [
+            (f'2010{i:07d}', f'تقرير المندوب {i}') for i in range(args.messages)
+        ])
+        sender = outbox.OutboxSender(
+            outbox.WhatsAppClient('123', 'token', base_url=base_url, pool_size=args.workers),
+            bucket=outbox.TokenBucket(args.rate, int(args.rate)),
+            workers=args.workers, daily_limit=0
+        )
+
+        started = time.perf_counter()
+        totals = {'sent': 0, 'retry': 0, 'failed': 0}
+        while True:
+            stats, next_attempt = sender.drain(report_id)
+            for key in totals:
+                totals[key] += stats[key]
+            if next_attempt is None:
+                break
+            # تجاوز مهلة إعادة المحاولة في القياس
+            with dbpool.transaction() as cursor:
+                cursor.execute("UPDATE outbox SET next_attempt_at = 0 WHERE status = 'pending'")
+        elapsed = time.perf_counter() - started
+
+        delivery = outbox.get_delivery_status(report_id)
+        print(f"messages={args.messages} latency={args.latency}s rate={args.rate}/s workers={args.workers}")
+        print(f"sent={totals['sent']} retries={totals['retry']} failed={totals['failed']} "
+              f"requests={counter['requests']} throttled={counter['throttled']}")
+        print(f"elapsed={elapsed:.2f}s  throughput={totals['sent'] / elapsed:.1f} msg/s  "
+              f"(sequential would take ~{args.messages * args.latency:.0f}s)")
+        print(f"report status={delivery['status']} sent={delivery['sent']} failed={delivery['failed']}")
+
+        dbpool.close_all()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+قياس زمن الاستعلامات الساخنة قبل وبعد ترحيلات الفهارس
+
+    python benchmarks/bench_schema.py --rows 1000000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dbpool
+import db
+
+
+def populate(rows):
+    """ملء قاعدة بيانات فارغة بعدد rows من الرسائل والتعليقات والطلبات"""
+    start = datetime.now() - timedelta(days=365)
+    statuses = ['new', 'assigned', 'in_progress', 'completed', 'cancelled']
+
+    def stamp(i):
+        return (start + timedelta(seconds=i * 31536000 // rows)).strftime(db.TIMESTAMP_FORMAT)
+
+    with dbpool.transaction() as cursor:
+        cursor.executemany(
+            'INSERT INTO inbox (message_id, user_id, user_name, page_id, message, created_time) VALUES (?, ?, ?, ?, ?, ?)',
+            ((f'm{i}', f'u{random.randrange(rows // 5)}', 'عميل', f'p{i % 10}', 'بكام؟', stamp(i)) for i in range(rows))
+        )
+        cursor.executemany(
+            'INSERT INTO comments (comment_id, post_id, user_id, user_name, message, status, created_time) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((f'c{i}', f'post{i % 1000}', f'u{i % 50000}', 'عميل', 'متاح؟',
+              'pending' if i % 100 == 0 else 'replied', stamp(i)) for i in range(rows))
+        )
+        cursor.executemany(
+            'INSERT INTO orders (order_id, customer_name, product, quantity, status, agent_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            ((f'o{i}', 'عميل', 'منتج', 1, statuses[i % 5], f'agent_{i % 50}', stamp(i)) for i in range(rows))
+        )
+        cursor.executemany(
+            'INSERT INTO agents (agent_id, name, status) VALUES (?, ?, ?)',
+            ((f'agent_{i}', f'مندوب {i}', i % 3 != 0) for i in range(50))
+        )
+
+
+def measure(label, query, params_factory, repeat):
+    cursor = dbpool.get_connection().cursor()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        cursor.execute(query, params_factory()).fetchall()
+    return label, (time.perf_counter() - started) / repeat * 1000
+
+
+def run_queries(rows, repeat):
+    day = (datetime.now() - timedelta(days=100)).date()
+    day_start, day_end = db.day_range(day)
+    return [
+        measure('first contact (inbox user/page)',
+                'SELECT COUNT(*) FROM inbox WHERE user_id = ? AND page_id = ?',
+                lambda: (f'u{random.randrange(rows // 5)}', f'p{random.randrange(10)}'), repeat),
+        measure('today messages DATE(created_time)',
+                'SELECT COUNT(*) FROM inbox WHERE DATE(created_time) = ?',
+                lambda: (str(day),), max(1, repeat // 20)),
+        measure('today messages range scan',
+                'SELECT COUNT(*) FROM inbox WHERE created_time >= ? AND created_time < ?',
+                lambda: (day_start, day_end), repeat),
+        measure('today comments range scan',
+                'SELECT COUNT(*) FROM comments WHERE created_time >= ? AND created_time < ?',
+                lambda: (day_start, day_end), repeat),
+        measure('new orders count',
+                'SELECT COUNT(*) FROM orders WHERE status = ?',
+                lambda: ('new',), max(1, repeat // 20)),
+        measure('agent dashboard orders',
+                "SELECT * FROM orders WHERE agent_id = ? AND status IN ('assigned', 'in_progress') ORDER BY created_at DESC LIMIT 50",
+                lambda: (f'agent_{random.randrange(50)}',), repeat),
+        measure('pending comments chunk',
+                "SELECT id FROM comments WHERE status = 'pending' AND id > ? ORDER BY id LIMIT 200",
+                lambda: (random.randrange(rows),), repeat),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dbpool.configure(os.path.join(tmp, 'bench.db'))
+        db.init_database(migrate=False)
+
+        started = time.perf_counter()
+        populate(args.rows)
+        print(f'populated {args.rows:,} rows per table in {time.perf_counter() - started:.1f}s')
+
+        before = run_queries(args.rows, args.repeat)
+
+        started = time.perf_counter()
+        db.run_migrations()
+        print(f'migrations to v{db.get_schema_version()} in {time.perf_counter() - started:.1f}s\n')
+
+        after = run_queries(args.rows, args.repeat)
+
+        print(f'{"query":<38}{"before ms":>12}{"after ms":>12}{"speedup":>10}')
+        for (label, old), (_, new) in zip(before, after):
+            print(f'{label:<38}{old:>12.3f}{new:>12.3f}{old / new if new else 0:>9.0f}x')
+
+        dbpool.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+مقارنة زمن بدء التشغيل وعدد الطلبات في الثانية بين run.py و serve.py
+كل أمر يعمل على قاعدة بيانات مؤقتة مستقلة، والقياس على /api/orders بعد تسجيل الدخول
+
+    python benchmarks/bench_serve.py --seconds 5 --concurrency 16
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PORT = 5000  # run.py يستخدم المنفذ 5000 دائماً
+
+COMMANDS = {
+    'run.py': [sys.executable, 'run.py'],
+    'run.py --fast': [sys.executable, 'run.py', '--fast'],
+    'serve.py': [sys.executable, 'serve.py', 'all'],
+}
+
+
+def request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    response.read()
+    return response
+
+
+def wait_until_up(process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=1)
+            request(conn, 'GET', '/admin/dashboard')
+            conn.close()
+            return True
+        except OSError:
+            time.sleep(0.02)
+    return False
+
+
+def login():
+    conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+    response = request(conn, 'POST', '/login',
+                       body=urllib.parse.urlencode({'password': os.environ['ADMIN_PASS']}),
+                       headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    conn.close()
+    return response.getheader('Set-Cookie', '').split(';')[0]
+
+
+def load(cookie, seconds, concurrency):
+    counts = [0] * concurrency
+    errors = [0] * concurrency
+    deadline = time.monotonic() + seconds
+
+    def client(index):
+        conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+        while time.monotonic() < deadline:
+            try:
+                response = request(conn, 'GET', '/api/orders?limit=20', headers={'Cookie': cookie})
+                if response.status == 200:
+                    counts[index] += 1
+                else:
+                    errors[index] += 1
+            except (OSError, http.client.HTTPException):
+                errors[index] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts) / seconds, sum(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--startup-timeout', type=float, default=120)
+    parser.add_argument('--only', choices=list(COMMANDS), action='append')
+    args = parser.parse_args()
+
+    os.environ.setdefault('ADMIN_PASS', 'bench-pass')
+    os.environ.setdefault('SECRET_KEY', 'bench-secret')
+
+    print(f'{"command":<16}{"startup s":>11}{"req/s":>10}{"errors":>8}')
+    for name, command in COMMANDS.items():
+        if args.only and name not in args.only:
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DATABASE_PATH=os.path.join(tmp, 'bench.db'), WEB_PORT=str(PORT))
+            started = time.monotonic()
+            process = subprocess.Popen(command, cwd=ROOT, env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                if not wait_until_up(process, args.startup_timeout):
+                    print(f'{name:<16}{"failed to start":>29}')
+                    continue
+                startup = time.monotonic() - started
+                rps, errors = load(login(), args.seconds, args.concurrency)
+                print(f'{name:<16}{startup:>11.2f}{rps:>10.0f}{errors:>8}')
+            finally:
+                process.terminate()
+                try:
+                    process.wait(30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+if __name__ == '__main__':
+    main()
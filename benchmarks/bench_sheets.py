@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+قياس مزامنة الطلبات مع Google Sheets مقابل خادم values API وهمي محلي (الجدول في الذاكرة)
+تصدير أولي، ثم مزامنة بلا تغييرات، ثم تعديل بعض الطلبات، ثم تعديلات من داخل الجدول
+
+    python benchmarks/bench_sheets.py --orders 20000 --changed 200 --latency 0.05
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dbpool
+import db
+
+RANGE_RE = re.compile(r"^'?[^'!]+'?!([A-Z]+)(\d+):([A-Z]+)(\d+)$")
+
+
+def make_handler(latency):
+    grid = {}  # رقم الصف -> قائمة القيم
+    counter = {'get': 0, 'update': 0, 'cells': 0}
+    lock = threading.Lock()
+
+    def parse(a1):
+        first_col, first_row, last_col, last_row = RANGE_RE.match(a1).groups()
+        return int(first_row), int(last_row), ord(last_col) - ord(first_col) + 1
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def _reply(self, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            time.sleep(latency)
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            ranges = []
+            with lock:
+                counter['get'] += 1
+                for a1 in query.get('ranges', []):
+                    first, last, width = parse(a1)
+                    rows = [grid.get(n, []) for n in range(first, last + 1)]
+                    while rows and not any(rows[-1]):
+                        rows.pop()
+                    ranges.append({'range': a1, 'values': rows})
+            self._reply({'valueRanges': ranges})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time.sleep(latency)
+            cells = 0
+            with lock:
+                counter['update'] += 1
+                for item in body['data']:
+                    first, last, width = parse(item['range'])
+                    for offset, values in enumerate(item['values']):
+                        grid[first + offset] = [str(value) for value in values]
+                        cells += len(values)
+                counter['cells'] += cells
+            self._reply({'totalUpdatedCells': cells})
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler, grid, counter
+
+
+def seed_orders(count):
+    statuses = ('new', 'assigned', 'in_progress', 'completed', 'cancelled')
+    with dbpool.transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO orders (order_id, customer_name, customer_phone, product, quantity, status, agent_id,
+                                created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(f'ORD{i:07d}', f'عميل {i}', f'010{i:08d}', 'فستان سهرة', 1 + i % 3, random.choice(statuses),
+               f'AGT{i % 20:03d}', '2024-01-01 10:00:00', '2024-01-01 10:00:00') for i in range(count)])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--changed', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--rpm', type=float, default=600)
+    args = parser.parse_args()
+
+    handler, grid, counter = make_handler(args.latency)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dbpool.configure(os.path.join(tmp, 'bench.db'))
+        db.init_database()
+        random.seed(3)
+        seed_orders(args.orders)
+
+        import sheets_sync
+        client = sheets_sync.SheetsClient('bench-sheet', 'token', base_url=base_url, requests_per_minute=args.rpm)
+        sync = sheets_sync.OrderSheetSync(client)
+
+        def run(name):
+            before = dict(counter)
+            started = time.perf_counter()
+            stats, changes = sync.run()
+            elapsed = time.perf_counter() - started
+            print(f"{name:<22} {elapsed:>7.2f}s  requests get={counter['get'] - before['get']} "
+                  f"update={counter['update'] - before['update']}  rows written={stats['written_rows']:>6}  "
+                  f"cells={counter['cells'] - before['cells']:>7}  imported={stats['imported']} "
+                  f"created={stats['created']} conflicts={stats['conflicts']} order changes={len(changes)}")
+
+        print(f'orders={args.orders} latency={args.latency}s quota={args.rpm}/min')
+        run('initial export')
+        run('no changes')
+
+        ids = random.sample(range(args.orders), args.changed)
+        for i in ids:
+            db.update_order(f'ORD{i:07d}', 'completed')
+        run(f'{args.changed} db updates')
+
+        # تعديل الحالة في الجدول مباشرة + صف جديد يضيفه المستخدم
+        edited = random.sample(sorted(grid)[1:], args.changed)
+        for row_number in edited:
+            grid[row_number][5] = 'cancelled'
+        grid[max(grid) + 1] = ['SHEET0001', 'عميل من الجدول', '01000000000', 'حقيبة', '2', 'new', '', '', '', '']
+        run(f'{args.changed} sheet edits')
+        run('no changes')
+
+        cursor = dbpool.get_connection().cursor()
+        cursor.execute("SELECT COUNT(*) FROM orders WHERE status = 'cancelled'")
+        cancelled = cursor.fetchone()[0]
+        sheet_cancelled = sum(1 for n, row in grid.items() if n > 1 and row[5] == 'cancelled')
+        print(f'cancelled in db={cancelled} in sheet={sheet_cancelled}  sheet rows={len(grid) - 1}')
+        dbpool.close_all()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
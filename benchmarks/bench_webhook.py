@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+قياس كلفة رفض طلبات Webhook المزيفة مقارنة بالطلبات الموقعة التي تصل إلى مرحلة الإدخال
+(عميل اختبار Flask بدون شبكة - الفرق كله في مسار الطلب نفسه)
+
+    python benchmarks/bench_webhook.py --requests 2000 --events 20
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+SECRET = b'bench-app-secret'
+
+
+def make_body(index, events):
+    now = int(time.time())
+    changes = [{'field': 'feed', 'value': {
+        'item': 'comment', 'verb': 'add', 'comment_id': f'c_{index}_{n}', 'post_id': f'page_1_post_{n % 10}',
+        'from': {'id': f'user_{n}', 'name': 'عميل'}, 'message': 'متاح مقاس لارج؟', 'created_time': now
+    }} for n in range(events)]
+    return json.dumps({'object': 'page', 'entry': [{'id': 'page_1', 'time': now, 'changes': changes}]}).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_PATH'] = os.path.join(tmp, 'bench.db')
+        os.environ['APP_START_WORKERS'] = '0'
+        os.environ['FACEBOOK_APP_SECRET'] = SECRET.decode()
+        import dbpool
+        import app as app_module
+        from webhook_auth import sign, get_webhook_guard, loads
+
+        client = app_module.app.test_client()
+        bodies = [make_body(i, args.events) for i in range(args.requests)]
+        print(f'json parser: {loads.__module__ or "json"}  body={len(bodies[0])} bytes  events/request={args.events}')
+
+        cases = {
+            'spoofed (bad signature)': lambda body: {'X-Hub-Signature-256': 'sha256=' + '0' * 64},
+            'unsigned (no header)': lambda body: {},
+            'signed (stored)': lambda body: {'X-Hub-Signature-256': sign(SECRET, body)},
+        }
+        for name, headers in cases.items():
+            statuses = {}
+            started = time.perf_counter()
+            for body in bodies:
+                status = client.post('/webhook/facebook', data=body, headers=headers(body),
+                                     content_type='application/json').status_code
+                statuses[status] = statuses.get(status, 0) + 1
+            elapsed = time.perf_counter() - started
+            print(f'{name:<26} {args.requests / elapsed:>9,.0f} req/s  '
+                  f'{elapsed / args.requests * 1e6:>8,.0f} us/req  statuses={statuses}')
+
+        print(f'guard stats: {get_webhook_guard().stats}')
+        dbpool.close_all()
+
+
+if __name__ == '__main__':
+    main()
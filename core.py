@@ -1,15 +1,259 @@
-import openai
+import os
 import requests
 import json
 import re
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from db import get_service_token, add_log
+from requests.adapters import HTTPAdapter
+from db import get_service_token, get_settings_version, get_conversation, add_log, get_connection
+from response_cache import ResponseCache
+from arabic import normalize_arabic, message_tokens
+from intents import KeywordMatcher, get_intent_classifier
+from product_search import get_product_index, format_products
+from reports import get_report_engine, render_report
+from outbox import queue_messages
+
+AI_CONNECT_TIMEOUT = float(os.environ.get('AI_CONNECT_TIMEOUT', 3))
+AI_READ_TIMEOUT = float(os.environ.get('AI_READ_TIMEOUT', 15))
+AI_HEDGE_DELAY = float(os.environ.get('AI_HEDGE_DELAY', 6))  # 0 لإيقاف الطلبات الموازية
+# مهلة إجمالية للسلسلة كلها (الطلب الموازي والانتقال للبديل ضمنها)
+AI_DEADLINE = float(os.environ.get('AI_DEADLINE', AI_CONNECT_TIMEOUT + AI_READ_TIMEOUT + AI_HEDGE_DELAY))
+AI_POOL_SIZE = int(os.environ.get('AI_POOL_SIZE', 10))
+
+class ProviderError(Exception):
+    """فشل مزود الذكاء الاصطناعي (خطأ HTTP أو مهلة أو رد غير صالح)"""
+
+class CircuitBreaker:
+    """قاطع دائرة - يوقف استدعاء المزود البطيء أو المعطل مؤقتاً"""
+    
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+    
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'half_open':
+                # محاولة تجريبية واحدة ثم ننتظر نتيجتها
+                self.opened_at = time.monotonic()
+                return True
+            return state == 'closed'
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class AIProvider:
+    """مزود متوافق مع واجهة chat/completions مع جلسة HTTP مشتركة"""
+    
+    name = ''
+    default_base_url = ''
+    model = ''
+    
+    def __init__(self, api_key, base_url=None, connect_timeout=AI_CONNECT_TIMEOUT,
+                 read_timeout=AI_READ_TIMEOUT, pool_size=AI_POOL_SIZE):
+        self.api_key = api_key
+        self.base_url = (base_url or self.default_base_url).rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker()
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        })
+    
+    def build_messages(self, message, context, variables):
+        raise NotImplementedError
+    
+    def generate(self, message, context, variables):
+        payload = {
+            'model': self.model,
+            'messages': self.build_messages(message, context, variables),
+            'max_tokens': 150,
+            'temperature': 0.7
+        }
+        
+        try:
+            response = self.session.post(f'{self.base_url}/chat/completions',
+                                         json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ProviderError(f'{self.name}: {str(e)}')
+        
+        if response.status_code != 200:
+            raise ProviderError(f'{self.name} API error: {response.status_code}')
+        
+        try:
+            return response.json()['choices'][0]['message']['content']
+        except (ValueError, KeyError, IndexError):
+            raise ProviderError(f'{self.name}: invalid response body')
+
+class OpenAIProvider(AIProvider):
+    name = 'openai'
+    default_base_url = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+    model = 'gpt-3.5-turbo'
+    
+    def build_messages(self, message, context, variables):
+        prompt = f"""
+        أنت مساعد ذكي للرد على رسائل العملاء. 
+        السياق: {context}
+        الرسالة: {message}
+        
+        قم بالرد بشكل ودي ومفيد. استخدم المتغيرات التالية إذا لزم الأمر:
+        {json.dumps(variables, ensure_ascii=False)}
+        """
+        return [{"role": "user", "content": prompt}]
+
+class DeepSeekProvider(AIProvider):
+    name = 'deepseek'
+    default_base_url = os.environ.get('DEEPSEEK_BASE_URL', 'https://api.deepseek.com/v1')
+    model = 'deepseek-chat'
+    
+    def build_messages(self, message, context, variables):
+        return [
+            {"role": "system", "content": "أنت مساعد ذكي للرد على رسائل العملاء."},
+            {"role": "user", "content": f"السياق: {context}\nالرسالة: {message}"}
+        ]
+
+class ProviderChain:
+    """سلسلة مزودين بالترتيب مع طلبات موازية (hedging) وقاطع دائرة لكل مزود"""
+    
+    _executor = ThreadPoolExecutor(max_workers=AI_POOL_SIZE * 2, thread_name_prefix='ai-provider')
+    
+    def __init__(self, providers, hedge_delay=AI_HEDGE_DELAY, deadline=AI_DEADLINE):
+        self.providers = list(providers)
+        self.hedge_delay = hedge_delay
+        self.deadline = deadline
+    
+    def __bool__(self):
+        return bool(self.providers)
+    
+    def generate(self, message, context, variables):
+        """أول رد ناجح من السلسلة خلال مهلة إجمالية واحدة
+        فشل المزود ينقل للتالي فوراً، وتأخره أكثر من hedge_delay يطلق التالي بالتوازي"""
+        errors = []
+        candidates = iter(self.providers)
+        running = {}
+        
+        def launch():
+            for provider in candidates:
+                if provider.breaker.allow():
+                    running[self._executor.submit(provider.generate, message, context, variables)] = provider
+                    return True
+                errors.append(f'{provider.name}: circuit open')
+            return False
+        
+        deadline = time.monotonic() + self.deadline
+        exhausted = not launch()
+        hedge_at = time.monotonic() + self.hedge_delay
+        while running:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            timeout = deadline - now
+            if self.hedge_delay and not exhausted:
+                timeout = min(timeout, max(0.0, hedge_at - now))
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                provider = running.pop(future)
+                try:
+                    result = future.result()
+                except ProviderError as e:
+                    provider.breaker.record_failure()
+                    errors.append(str(e))
+                    continue
+                provider.breaker.record_success()
+                return result
+            
+            # فشل كل ما يعمل، أو حان موعد الطلب الموازي مع مزود السلسلة التالي
+            if not exhausted and (not running or (self.hedge_delay and time.monotonic() >= hedge_at)):
+                exhausted = not launch()
+                hedge_at = time.monotonic() + self.hedge_delay
+        
+        for provider in running.values():
+            # الطلب يكمل في الخلفية لكن نتيجته لم تعد تهمنا
+            provider.breaker.record_failure()
+            errors.append(f'{provider.name}: timed out')
+        raise ProviderError('; '.join(errors) or 'No AI provider configured')
+    
+    async def agenerate(self, message, context, variables):
+        """نسخة asyncio - نفس السلسلة والمهلة في خيط منفصل بدون حجز حلقة الأحداث"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.generate, message, context, variables)
+
+
+# ردود افتراضية عند تعذر الوصول لمزودي الذكاء الاصطناعي (المفاتيح بدون "ال" التعريف)
+DEFAULT_RESPONSES = {
+    'customer': {
+        'مرحبا': 'مرحباً بك! 👋 أنا مساعدك الشخصي، كيف يمكنني مساعدتك اليوم؟',
+        'شكرا': 'العفو! 😊 في خدمتك دائماً، لا تنسى متابعة صفحتنا للمزيد من العروض.',
+        'سعر': '💰 الأسعار تختلف حسب المنتج. أرسل لي صورة المنتج المطلوب أو رقم الموديل وسأقوم بإخبارك بالسعر فوراً!',
+        'عنوان': '📍 عنواننا: القاهرة، مصر. يمكننا أيضاً توصيل الطلب لأي مكان داخل القاهرة والجيزة.',
+        'توصيل': '🚚 خدمة التوصيل متاحة داخل القاهرة والجيزة خلال 24-48 ساعة. تكلفة التوصيل 25 جنيه.',
+        'دفع': '💳 نقبل الدفع نقداً عند الاستلام أو تحويل بنكي أو فودافون كاش.',
+        'متاح': '✅ معظم المنتجات متاحة، أرسل لي اسم المنتج أو صورته للتأكد من توافره.',
+        'خصم': '🎯 عروض خاصة متاحة حالياً! اشترِ 2 واحصل على الثالث مجاناً على منتجات مختارة.'
+    },
+    'assistant': {
+        'شرح': 'سأشرح لك هذه الصفحة خطوة بخطوة. هذه الصفحة تتيح لك إدارة إعدادات فيسبوك وربط حسابك بسهولة.',
+        'مساعدة': 'أنا هنا للمساعدة! يمكنني شرح أي جزء من النظام، تقديم نصائح لتحسين الأداء، أو مساعدتك في حل المشكلات.',
+        'إعدادات': 'يمكنك تعديل الإعدادات من القائمة الجانبية. كل خدمة لها صفحة إعدادات مستقلة للتحكم الكامل.'
+    },
+    'management': {
+        'تقرير': 'سأقوم بتحليل البيانات وتقديم تقرير إداري شامل عن أداء النظام وتوصيات للتحسين.',
+        'تحليل': 'بناءً على البيانات المتوفرة، يمكنني تحليل أداء المبيعات، سلوك العملاء، وكفاءة المناديب.'
+    }
+}
+
+DEFAULT_FALLBACKS = {
+    'customer': 'شكراً لتواصلك معنا! 😊 سأقوم بالرد عليك فوراً، كيف يمكنني مساعدتك اليوم؟',
+    'assistant': 'كيف يمكنني مساعدتك في إدارة النظام اليوم؟ يمكنني شرح أي جزء أو مساعدتك في حل المشكلات.',
+    'management': 'كيف يمكنني مساعدتك في اتخاذ القرارات الإدارية اليوم؟'
+}
+
+# تُبنى مرة واحدة: {context_type: (matcher, {key: response})}
+_DEFAULT_MATCHERS = {
+    context_type: (
+        KeywordMatcher({normalize_arabic(key): (key, order) for order, key in enumerate(responses)}),
+        responses
+    )
+    for context_type, responses in DEFAULT_RESPONSES.items()
+}
+
 
 class AIEngine:
     def __init__(self):
-        self.openai_key = get_service_token('openai')
-        self.deepseek_key = get_service_token('deepseek')
+        self._settings_lock = threading.Lock()
+        self._settings_version = None
+        self.openai_key = None
+        self.deepseek_key = None
         self.model = 'openai'  # أو 'deepseek' حسب الإعدادات
+        self.cache = ResponseCache()
         
         # سياقات مختلفة
         self.contexts = {
@@ -18,16 +262,74 @@ class AIEngine:
             'admin': self._get_admin_context()
         }
         
-    def generate_response(self, message, context_type='customer', variables={}):
+        self.reload_settings()
+    
+    def reload_settings(self):
+        """إعادة قراءة مفاتيح الذكاء الاصطناعي من جدول settings"""
+        with self._settings_lock:
+            version = get_settings_version()
+            self.openai_key = get_service_token('openai')
+            self.deepseek_key = get_service_token('deepseek')
+            self.providers = self._build_providers()
+            self._settings_version = version
+    
+    def _build_providers(self):
+        """ترتيب السلسلة: النموذج المختار أولاً ثم البديل - مع الإبقاء على الجلسات المفتوحة"""
+        existing = {(p.name, p.api_key): p for p in getattr(self, 'providers', ProviderChain([])).providers}
+        available = [
+            (OpenAIProvider, self.openai_key),
+            (DeepSeekProvider, self.deepseek_key)
+        ]
+        available.sort(key=lambda item: item[0].name != self.model)
+        
+        providers = []
+        for provider_class, key in available:
+            if key:
+                providers.append(existing.get((provider_class.name, key)) or provider_class(key))
+        return ProviderChain(providers)
+    
+    def refresh_settings(self):
+        """إعادة التحميل فقط إذا تغير إصدار الإعدادات"""
+        if get_settings_version() != self._settings_version:
+            self.reload_settings()
+        
+    def _prepare(self, message, context, variables, context_type):
+        """السياق الكامل مع رد جاهز (افتراضي أو من الكاش) إن لم يلزم استدعاء النموذج"""
+        self.refresh_settings()
+        base_context = self.contexts.get(context_type, '')
+        full_context = f'{base_context}\n{context}' if context else base_context
+        
+        if not self.providers:
+            return full_context, self._default_response(message, variables, context_type)
+        
+        # نفس السؤال بنفس السياق لا يحتاج استدعاء جديد للنموذج
+        cached = self.cache.get(message, context_type, full_context, variables)
+        if cached is not None:
+            return full_context, self._replace_variables(cached, variables)
+        return full_context, None
+    
+    def generate_response(self, message, context='', variables=None, context_type='customer'):
+        """توليد رد - context نص إضافي (قالب المنشور أو معلومات المنتج) فوق سياق context_type"""
+        variables = variables or {}
         try:
-            context = self.contexts.get(context_type, '')
-            
-            if self.model == 'openai' and self.openai_key:
-                return self._openai_generate(message, context, variables)
-            elif self.model == 'deepseek' and self.deepseek_key:
-                return self._deepseek_generate(message, context, variables)
-            else:
-                return self._default_response(message, variables, context_type)
+            full_context, response = self._prepare(message, context, variables, context_type)
+            if response is None:
+                response = self.providers.generate(message, full_context, variables)
+                self.cache.put(message, context_type, full_context, variables, response)
+            return response
+        except Exception as e:
+            add_log('error', f'AI generation failed: {str(e)}', 'ai')
+            return self._default_response(message, variables, context_type)
+    
+    async def agenerate_response(self, message, context='', variables=None, context_type='customer'):
+        """نسخة asyncio من generate_response"""
+        variables = variables or {}
+        try:
+            full_context, response = self._prepare(message, context, variables, context_type)
+            if response is None:
+                response = await self.providers.agenerate(message, full_context, variables)
+                self.cache.put(message, context_type, full_context, variables, response)
+            return response
         except Exception as e:
             add_log('error', f'AI generation failed: {str(e)}', 'ai')
             return self._default_response(message, variables, context_type)
@@ -83,136 +385,91 @@ class AIEngine:
         - استخدم المصطلحات الإدارية الصحيحة
         """
     
-    def _openai_generate(self, message, context, variables):
-        openai.api_key = self.openai_key
-        
-        prompt = f"""
-        أنت مساعد ذكي للرد على رسائل العملاء. 
-        السياق: {context}
-        الرسالة: {message}
-        
-        قم بالرد بشكل ودي ومفيد. استخدم المتغيرات التالية إذا لزم الأمر:
-        {json.dumps(variables, ensure_ascii=False)}
-        """
-        
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=150,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content
-    
-    def _deepseek_generate(self, message, context, variables):
-        # دمج DeepSeek API (مماثل لـ OpenAI)
-        headers = {
-            'Authorization': f'Bearer {self.deepseek_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        data = {
-            'model': 'deepseek-chat',
-            'messages': [
-                {"role": "system", "content": "أنت مساعد ذكي للرد على رسائل العملاء."},
-                {"role": "user", "content": f"السياق: {context}\nالرسالة: {message}"}
-            ],
-            'max_tokens': 150,
-            'temperature': 0.7
-        }
-        
-        response = requests.post('https://api.deepseek.com/v1/chat/completions', 
-                               headers=headers, json=data)
-        
-        if response.status_code == 200:
-            return response.json()['choices'][0]['message']['content']
-        else:
-            raise Exception("DeepSeek API error")
-    
     def _default_response(self, message, variables, context_type='customer'):
-        # ردود افتراضية ذكية حسب السياق
-        if context_type == 'customer':
-            responses = {
-                'مرحبا': 'مرحباً بك! 👋 أنا مساعدك الشخصي، كيف يمكنني مساعدتك اليوم؟',
-                'شكرا': 'العفو! 😊 في خدمتك دائماً، لا تنسى متابعة صفحتنا للمزيد من العروض.',
-                'السعر': '💰 الأسعار تختلف حسب المنتج. أرسل لي صورة المنتج المطلوب أو رقم الموديل وسأقوم بإخبارك بالسعر فوراً!',
-                'العنوان': '📍 عنواننا: القاهرة، مصر. يمكننا أيضاً توصيل الطلب لأي مكان داخل القاهرة والجيزة.',
-                'التوصيل': '🚚 خدمة التوصيل متاحة داخل القاهرة والجيزة خلال 24-48 ساعة. تكلفة التوصيل 25 جنيه.',
-                'الدفع': '💳 نقبل الدفع نقداً عند الاستلام أو تحويل بنكي أو فودافون كاش.',
-                'متاح': '✅ معظم المنتجات متاحة، أرسل لي اسم المنتج أو صورته للتأكد من توافره.',
-                'خصم': '🎯 عروض خاصة متاحة حالياً! اشترِ 2 واحصل على الثالث مجاناً على منتجات مختارة.'
-            }
-        elif context_type == 'assistant':
-            responses = {
-                'شرح': 'سأشرح لك هذه الصفحة خطوة بخطوة. هذه الصفحة تتيح لك إدارة إعدادات فيسبوك وربط حسابك بسهولة.',
-                'مساعدة': 'أنا هنا للمساعدة! يمكنني شرح أي جزء من النظام، تقديم نصائح لتحسين الأداء، أو مساعدتك في حل المشكلات.',
-                'إعدادات': 'يمكنك تعديل الإعدادات من القائمة الجانبية. كل خدمة لها صفحة إعدادات مستقلة للتحكم الكامل.'
-            }
-        else:
-            responses = {
-                'تقرير': 'سأقوم بتحليل البيانات وتقديم تقرير إداري شامل عن أداء النظام وتوصيات للتحسين.',
-                'تحليل': 'بناءً على البيانات المتوفرة، يمكنني تحليل أداء المبيعات، سلوك العملاء، وكفاءة المناديب.'
-            }
-        
-        # البحث عن مطابقات ذكية
-        for key, value in responses.items():
-            if key.lower() in message.lower():
-                return self._replace_variables(value, variables)
-        
-        # ردود افتراضية حسب السياق
-        if context_type == 'customer':
-            return self._replace_variables('شكراً لتواصلك معنا! 😊 سأقوم بالرد عليك فوراً، كيف يمكنني مساعدتك اليوم؟', variables)
-        elif context_type == 'assistant':
-            return self._replace_variables('كيف يمكنني مساعدتك في إدارة النظام اليوم؟ يمكنني شرح أي جزء أو مساعدتك في حل المشكلات.', variables)
-        else:
-            return self._replace_variables('كيف يمكنني مساعدتك في اتخاذ القرارات الإدارية اليوم؟', variables)
+        # ردود افتراضية ذكية حسب السياق - أول مفتاح مطابق حسب ترتيب القاموس
+        matcher, responses = _DEFAULT_MATCHERS.get(context_type, _DEFAULT_MATCHERS['management'])
+        matches = matcher.scan(message_tokens(message))
+        if matches:
+            key = min(matches, key=lambda match: match[1])[0]
+            return self._replace_variables(responses[key], variables)
+        return self._replace_variables(DEFAULT_FALLBACKS.get(context_type, DEFAULT_FALLBACKS['management']), variables)
     
     def _replace_variables(self, text, variables):
         for key, value in variables.items():
             text = text.replace(f'{{{key}}}', str(value))
         return text
 
+_response_manager = None
+_response_manager_lock = threading.Lock()
+
+def get_response_manager():
+    """نسخة واحدة مشتركة من ResponseManager لكل عملية"""
+    global _response_manager
+    if _response_manager is None:
+        with _response_manager_lock:
+            if _response_manager is None:
+                _response_manager = ResponseManager()
+    return _response_manager
+
 class ResponseManager:
     def __init__(self):
         self.ai = AIEngine()
         self.egyptian_kb = EgyptianKnowledgeBase()
         self.management_kb = ManagementKnowledgeBase()
+        self._memory_lock = threading.Lock()
         
         # ذاكرة للبوت من Shopify (سيتم تحديثها ديناميكياً)
         self.shopify_memory = {
-            'products': [],
             'categories': ['ملابس', 'اكسسوارات', 'احذية'],
             'popular_items': [],
             'recent_orders': []
         }
     
-    def update_shopify_memory(self, products_data):
-        """تحديث ذاكرة المنتجات من Shopify"""
-        self.shopify_memory['products'] = products_data
-        self.shopify_memory['popular_items'] = self._get_popular_items(products_data)
-    
-    def _get_popular_items(self, products):
-        """الحصول على المنتجات الأكثر شعبية"""
-        # محاكاة - في الواقع يجب جلبها من بيانات الطلبات
-        return products[:5] if len(products) > 5 else products
+    def update_shopify_memory(self):
+        """تحديث ملخص الكتالوج من shopify_products (الفئات وأحدث المنتجات)"""
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT DISTINCT category FROM shopify_products
+            WHERE category IS NOT NULL AND category != '' ORDER BY category
+        ''')
+        categories = [row[0] for row in cursor.fetchall()]
+        cursor.execute('''
+            SELECT product_id, title, price FROM shopify_products
+            WHERE availability = 1 ORDER BY updated_at DESC LIMIT 5
+        ''')
+        popular_items = [dict(zip(('product_id', 'title', 'price'), row)) for row in cursor.fetchall()]
+        
+        # استبدال القاموس كاملاً حتى لا يرى القراء حالة نصف محدثة
+        with self._memory_lock:
+            memory = dict(self.shopify_memory)
+            memory['popular_items'] = popular_items
+            if categories:
+                memory['categories'] = categories
+            self.shopify_memory = memory
     
     def process_comment(self, comment_data):
-        from db import get_service_token
-        
+        message, context, variables = self.build_comment_prompt(comment_data)
+        return self.ai.generate_response(message, context, variables)
+    
+    def build_comment_prompt(self, comment_data, reply_template=None, page_name=None):
+        """تجهيز (الرسالة، السياق، المتغيرات) لتعليق - القالب واسم الصفحة يمكن تمريرهما مسبقاً"""
         page_id = comment_data.get('page_id')
         post_id = comment_data.get('post_id')
         user_name = comment_data.get('user_name')
-        message = comment_data.get('message')
+        message = comment_data.get('message') or ''
         
         # تحليل نوع الاستفسار
         inquiry_type = self._analyze_inquiry(message)
         
         # جلب قالب الرد للمنشور
-        reply_template = self._get_post_reply_template(post_id)
+        if reply_template is None:
+            reply_template = self._get_post_reply_template(post_id)
+        if page_name is None:
+            page_name = self._get_page_name(page_id)
         
         variables = {
             'name': user_name,
-            'page_name': self._get_page_name(page_id),
+            'page_name': page_name,
             'order_id': self._extract_order_id(message),
             'product_info': self._get_relevant_product_info(message),
             'shipping_info': self._get_shipping_context(message)
@@ -220,36 +477,24 @@ class ResponseManager:
         
         # إذا كان هناك قالب مخصص، استخدمه
         if reply_template:
-            response = self.ai.generate_response(message, reply_template, variables)
+            context = reply_template
+        elif inquiry_type in ['price', 'product', 'availability']:
+            # إضافة معلومات من Shopify وقاعدة المعرفة
+            context = self._build_context_for_inquiry(inquiry_type, message, variables['product_info'])
         else:
-            # استخدام الذكاء الاصطناعي مع السياق المناسب
-            if inquiry_type in ['price', 'product', 'availability']:
-                # إضافة معلومات من Shopify وقاعدة المعرفة
-                context = self._build_context_for_inquiry(inquiry_type, message)
-                response = self.ai.generate_response(message, context, variables)
-            else:
-                response = self.ai.generate_response(message, '', variables)
+            context = ''
         
-        return response
+        return message, context, variables
     
     def _analyze_inquiry(self, message):
         """تحليل نوع الاستفسار"""
-        message_lower = message.lower()
-        
-        if any(word in message_lower for word in ['سعر', 'كم', 'بكام', 'السعر']):
-            return 'price'
-        elif any(word in message_lower for word in ['متاح', 'فيه', 'عندك', 'عندكم']):
-            return 'availability'
-        elif any(word in message_lower for word in ['توصيل', 'شحن', 'وصل', 'متى']):
-            return 'shipping'
-        elif any(word in message_lower for word in ['منتج', 'قطعة', 'حاجة', ' item']):
-            return 'product'
-        else:
-            return 'general'
+        return get_intent_classifier().classify(message)
     
     def _get_relevant_product_info(self, message):
-        """الحصول على معلومات المنتجات المرتبطة"""
-        # محاكاة - في الواقع يجب تحليل الرسالة واستخراج الكلمات المفتاحية
+        """الحصول على معلومات المنتجات المرتبطة - أفضل المنتجات من الكتالوج ثم قاعدة المعرفة"""
+        products = get_product_index().search(message)
+        if products:
+            return {'products': products}
         for category in self.egyptian_kb.products:
             if category in message:
                 return self.egyptian_kb.get_product_info(category)
@@ -263,71 +508,53 @@ class ResponseManager:
                 return self.egyptian_kb.get_shipping_info(city)
         return {}
     
-    def _build_context_for_inquiry(self, inquiry_type, message):
+    def _build_context_for_inquiry(self, inquiry_type, message, product_info=None):
         """بناء سياق مخصص حسب نوع الاستفسار"""
+        if inquiry_type in ('price', 'availability', 'product'):
+            if product_info is None:
+                product_info = self._get_relevant_product_info(message)
+            products = product_info.get('products')
+            if products:
+                catalog = f"المنتجات الأقرب لسؤال العميل:\n{format_products(products)}"
+            else:
+                catalog = f"المنتجات المتاحة: {self.shopify_memory.get('categories', [])}"
+        
         if inquiry_type == 'price':
-            return f"العميل يسأل عن السعر. المنتجات المتاحة: {self.shopify_memory.get('categories', [])}. استخدم معلومات الأسعار المصرية."
+            return f"العميل يسأل عن السعر. {catalog}. استخدم معلومات الأسعار المصرية."
         elif inquiry_type == 'availability':
-            return f"العميل يسأل عن توافر منتج. المنتجات المتاحة: {self.shopify_memory.get('categories', [])}. تحقق من التوافر."
+            return f"العميل يسأل عن توافر منتج. {catalog}. تحقق من التوافر."
+        elif inquiry_type == 'product':
+            return f"العميل يسأل عن منتج. {catalog}." if products else ""
         elif inquiry_type == 'shipping':
             return "العميل يسأل عن التوصيل. معلومات التوصيل: متاح داخل القاهرة والجيزة خلال 1-2 يوم."
         else:
             return ""
     
+    def process_assistant_query(self, question, page_context=''):
+        """أسئلة المساعد الذكي العائم في لوحة التحكم"""
+        return self.ai.generate_response(question, page_context, {}, 'assistant')
+    
     def generate_daily_report(self):
         """توليد تقرير يومي"""
-        report_template = self.management_kb.get_report_template('يومي')
-        
-        # محاكاة - في الواقع يجب جلب البيانات من قاعدة البيانات
-        report_data = {
-            'الطلبات': {
-                'الاجمالي': 25,
-                'القيمة': '12500 جنيه',
-                'الناجحة': 23,
-                'الملغاة': 2
-            },
-            'العملاء': {
-                'الجدد': 8,
-                'الدائمون': 17
-            },
-            'المناديب': {
-                'النشطون': 5,
-                'افضل_مندوب': 'أحمد'
-            }
-        }
-        
-        report = f"""
-        📊 التقرير اليومي - {datetime.now().strftime('%Y-%m-%d')}
-        
-        📈 أداء الطلبات:
-        • إجمالي الطلبات: {report_data['طلبات']['الاجمالي']}
-        • القيمة الإجمالية: {report_data['طلبات']['القيمة']}
-        • الطلبات الناجحة: {report_data['طلبات']['الناجحة']}
-        • الطلبات الملغاة: {report_data['طلبات']['الملغاة']}
-        
-        👥 العملاء:
-        • عملاء جدد: {report_data['العملاء']['الجدد']}
-        • عملاء دائمون: {report_data['العملاء']['الدائمون']}
-        
-        🚚 المناديب:
-        • مناديب نشطون: {report_data['المناديب']['النشطون']}
-        • أفضل مندوب: {report_data['المناديب']['افضل_مندوب']}
-        
-        💡 توصيات:
-        • متابعة العملاء الجدد لتحويلهم إلى عملاء دائمين
-        • تحفيز المناديب على زيادة الأداء
-        • مراجعة أسباب إلغاء الطلبات
-        """
-        
-        return report
+        return self.generate_report('daily')
+    
+    def generate_report(self, period='daily', day=None):
+        """تقرير يومي/أسبوعي/شهري من بيانات قاعدة البيانات"""
+        return render_report(get_report_engine().build(period, day))
     
     def process_message(self, message_data):
         user_name = message_data.get('user_name')
         message = message_data.get('message')
         page_id = message_data.get('page_id')
+        user_id = message_data.get('user_id')
+        
+        # مسار الإدخال يحدد أول تواصل عند تسجيل الرسالة - وإلا نستعلم بالمفتاح الأساسي
+        is_first = message_data.get('is_first_contact')
+        if is_first is None:
+            is_first = get_conversation(user_id, page_id) is None
         
         # التحقق من رسالة الترحيب
-        if self._is_first_message(message_data.get('user_id'), page_id):
+        if is_first:
             welcome_msg = self._get_welcome_message(page_id)
             if welcome_msg:
                 return welcome_msg
@@ -343,49 +570,26 @@ class ResponseManager:
         if inquiry_type in ['price', 'product', 'availability', 'shipping']:
             # استخدام الذكاء الاصطناعي مع السياق المخصص
             context = self._build_context_for_inquiry(inquiry_type, message)
-            response = self.ai.generate_response(message, context, variables)
         else:
-            # استخدام الردود الافتراضية مع سياق العملاء
-            response = self.ai.generate_response(message, '', variables, 'customer')
+            context = ''
         
-        return response
-    
-    def process_message(self, message_data):
-        user_name = message_data.get('user_name')
-        message = message_data.get('message')
-        page_id = message_data.get('page_id')
-        
-        # التحقق من رسالة الترحيب
-        if self._is_first_message(message_data.get('user_id'), page_id):
-            welcome_msg = self._get_welcome_message(page_id)
-            if welcome_msg:
-                return welcome_msg
-        
-        variables = {
-            'name': user_name,
-            'page_name': self._get_page_name(page_id)
-        }
+        if not is_first:
+            # وصف ثابت فقط - تاريخ أول تواصل وعدد الرسائل يجعلان مفتاح الكاش فريداً لكل عميل
+            context = f"{context}\nعميل عائد".strip()
         
-        response = self.ai.generate_response(message, '', variables)
-        return response
+        return self.ai.generate_response(message, context, variables, 'customer')
     
     def _get_post_reply_template(self, post_id):
         # جلب قالب الرد من قاعدة البيانات
-        from db import sqlite3
-        conn = sqlite3.connect('data.db')
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
         cursor.execute('SELECT auto_reply FROM posts WHERE post_id = ?', (post_id,))
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
     
     def _get_page_name(self, page_id):
-        from db import sqlite3
-        conn = sqlite3.connect('data.db')
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
         cursor.execute('SELECT page_name FROM pages WHERE page_id = ?', (page_id,))
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else 'الصفحة'
     
     def _extract_order_id(self, message):
@@ -393,120 +597,12 @@ class ResponseManager:
         match = re.search(r'#\d+', message)
         return match.group(0) if match else ''
     
-    def _is_first_message(self, user_id, page_id):
-        from db import sqlite3
-        conn = sqlite3.connect('data.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) FROM inbox 
-            WHERE user_id = ? AND page_id = ?
-        ''', (user_id, page_id))
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count == 0
-    
     def _get_welcome_message(self, page_id):
-        from db import sqlite3
-        conn = sqlite3.connect('data.db')
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
         cursor.execute('SELECT welcome_message FROM pages WHERE page_id = ?', (page_id,))
         result = cursor.fetchone()
-        conn.close()
         return result[0] if result else None
 
-class ConnectionTester:
-    def test_facebook_connection(self, access_token):
-        try:
-            url = f"https://graph.facebook.com/v18.0/me?access_token={access_token}"
-            response = requests.get(url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    'status': 'success',
-                    'message': 'الاتصال بنجاح',
-                    'data': data
-                }
-            else:
-                return {
-                    'status': 'error',
-                    'message': f'فشل الاتصال: {response.status_code}',
-                    'error': response.text
-                }
-        except Exception as e:
-            return {
-                'status': 'error',
-                'message': 'خطأ في الاتصال',
-                'error': str(e)
-            }
-    
-    def test_whatsapp_connection(self, access_token):
-        try:
-            # اختبار الاتصال بـ WhatsApp Business API
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            # اختبار الحصول على معلومات الحساب
-            response = requests.get(
-                'https://graph.facebook.com/v18.0/me',
-                headers=headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                return {
-                    'status': 'success',
-                    'message': 'الاتصال بنجاح',
-                    'data': response.json()
-                }
-            else:
-                return {
-                    'status': 'error',
-                    'message': f'فشل الاتصال: {response.status_code}',
-                    'error': response.text
-                }
-        except Exception as e:
-            return {
-                'status': 'error',
-                'message': 'خطأ في الاتصال',
-                'error': str(e)
-            }
-    
-    def test_google_sheets_connection(self, access_token):
-        try:
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            # اختبار الوصول إلى Google Sheets API
-            response = requests.get(
-                'https://www.googleapis.com/drive/v3/files?q=mimeType="application/vnd.google-apps.spreadsheet"',
-                headers=headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                return {
-                    'status': 'success',
-                    'message': 'الاتصال بنجاح',
-                    'data': response.json()
-                }
-            else:
-                return {
-                    'status': 'error',
-                    'message': f'فشل الاتصال: {response.status_code}',
-                    'error': response.text
-                }
-        except Exception as e:
-            return {
-                'status': 'error',
-                'message': 'خطأ في الاتصال',
-                'error': str(e)
-            }
-
 # مكتبات المعرفة
 class EgyptianKnowledgeBase:
     """مكتبة المعرفة المصرية للتجارة الإلكترونية"""
@@ -523,62 +619,146 @@ class EgyptianKnowledgeBase:
                 'الاسعار': 'من 50 إلى 300 جنيه',
                 'الانواع': 'ساعات، نظارات، حقائب، مجوهرات',
                 'توصيل': '2-3 أيام لجميع المحافظات'
-    class WhatsAppReporter:
-    """نظام التقارير التلقائي للواتساب"""
+            },
+            'احذية': {
+                'الاسعار': 'من 200 إلى 700 جنيه',
+                'المقاسات': '36 - 45',
+                'الوان': 'أسود، بني، أبيض',
+                'توصيل': '1-2 يوم داخل القاهرة'
+            }
+        }
+        
+        self.shipping_info = {
+            'القاهرة': {'المدة': '1-2 يوم', 'التكلفة': '25 جنيه'},
+            'الجيزة': {'المدة': '1-2 يوم', 'التكلفة': '25 جنيه'},
+            'الإسكندرية': {'المدة': '2-3 أيام', 'التكلفة': '40 جنيه'},
+            'باقي المحافظات': {'المدة': '3-5 أيام', 'التكلفة': '50 جنيه'}
+        }
+        
+        self.payment_methods = ['كاش عند الاستلام', 'فودافون كاش', 'إنستاباي', 'تحويل بنكي']
     
-    def __init__(self, response_manager):
-        self.response_manager = response_manager
-        self.report_schedule = {
-            'daily': '09:00',  # الساعة 9 صباحاً
-            'weekly': 'monday 10:00',  # الاثنين الساعة 10
-            'monthly': '1st 09:00'  # أول الشهر الساعة 9
+    def get_product_info(self, category):
+        return self.products.get(category, {})
+    
+    def get_shipping_info(self, city):
+        return self.shipping_info.get(city, self.shipping_info['باقي المحافظات'])
+
+class ManagementKnowledgeBase:
+    """مكتبة المعرفة الإدارية للمساعدة والتقارير"""
+    
+    def __init__(self):
+        self.kpis = {
+            'معدل التحويل': 'عدد الطلبات ÷ عدد المحادثات',
+            'متوسط وقت الرد': 'الوقت بين الرسالة والرد الأول',
+            'معدل الإلغاء': 'الطلبات الملغاة ÷ إجمالي الطلبات',
+            'أداء المندوب': 'الطلبات المكتملة ÷ الطلبات المسندة'
+        }
+        
+        self.report_templates = {
+            'يومي': ['الطلبات', 'العملاء', 'المناديب', 'توصيات'],
+            'أسبوعي': ['الطلبات', 'العملاء', 'المناديب', 'المقارنة', 'توصيات'],
+            'شهري': ['الطلبات', 'العملاء', 'المناديب', 'الاتجاهات', 'توصيات']
         }
     
+    def get_report_template(self, report_type):
+        return self.report_templates.get(report_type, self.report_templates['يومي'])
+
+def generate_quick_buttons(inquiry_type):
+    """أزرار الرد السريع حسب نوع الاستفسار"""
+    buttons = {
+        'price': ['اطلب الآن', 'شوف المقاسات', 'كلم خدمة العملاء'],
+        'availability': ['اطلب الآن', 'منتجات مشابهة'],
+        'shipping': ['مناطق التوصيل', 'تتبع طلبي'],
+        'product': ['تفاصيل المنتج', 'اطلب الآن']
+    }
+    return buttons.get(inquiry_type, ['كلم خدمة العملاء'])
+
+# مواعيد التقارير المجدولة (ينفذها scheduler.py) ورقم المسؤول الافتراضي
+REPORT_SCHEDULE = {
+    'daily': os.environ.get('REPORT_DAILY_AT', '09:00'),  # الساعة 9 صباحاً
+    'weekly': os.environ.get('REPORT_WEEKLY_AT', 'monday 10:00'),  # الاثنين الساعة 10
+    'monthly': os.environ.get('REPORT_MONTHLY_AT', '1st 09:00')  # أول الشهر الساعة 9
+}
+REPORT_PHONE = os.environ.get('REPORT_PHONE', '')
+
+class WhatsAppReporter:
+    """نظام التقارير التلقائي للواتساب - الرسائل تمر عبر outbox وتُرسل في الخلفية"""
+    
+    def __init__(self, response_manager, on_queued=None):
+        self.response_manager = response_manager
+        self.report_schedule = dict(REPORT_SCHEDULE)
+        # يُستدعى برقم التقرير بعد حفظ رسائله (لإضافة مهمة الإرسال إلى الطابور)
+        self.on_queued = on_queued
+    
+    def _queue(self, report_type, title, messages, content=''):
+        report_id = queue_messages(report_type, title, messages, content)
+        add_log('info', f'{title}: {len(messages)} WhatsApp messages queued (report {report_id})', 'whatsapp_reporter')
+        if self.on_queued:
+            self.on_queued(report_id)
+        return report_id
+    
     def send_daily_report(self, admin_phone):
         """إرسال التقرير اليومي عبر واتساب"""
+        return self.send_report(admin_phone, 'daily')
+    
+    def send_report(self, admin_phone, period='daily', day=None):
+        """إرسال تقرير يومي/أسبوعي/شهري عبر واتساب - ترجع رقم التقرير أو None"""
         try:
-            report = self.response_manager.generate_daily_report()
-            
-            # محاكاة - في الواقع يجب استخدام WhatsApp Business API
-            print(f"📱 إرسال تقرير يومي إلى {admin_phone}")
-            print(report)
-            
-            # تسجيل الإرسال
-            add_log('info', f'Daily report sent to {admin_phone}', 'whatsapp_reporter')
-            
-            return True
+            report = self.response_manager.generate_report(period, day)
+            return self._queue(period, f'{period} report', [(admin_phone, report)], report)
             
         except Exception as e:
-            add_log('error', f'Failed to send daily report: {str(e)}', 'whatsapp_reporter')
-            return False
+            add_log('error', f'Failed to send {period} report: {str(e)}', 'whatsapp_reporter')
+            return None
+    
+    def build_agent_report(self, agent_data):
+        """نص تقرير أداء مندوب واحد (المبيعات والتقييم فقط إن توفرت)"""
+        lines = [
+            f"📊 تقرير أدائك اليومي - {agent_data.get('day') or datetime.now().strftime('%Y-%m-%d')}",
+            '',
+            f"🚚 الطلبات المكتملة: {agent_data.get('completed_orders', 0)}"
+        ]
+        if 'total_sales' in agent_data:
+            lines.append(f"💰 إجمالي المبيعات: {agent_data['total_sales']} جنيه")
+        if 'customer_rating' in agent_data:
+            lines.append(f"⭐ تقييم العملاء: {agent_data['customer_rating']}/5")
+        lines += [
+            f"🏆 ترتيبك: #{agent_data.get('rank', 0)} بين المناديب",
+            '',
+            '💡 نصائح لتحسين الأداء:',
+            '• حاول تقليل وقت التوصيل',
+            '• تواصل بشكل أفضل مع العملاء',
+            '• استفد من ساعات الذروة',
+            '',
+            'استمر في العمل الجيد! 👏'
+        ]
+        return '\n'.join(lines)
     
     def send_agent_performance_report(self, agent_phone, agent_data):
         """إرسال تقرير أداء المندوب"""
         try:
-            report = f"""
-            📊 تقرير أدائك اليومي - {datetime.now().strftime('%Y-%m-%d')}
-            
-            🚚 الطلبات المكتملة: {agent_data.get('completed_orders', 0)}
-            💰 إجمالي المبيعات: {agent_data.get('total_sales', 0)} جنيه
-            ⭐ تقييم العملاء: {agent_data.get('customer_rating', 0)}/5
-            🏆 ترتيبك: #{agent_data.get('rank', 0)} بين المناديب
-            
-            💡 نصائح لتحسين الأداء:
-            • حاول تقليل وقت التوصيل
-            • تواصل بشكل أفضل مع العملاء
-            • استفد من ساعات الذروة
-            
-            استمر في العمل الجيد! 👏
-            """
-            
-            print(f"📱 إرسال تقرير أداء إلى {agent_phone}")
-            print(report)
-            
-            return True
+            return self._queue('agent', 'agent report', [(agent_phone, self.build_agent_report(agent_data))])
             
         except Exception as e:
             add_log('error', f'Failed to send agent report: {str(e)}', 'whatsapp_reporter')
-            return False
+            return None
+    
+    def send_agent_reports(self, period='daily', day=None):
+        """تقرير أداء لكل المناديب النشطين في تقرير واحد (رسالة لكل مندوب)"""
+        report = get_report_engine().build(period, day)
+        ranking = {agent['agent_id']: (rank, agent) for rank, agent in enumerate(report['agents']['ranking'], 1)}
+        
+        cursor = get_connection().cursor()
+        cursor.execute("SELECT agent_id, phone FROM agents WHERE status = 1 AND phone IS NOT NULL AND phone != ''")
+        messages = []
+        for agent_id, phone in cursor.fetchall():
+            rank, stats = ranking.get(agent_id, (len(ranking) + 1, {}))
+            messages.append((phone, self.build_agent_report({
+                'day': report['end'],
+                'completed_orders': stats.get('completed', 0),
+                'rank': rank
+            })))
+        return self._queue('agent', f'agent {period} reports', messages)
 
 if __name__ == '__main__':
     # اختبار الوظائف
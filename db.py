@@ -1,11 +1,22 @@
-import sqlite3
+import base64
+import binascii
 import json
-from datetime import datetime
+import time
+import threading
+from datetime import datetime, date, timedelta
+from dbpool import get_connection, transaction
+from logsink import log_sink
 
-def init_database():
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
+# صيغة التخزين الموحدة للتواريخ - نصية قابلة للمقارنة بالترتيب (تسمح باستخدام الفهارس)
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def init_database(migrate=True):
+    with transaction() as cursor:
+        _create_tables(cursor)
+    if migrate:
+        run_migrations()
+
+def _create_tables(cursor):
     # جدول الإعدادات والخدمات
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS settings (
@@ -155,14 +166,67 @@ def init_database():
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
+
+    # جدول المهام الخلفية (الردود التلقائية وغيرها)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            dedup_key TEXT UNIQUE,
+            payload TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 5,
+            run_after REAL,
+            locked_by TEXT,
+            locked_at REAL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_after)')
+
+    # ذاكرة الردود المؤقتة للذكاء الاصطناعي
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS response_cache (
+            cache_key TEXT PRIMARY KEY,
+            tier TEXT,
+            context_type TEXT,
+            response TEXT,
+            created_at REAL,
+            expires_at REAL,
+            last_used_at REAL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache (expires_at)')
+
+    # عداد إصدار الإعدادات - يزيد تلقائياً مع أي تعديل على جدول settings
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO app_meta (key, value) VALUES ('settings_version', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS settings_version_{event.lower()}
+            AFTER {event} ON settings
+            BEGIN
+                UPDATE app_meta SET value = value + 1 WHERE key = 'settings_version';
+            END
+        ''')
+
     # إدخال الإعدادات الافتراضية
     default_settings = [
         ('facebook', '', '', 0, '{}'),
         ('whatsapp', '', '', 0, '{}'),
         ('googlesheet', '', '', 0, '{}'),
         ('openai', '', '', 0, '{}'),
-        ('deepseek', '', '', 0, '{}')
+        ('deepseek', '', '', 0, '{}'),
+        ('shopify', '', '', 0, '{}')
     ]
     
     for service, token, refresh, status, config in default_settings:
@@ -170,55 +234,606 @@ def init_database():
             INSERT OR IGNORE INTO settings (service_name, access_token, refresh_token, status, config)
             VALUES (?, ?, ?, ?, ?)
         ''', (service, token, refresh, status, config))
+
+# ترحيلات المخطط - تضاف دائماً في النهاية برقم إصدار جديد ولا تعدل بعد نشرها
+# كل ترحيل إما قائمة أوامر SQL أو دالة تستقبل cursor
+MIGRATIONS = [
+    (1, 'indexes for hot query paths', [
+        'CREATE INDEX IF NOT EXISTS idx_inbox_user_page ON inbox (user_id, page_id)',
+        'CREATE INDEX IF NOT EXISTS idx_inbox_created ON inbox (created_time)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_created ON comments (created_time)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_status ON comments (status, id)',
+        'CREATE INDEX IF NOT EXISTS idx_comments_post ON comments (post_id)',
+        'CREATE INDEX IF NOT EXISTS idx_posts_page ON posts (page_id)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_agent_status ON orders (agent_id, status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_agents_status ON agents (status, agent_id)',
+        'CREATE INDEX IF NOT EXISTS idx_logs_created ON logs (created_at)',
+    ]),
+    (2, 'canonical sortable timestamps', [
+        f"""UPDATE {table} SET {column} = REPLACE(SUBSTR({column}, 1, 19), 'T', ' ')
+            WHERE {column} LIKE '____-__-__T%'"""
+        for table, column in (
+            ('inbox', 'created_time'), ('inbox', 'replied_at'),
+            ('comments', 'created_time'), ('comments', 'replied_at'),
+            ('posts', 'created_time'), ('orders', 'created_at')
+        )
+    ]),
+    (3, 'conversations table for first-contact lookups', [
+        '''CREATE TABLE IF NOT EXISTS conversations (
+            user_id TEXT NOT NULL,
+            page_id TEXT NOT NULL,
+            user_name TEXT,
+            first_seen TIMESTAMP,
+            last_seen TIMESTAMP,
+            message_count INTEGER DEFAULT 0,
+            last_message TEXT,
+            PRIMARY KEY (user_id, page_id)
+        ) WITHOUT ROWID''',
+        '''INSERT OR IGNORE INTO conversations (user_id, page_id, user_name, first_seen, last_seen, message_count)
+            SELECT user_id, page_id, MAX(user_name), MIN(created_time), MAX(created_time), COUNT(*)
+            FROM inbox WHERE user_id IS NOT NULL AND page_id IS NOT NULL
+            GROUP BY user_id, page_id''',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_first_seen ON conversations (first_seen)',
+    ]),
+    (4, 'incremental dashboard statistics', lambda cursor: _create_stats_tables(cursor)),
+    (5, 'log rollups for retention', [
+        '''CREATE TABLE IF NOT EXISTS log_rollups (
+            day TEXT NOT NULL,
+            level TEXT NOT NULL,
+            service TEXT NOT NULL,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (day, level, service)
+        ) WITHOUT ROWID''',
+    ]),
+    (6, 'product search watermark and stock', [
+        'ALTER TABLE shopify_products ADD COLUMN inventory_quantity INTEGER',
+        'CREATE INDEX IF NOT EXISTS idx_shopify_products_updated ON shopify_products (updated_at)',
+        # أي تعديل لا يمس updated_at يحدثه تلقائياً حتى يلتقطه فهرس البحث
+        '''CREATE TRIGGER IF NOT EXISTS shopify_products_touch
+            AFTER UPDATE ON shopify_products
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE shopify_products SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+            END''',
+    ]),
+    (7, 'sync cursors for external catalogs', [
+        '''CREATE TABLE IF NOT EXISTS sync_state (
+            name TEXT PRIMARY KEY,
+            cursor TEXT,
+            last_run_at TIMESTAMP,
+            last_status TEXT,
+            items INTEGER DEFAULT 0,
+            details TEXT
+        )''',
+    ]),
+    (8, 'keyset indexes for the orders list', [
+        # كل فهرس يحمل rowid (= id) ضمنياً، فالترتيب (created_at, id) يُقرأ من الفهرس مباشرة
+        'CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_orders_agent_created ON orders (agent_id, created_at)',
+    ]),
+    (9, 'delivery zones for order dispatch', [
+        'ALTER TABLE orders ADD COLUMN city TEXT',
+        'ALTER TABLE agents ADD COLUMN zone TEXT',
+    ]),
+    (10, 'periodic job store and scheduler lock', [
+        '''CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            name TEXT PRIMARY KEY,
+            schedule TEXT,
+            next_run_at REAL,
+            last_run_at REAL,
+            last_status TEXT,
+            runs INTEGER DEFAULT 0
+        )''',
+        '''CREATE TABLE IF NOT EXISTS scheduler_lock (
+            name TEXT PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL
+        )''',
+    ]),
+    (11, 'whatsapp outbox and report delivery counters', [
+        '''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            report_id INTEGER,
+            recipient TEXT NOT NULL,
+            body TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL,
+            provider_id TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_report ON outbox (report_id, status)',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_provider ON outbox (provider_id)',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_sent ON outbox (sent_at)',
+        'ALTER TABLE reports ADD COLUMN total_count INTEGER DEFAULT 0',
+        'ALTER TABLE reports ADD COLUMN sent_count INTEGER DEFAULT 0',
+        'ALTER TABLE reports ADD COLUMN failed_count INTEGER DEFAULT 0',
+    ]),
+    (12, 'shared rate limit windows', [
+        '''CREATE TABLE IF NOT EXISTS rate_limits (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            window_start REAL NOT NULL,
+            count INTEGER DEFAULT 0,
+            expires_at REAL,
+            PRIMARY KEY (scope, key, window_start)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_rate_limits_expires ON rate_limits (expires_at)',
+    ]),
+    (13, 'orders watermark and spreadsheet row map', [
+        'CREATE INDEX IF NOT EXISTS idx_orders_updated ON orders (updated_at)',
+        # أي تعديل لا يمس updated_at يحدثه تلقائياً حتى تلتقطه مزامنة الجدول
+        '''CREATE TRIGGER IF NOT EXISTS orders_touch
+            AFTER UPDATE ON orders
+            WHEN NEW.updated_at IS OLD.updated_at
+            BEGIN
+                UPDATE orders SET updated_at = DATETIME('now', 'localtime') WHERE id = NEW.id;
+            END''',
+        '''CREATE TABLE IF NOT EXISTS sheet_rows (
+            order_id TEXT PRIMARY KEY,
+            row_number INTEGER,
+            row_hash TEXT,
+            synced_at TIMESTAMP
+        ) WITHOUT ROWID''',
+    ]),
+    (14, 'service health checks', [
+        '''CREATE TABLE IF NOT EXISTS service_health (
+            service TEXT PRIMARY KEY,
+            status TEXT,
+            latency_ms REAL,
+            http_status INTEGER,
+            checked_at TIMESTAMP,
+            last_ok_at TIMESTAMP,
+            last_error TEXT,
+            last_error_at TIMESTAMP,
+            failures INTEGER DEFAULT 0
+        )''',
+    ]),
+    (15, 'orders updated_at default in local time', [
+        # القيمة الافتراضية للعمود CURRENT_TIMESTAMP (UTC) بينما التطبيق و orders_touch يكتبان بالتوقيت المحلي
+        # (format_timestamp) - الإدخال بدون updated_at يُحول للمحلي حتى لا يختلط التوقيتان في مؤشر المزامنة
+        '''CREATE TRIGGER IF NOT EXISTS orders_insert_local
+            AFTER INSERT ON orders
+            WHEN NEW.updated_at IS NULL OR NEW.updated_at = DATETIME('now')
+            BEGIN
+                UPDATE orders SET updated_at = DATETIME('now', 'localtime') WHERE id = NEW.id;
+            END''',
+    ]),
+    (16, 'agent events shared across processes', [
+        # التسلسل هو معرف الحدث في SSE - AUTOINCREMENT حتى لا يُعاد استخدام رقم بعد الحذف
+        '''CREATE TABLE IF NOT EXISTS events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            data TEXT,
+            created_at REAL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_events_topic ON events (topic, seq)',
+        'CREATE INDEX IF NOT EXISTS idx_events_created ON events (created_at)',
+    ]),
+    (17, 'daily stats and order defaults in local time', lambda cursor: _local_clock(cursor)),
+]
+
+# عدادات يومية تحدثها triggers مع كل إدخال (اليوم = أول 10 أحرف من التاريخ)
+DAILY_STAT_SOURCES = (
+    ('inbox', 'created_time', 'inbox_count'),
+    ('comments', 'created_time', 'comments_count'),
+    ('orders', 'created_at', 'orders_created'),
+)
+
+def _create_daily_stat_triggers(cursor):
+    # اليوم بالتوقيت المحلي مثل date.today() في اللوحة والتقارير
+    for table, column, counter in DAILY_STAT_SOURCES:
+        for event, row, delta in (('INSERT', 'NEW', '+ 1'), ('DELETE', 'OLD', '- 1')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_daily_stats_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO daily_stats (day, {counter})
+                    VALUES (COALESCE(SUBSTR({row}.{column}, 1, 10), DATE('now', 'localtime')), 0)
+                    ON CONFLICT (day) DO NOTHING;
+                    UPDATE daily_stats SET {counter} = {counter} {delta}
+                    WHERE day = COALESCE(SUBSTR({row}.{column}, 1, 10), DATE('now', 'localtime'));
+                END
+            ''')
+
+def _local_clock(cursor):
+    """الترحيل 17: الإحصائيات اليومية و created_at للطلبات بالتوقيت المحلي"""
+    for table, _, _ in DAILY_STAT_SOURCES:
+        for event in ('insert', 'delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {table}_daily_stats_{event}')
+    _create_daily_stat_triggers(cursor)
+    # القيمة الافتراضية CURRENT_TIMESTAMP (UTC) لا تتغير بدون إعادة بناء الجدول - نحولها بعد الإدخال
+    # ونصحح عداد اليوم الذي سجله orders_daily_stats_insert بتاريخ UTC (الترتيب بين المشغلين لا يهم)
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS orders_created_local
+            AFTER INSERT ON orders
+            WHEN NEW.created_at = DATETIME('now') AND DATETIME('now') != DATETIME('now', 'localtime')
+            BEGIN
+                UPDATE orders SET created_at = DATETIME('now', 'localtime') WHERE id = NEW.id;
+                INSERT INTO daily_stats (day, orders_created) VALUES (SUBSTR(NEW.created_at, 1, 10), -1)
+                ON CONFLICT (day) DO UPDATE SET orders_created = orders_created - 1;
+                INSERT INTO daily_stats (day, orders_created) VALUES (DATE('now', 'localtime'), 1)
+                ON CONFLICT (day) DO UPDATE SET orders_created = orders_created + 1;
+            END
+    ''')
+
+def _create_stats_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            inbox_count INTEGER DEFAULT 0,
+            comments_count INTEGER DEFAULT 0,
+            orders_created INTEGER DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stat_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+    
+    _create_daily_stat_triggers(cursor)
+    
+    # عدد الطلبات لكل حالة وعدد المناديب النشطين
+    for statement in (
+        '''CREATE TRIGGER IF NOT EXISTS orders_status_counter_insert AFTER INSERT ON orders
+            BEGIN
+                INSERT INTO stat_counters (name, value) VALUES ('orders_status:' || NEW.status, 1)
+                ON CONFLICT (name) DO UPDATE SET value = value + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS orders_status_counter_update AFTER UPDATE OF status ON orders
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                UPDATE stat_counters SET value = value - 1 WHERE name = 'orders_status:' || OLD.status;
+                INSERT INTO stat_counters (name, value) VALUES ('orders_status:' || NEW.status, 1)
+                ON CONFLICT (name) DO UPDATE SET value = value + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS orders_status_counter_delete AFTER DELETE ON orders
+            BEGIN
+                UPDATE stat_counters SET value = value - 1 WHERE name = 'orders_status:' || OLD.status;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS agents_active_counter_insert AFTER INSERT ON agents
+            WHEN NEW.status = 1
+            BEGIN
+                UPDATE stat_counters SET value = value + 1 WHERE name = 'agents_active';
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS agents_active_counter_update AFTER UPDATE OF status ON agents
+            WHEN (OLD.status = 1) IS NOT (NEW.status = 1)
+            BEGIN
+                UPDATE stat_counters SET value = value + (CASE WHEN NEW.status = 1 THEN 1 ELSE -1 END)
+                WHERE name = 'agents_active';
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS agents_active_counter_delete AFTER DELETE ON agents
+            WHEN OLD.status = 1
+            BEGIN
+                UPDATE stat_counters SET value = value - 1 WHERE name = 'agents_active';
+            END''',
+    ):
+        cursor.execute(statement)
+    
+    rebuild_stats(cursor)
+
+def rebuild_stats(cursor, since_day=None):
+    """إعادة حساب الإحصائيات من الجداول الأصلية (كلها أو من يوم معين) لتصحيح أي انحراف"""
+    if since_day is None:
+        cursor.execute('DELETE FROM daily_stats')
+    else:
+        cursor.execute('DELETE FROM daily_stats WHERE day >= ?', (since_day,))
+    
+    for table, column, counter in DAILY_STAT_SOURCES:
+        cursor.execute(f'''
+            INSERT INTO daily_stats (day, {counter})
+            SELECT COALESCE(SUBSTR({column}, 1, 10), DATE('now', 'localtime')) AS day, COUNT(*)
+            FROM {table}
+            WHERE ? IS NULL OR {column} >= ?
+            GROUP BY day
+            ON CONFLICT (day) DO UPDATE SET {counter} = excluded.{counter}
+        ''', (since_day, since_day))
     
-    conn.commit()
-    conn.close()
+    cursor.execute("DELETE FROM stat_counters")
+    cursor.execute('''
+        INSERT INTO stat_counters (name, value)
+        SELECT 'orders_status:' || status, COUNT(*) FROM orders WHERE status IS NOT NULL GROUP BY status
+    ''')
+    cursor.execute('''
+        INSERT INTO stat_counters (name, value)
+        SELECT 'agents_active', COUNT(*) FROM agents WHERE status = 1
+    ''')
+
+def run_migrations():
+    """تطبيق الترحيلات غير المطبقة بالترتيب - كل ترحيل في معاملة مستقلة"""
+    with transaction() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+    for version, name, steps in MIGRATIONS:
+        if version <= get_schema_version():
+            continue
+        with transaction(immediate=True) as cursor:
+            # إعادة التحقق بعد أخذ القفل (عدة عمليات قد تبدأ في نفس الوقت)
+            cursor.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,))
+            if cursor.fetchone():
+                continue
+            if callable(steps):
+                steps(cursor)
+            else:
+                for statement in steps:
+                    cursor.execute(statement)
+            cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+    
+    get_connection().execute('PRAGMA optimize')
+
+def get_schema_version():
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT MAX(version) FROM schema_migrations')
+    return cursor.fetchone()[0] or 0
+
+def format_timestamp(value=None):
+    """تحويل datetime أو ISO 8601 أو Unix timestamp إلى صيغة التخزين الموحدة"""
+    if value is None:
+        value = datetime.now()
+    elif isinstance(value, (int, float)):
+        # فيسبوك يرسل timestamp بالمللي ثانية في الرسائل
+        value = datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    elif isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return value[:19].replace('T', ' ')
+    if value.tzinfo is not None:
+        # فيسبوك يرسل created_time بتوقيت UTC ("+0000") - كل الأعمدة بالتوقيت المحلي مثل date.today()
+        value = value.astimezone().replace(tzinfo=None)
+    return value.strftime(TIMESTAMP_FORMAT)
+
+def day_range(day=None):
+    """بداية ونهاية اليوم كنصوص - للاستعلام بـ >= و < بدلاً من DATE(column)"""
+    day = day or date.today()
+    start = datetime(day.year, day.month, day.day)
+    return start.strftime(TIMESTAMP_FORMAT), (start + timedelta(days=1)).strftime(TIMESTAMP_FORMAT)
+
+def get_conversation(user_id, page_id):
+    """بيانات المحادثة (أول/آخر تواصل وعدد الرسائل) أو None لعميل جديد"""
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT user_id, page_id, user_name, first_seen, last_seen, message_count, last_message
+        FROM conversations WHERE user_id = ? AND page_id = ?
+    ''', (user_id, page_id))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    return dict(zip(('user_id', 'page_id', 'user_name', 'first_seen', 'last_seen',
+                     'message_count', 'last_message'), row))
+
+DASHBOARD_CACHE_TTL = 5
+_dashboard_cache = {'expires_at': 0, 'value': None}
+_dashboard_cache_lock = threading.Lock()
+
+def get_dashboard_stats():
+    """إحصائيات لوحة التحكم من العدادات المجمعة - مع ذاكرة مؤقتة قصيرة داخل العملية"""
+    now = time.monotonic()
+    cached = _dashboard_cache
+    if cached['value'] is not None and cached['expires_at'] > now:
+        return cached['value']
+    
+    with _dashboard_cache_lock:
+        if _dashboard_cache['value'] is not None and _dashboard_cache['expires_at'] > now:
+            return _dashboard_cache['value']
+        
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT
+                COALESCE((SELECT inbox_count FROM daily_stats WHERE day = :day), 0),
+                COALESCE((SELECT comments_count FROM daily_stats WHERE day = :day), 0),
+                COALESCE((SELECT value FROM stat_counters WHERE name = 'orders_status:new'), 0),
+                COALESCE((SELECT value FROM stat_counters WHERE name = 'agents_active'), 0)
+        ''', {'day': date.today().isoformat()})
+        today_messages, today_comments, new_orders, active_agents = cursor.fetchone()
+        
+        value = {
+            'today_messages': today_messages,
+            'today_comments': today_comments,
+            'new_orders': new_orders,
+            'active_agents': active_agents,
+            'services': get_services_status()
+        }
+        _dashboard_cache['value'] = value
+        _dashboard_cache['expires_at'] = now + DASHBOARD_CACHE_TTL
+        return value
+
+ORDER_STATUSES = ('new', 'assigned', 'in_progress', 'completed', 'cancelled')
+ORDER_SORTS = {'newest': 'DESC', 'oldest': 'ASC'}
+ORDERS_PAGE_MAX = 200
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token):
+    """مؤشر الصفحة التالية [created_at, id] - يرفع ValueError إذا كان تالفاً"""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return str(created_at), int(row_id)
+    except (TypeError, ValueError, binascii.Error):
+        raise ValueError('invalid cursor')
+
+def list_orders(status=None, agent_id=None, date_from=None, date_to=None,
+                sort='newest', after=None, limit=50, search=None):
+    """صفحة من الطلبات بترقيم keyset على (created_at, id) - زمن ثابت مهما كان رقم الصفحة"""
+    direction = ORDER_SORTS.get(sort, 'DESC')
+    limit = max(1, min(int(limit), ORDERS_PAGE_MAX))
+    
+    where, params = [], []
+    if status:
+        where.append('o.status = ?')
+        params.append(status)
+    if agent_id:
+        where.append('o.agent_id = ?')
+        params.append(agent_id)
+    if date_from:
+        where.append('o.created_at >= ?')
+        params.append(day_range(date_from)[0])
+    if date_to:
+        where.append('o.created_at < ?')
+        params.append(day_range(date_to)[1])
+    if search:
+        # رقم الطلب أو اسم العميل أو هاتفه أو المنتج - على كل الطلبات وليس الصفحة المحملة فقط
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where.append("(o.order_id LIKE ? ESCAPE '\\' OR o.customer_name LIKE ? ESCAPE '\\' "
+                     "OR o.customer_phone LIKE ? ESCAPE '\\' OR o.product LIKE ? ESCAPE '\\')")
+        params.extend([pattern] * 4)
+    if after:
+        where.append(f"(o.created_at, o.id) {'<' if direction == 'DESC' else '>'} (?, ?)")
+        params.extend(decode_cursor(after))
+    
+    query = f'''
+        SELECT o.id, o.order_id, o.customer_name, o.customer_phone, o.product, o.quantity,
+               o.status, o.agent_id, o.created_at, a.name AS agent_name
+        FROM orders o
+        LEFT JOIN agents a ON o.agent_id = a.agent_id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY o.created_at {direction}, o.id {direction}
+        LIMIT ?
+    '''
+    cursor = get_connection().cursor()
+    cursor.execute(query, params + [limit + 1])
+    columns = [c[0] for c in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['created_at'], rows[-1]['id']])
+    return {'orders': rows, 'next_cursor': next_cursor}
+
+ORDER_COLUMNS = ('id', 'order_id', 'customer_name', 'customer_phone', 'product', 'quantity',
+                 'status', 'agent_id', 'created_at')
+_UNCHANGED = object()
+
+def update_order(order_id, status, agent_id=_UNCHANGED, expected_statuses=None, expected_agents=None):
+    """تحديث حالة الطلب (ومندوبه) بشرط الحالة/المندوب الحاليين - ترجع (قبل، بعد) أو None"""
+    columns = ', '.join(ORDER_COLUMNS)
+    with transaction(immediate=True) as cursor:
+        cursor.execute(f'SELECT {columns} FROM orders WHERE order_id = ?', (order_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        before = dict(zip(ORDER_COLUMNS, row))
+        if expected_statuses and before['status'] not in expected_statuses:
+            return None
+        if expected_agents is not None and before['agent_id'] not in expected_agents:
+            return None
+        
+        after = dict(before, status=status)
+        if agent_id is not _UNCHANGED:
+            after['agent_id'] = agent_id
+        cursor.execute('''
+            UPDATE orders SET status = ?, agent_id = ?, updated_at = ? WHERE id = ?
+        ''', (status, after['agent_id'], format_timestamp(), before['id']))
+    return before, after
+
+def get_order_status_counts():
+    """عدد الطلبات لكل حالة من العدادات المحدثة بالـ triggers"""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT name, value FROM stat_counters WHERE name LIKE 'orders_status:%'")
+    counts = {status: 0 for status in ORDER_STATUSES}
+    for name, value in cursor.fetchall():
+        counts[name.split(':', 1)[1]] = value
+    counts['total'] = sum(counts.values())
+    return counts
+
+def get_services_status():
+    """حالة كل الخدمات باستعلام واحد"""
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT service_name, status FROM settings')
+    return {name: bool(status) for name, status in cursor.fetchall()}
 
 def get_service_status(service_name):
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     cursor.execute('SELECT status FROM settings WHERE service_name = ?', (service_name,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else False
 
 def update_service_status(service_name, status):
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE settings SET status = ?, updated_at = CURRENT_TIMESTAMP 
-        WHERE service_name = ?
-    ''', (status, service_name))
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE settings SET status = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE service_name = ?
+        ''', (status, service_name))
 
 def save_service_token(service_name, access_token, refresh_token=''):
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE settings SET access_token = ?, refresh_token = ?, updated_at = CURRENT_TIMESTAMP 
-        WHERE service_name = ?
-    ''', (access_token, refresh_token, service_name))
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE settings SET access_token = ?, refresh_token = ?, updated_at = CURRENT_TIMESTAMP 
+            WHERE service_name = ?
+        ''', (access_token, refresh_token, service_name))
 
 def get_service_token(service_name):
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     cursor.execute('SELECT access_token FROM settings WHERE service_name = ?', (service_name,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
+def get_service_config(service_name):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT config FROM settings WHERE service_name = ?', (service_name,))
+    result = cursor.fetchone()
+    try:
+        return json.loads(result[0]) if result and result[0] else {}
+    except ValueError:
+        return {}
+
+def save_service_config(service_name, config):
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE settings SET config = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE service_name = ?
+        ''', (json.dumps(config, ensure_ascii=False), service_name))
+
+def get_sync_state(name):
+    """آخر مؤشر مزامنة محفوظ (cursor) وحالة آخر تشغيل"""
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT cursor, last_run_at, last_status, items, details FROM sync_state WHERE name = ?
+    ''', (name,))
+    row = cursor.fetchone()
+    if not row:
+        return {'cursor': None, 'last_run_at': None, 'last_status': None, 'items': 0, 'details': None}
+    return dict(zip(('cursor', 'last_run_at', 'last_status', 'items', 'details'), row))
+
+def save_sync_state(name, status, items=0, cursor_value=None, details=''):
+    """حفظ نتيجة التشغيل - المؤشر لا يتغير إذا كان cursor_value فارغاً"""
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO sync_state (name, cursor, last_run_at, last_status, items, details)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                cursor = COALESCE(excluded.cursor, sync_state.cursor),
+                last_run_at = excluded.last_run_at,
+                last_status = excluded.last_status,
+                items = excluded.items,
+                details = excluded.details
+        ''', (name, cursor_value, format_timestamp(), status, items, details))
+
+def get_settings_version():
+    """رقم إصدار الإعدادات الحالي (يتغير عند أي تعديل من أي عملية)"""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT value FROM app_meta WHERE key = 'settings_version'")
+    result = cursor.fetchone()
+    return result[0] if result else 0
+
 def add_log(level, message, service='', details=''):
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO logs (level, message, service, details)
-        VALUES (?, ?, ?, ?)
-    ''', (level, message, service, details))
-    conn.commit()
-    conn.close()
+    # يكتب في الخلفية على دفعات - لا ينتظر قاعدة البيانات
+    log_sink.emit(level, message, service, details)
 
 if __name__ == '__main__':
     init_database()
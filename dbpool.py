@@ -0,0 +1,137 @@
+"""
+طبقة الاتصال المشتركة بقاعدة البيانات
+اتصال واحد لكل خيط يتم إعداده مرة واحدة (WAL + mmap + cache)
+"""
+
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = os.environ.get('DATABASE_PATH', 'data.db')
+
+# إعدادات SQLite التي تطبق مرة واحدة عند فتح الاتصال
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('temp_store', 'MEMORY'),
+    ('mmap_size', int(os.environ.get('DATABASE_MMAP_SIZE', 256 * 1024 * 1024))),
+    ('cache_size', -int(os.environ.get('DATABASE_CACHE_KB', 64 * 1024))),
+    ('foreign_keys', 'OFF'),
+)
+
+BUSY_TIMEOUT = float(os.environ.get('DATABASE_BUSY_TIMEOUT', 30))
+
+
+class _ConnectionHolder:
+    """يغلق اتصال الخيط تلقائياً عند انتهاء الخيط"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except sqlite3.Error:
+                pass
+            self.conn = None
+
+    def __del__(self):
+        self.close()
+
+
+class ConnectionPool:
+    """مجمع اتصالات SQLite - اتصال مستقل لكل خيط"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or DEFAULT_DB_PATH
+        self._local = threading.local()
+        self._holders = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False
+        )
+        for name, value in PRAGMAS:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def connection(self):
+        """إرجاع اتصال الخيط الحالي (يُنشأ عند أول استخدام)"""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None or holder.conn is None:
+            holder = _ConnectionHolder(self._connect())
+            self._local.holder = holder
+            with self._lock:
+                self._holders.add(holder)
+        return holder.conn
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """معاملة مع commit تلقائي أو rollback عند الخطأ"""
+        conn = self.connection()
+        if conn.in_transaction:
+            # معاملة متداخلة - تنفذ ضمن المعاملة الخارجية
+            yield conn.cursor()
+            return
+
+        if immediate:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close_thread_connection(self):
+        holder = getattr(self._local, 'holder', None)
+        if holder is not None:
+            holder.close()
+            self._local.holder = None
+
+    def close_all(self):
+        """إغلاق جميع الاتصالات المفتوحة (عند الإيقاف أو تغيير المسار)"""
+        with self._lock:
+            holders = list(self._holders)
+            self._holders = weakref.WeakSet()
+        for holder in holders:
+            holder.close()
+        self._local = threading.local()
+
+
+_pool = ConnectionPool()
+
+
+def configure(db_path):
+    """تغيير مسار قاعدة البيانات وإغلاق الاتصالات القديمة"""
+    global _pool
+    old_pool = _pool
+    _pool = ConnectionPool(db_path)
+    old_pool.close_all()
+    return _pool
+
+
+def get_pool():
+    return _pool
+
+
+def get_db_path():
+    return _pool.db_path
+
+
+def get_connection():
+    return _pool.connection()
+
+
+def transaction(immediate=False):
+    return _pool.transaction(immediate)
+
+
+def close_all():
+    _pool.close_all()
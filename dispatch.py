@@ -0,0 +1,219 @@
+"""
+إسناد الطلبات الجديدة للمناديب تلقائياً
+حمل كل مندوب (طلباته المفتوحة) في الذاكرة + استراتيجيات قابلة للتبديل
+"""
+
+import os
+import time
+import threading
+from dbpool import get_connection, transaction
+from db import format_timestamp, ORDER_COLUMNS
+from arabic import normalize_arabic
+from core import EgyptianKnowledgeBase
+
+DISPATCH_BATCH = int(os.environ.get('DISPATCH_BATCH', 500))
+DISPATCH_MAX_OPEN = int(os.environ.get('DISPATCH_MAX_OPEN', 20))
+DISPATCH_STRATEGY = os.environ.get('DISPATCH_STRATEGY', 'least_loaded')
+# إعادة مزامنة الحمل من الجدول - تصحح أي تعديل تم من عملية أخرى
+DISPATCH_RESYNC = float(os.environ.get('DISPATCH_RESYNC', 60))
+
+OPEN_STATUSES = ('assigned', 'in_progress')
+DEFAULT_ZONE = 'باقي المحافظات'
+
+
+class LoadTracker:
+    """عدد الطلبات المفتوحة لكل مندوب نشط + منطقته"""
+
+    def __init__(self, resync_interval=DISPATCH_RESYNC):
+        self.resync_interval = resync_interval
+        self._lock = threading.Lock()
+        self.loads = {}
+        self.zones = {}
+        self._synced_at = 0.0
+
+    def sync(self, force=False):
+        if not force and time.monotonic() - self._synced_at < self.resync_interval:
+            return
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT agent_id, zone FROM agents WHERE status = 1')
+        zones = {agent_id: zone for agent_id, zone in cursor.fetchall()}
+        cursor.execute(f'''
+            SELECT agent_id, COUNT(*) FROM orders
+            WHERE agent_id IS NOT NULL AND status IN ({','.join('?' * len(OPEN_STATUSES))})
+            GROUP BY agent_id
+        ''', OPEN_STATUSES)
+        counts = dict(cursor.fetchall())
+        with self._lock:
+            self.zones = zones
+            self.loads = {agent_id: counts.get(agent_id, 0) for agent_id in zones}
+            self._synced_at = time.monotonic()
+
+    def apply(self, before, after):
+        """تحديث الحمل بعد تعديل طلب واحد (إسناد يدوي أو تغيير حالة)"""
+        with self._lock:
+            for row, delta in ((before, -1), (after, 1)):
+                if row and row.get('agent_id') in self.loads and row.get('status') in OPEN_STATUSES:
+                    self.loads[row['agent_id']] += delta
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.loads), dict(self.zones)
+
+
+class Strategy:
+    """اختيار مندوب لطلب - loads قاموس يعدله المُسند بعد كل اختيار"""
+
+    name = ''
+
+    def choose(self, order, loads, zones):
+        raise NotImplementedError
+
+    @staticmethod
+    def available(loads):
+        return [agent_id for agent_id, load in loads.items() if load < DISPATCH_MAX_OPEN]
+
+
+class LeastLoaded(Strategy):
+    name = 'least_loaded'
+
+    def choose(self, order, loads, zones):
+        candidates = self.available(loads)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda agent_id: (loads[agent_id], agent_id))
+
+
+class RoundRobin(Strategy):
+    name = 'round_robin'
+
+    def __init__(self):
+        self._last = None
+
+    def choose(self, order, loads, zones):
+        candidates = sorted(self.available(loads))
+        if not candidates:
+            return None
+        for agent_id in candidates:
+            if self._last is None or agent_id > self._last:
+                break
+        else:
+            agent_id = candidates[0]
+        self._last = agent_id
+        return agent_id
+
+
+class ZoneStrategy(Strategy):
+    """مناديب منطقة الطلب أولاً (حسب مدن shipping_info) ثم الأقل حملاً من الباقين"""
+
+    name = 'zone'
+
+    def __init__(self, zone_names):
+        self._zones = {normalize_arabic(zone): zone for zone in zone_names}
+        self._cities = {}
+
+    def zone_for(self, city):
+        if not city:
+            return DEFAULT_ZONE
+        zone = self._cities.get(city)
+        if zone is None:
+            normalized = normalize_arabic(city)
+            zone = self._zones.get(normalized)
+            if zone is None:
+                zone = next((z for key, z in self._zones.items() if key in normalized), DEFAULT_ZONE)
+            self._cities[city] = zone
+        return zone
+
+    def choose(self, order, loads, zones):
+        candidates = self.available(loads)
+        if not candidates:
+            return None
+        zone = self.zone_for(order.get('city'))
+        local = [agent_id for agent_id in candidates if zones.get(agent_id) == zone]
+        return min(local or candidates, key=lambda agent_id: (loads[agent_id], agent_id))
+
+
+def build_strategies(zone_names):
+    return {
+        LeastLoaded.name: LeastLoaded(),
+        RoundRobin.name: RoundRobin(),
+        ZoneStrategy.name: ZoneStrategy(zone_names)
+    }
+
+
+class Dispatcher:
+    """إسناد الطلبات الجديدة غير المسندة على دفعات - كل دفعة في معاملة واحدة"""
+
+    def __init__(self, zone_names, tracker=None, batch_size=DISPATCH_BATCH):
+        self.tracker = tracker or LoadTracker()
+        self.strategies = build_strategies(zone_names)
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+
+    def dispatch(self, strategy=DISPATCH_STRATEGY, limit=None):
+        """ترجع (إحصائيات، [(قبل، بعد)]) - التغييرات تُمرر للإشعارات بعد انتهاء المعاملات"""
+        if strategy not in self.strategies:
+            raise ValueError(f'unknown dispatch strategy: {strategy}')
+        chooser = self.strategies[strategy]
+        stats = {'assigned': 0, 'skipped': 0, 'batches': 0, 'strategy': strategy}
+        changes = []
+
+        # مُسند واحد في كل مرة داخل العملية حتى لا يتجاوز مندوب الحد الأقصى
+        with self._lock:
+            self.tracker.sync()
+            loads, zones = self.tracker.snapshot()
+            last_key = ('', 0)
+            columns = ', '.join(ORDER_COLUMNS + ('city',))
+
+            while limit is None or stats['assigned'] + stats['skipped'] < limit:
+                size = self.batch_size if limit is None else min(self.batch_size, limit - stats['assigned'] - stats['skipped'])
+                assigned_at = format_timestamp()
+                with transaction(immediate=True) as cursor:
+                    cursor.execute(f'''
+                        SELECT {columns} FROM orders
+                        WHERE status = 'new' AND agent_id IS NULL AND (created_at, id) > (?, ?)
+                        ORDER BY created_at, id LIMIT ?
+                    ''', (*last_key, size))
+                    rows = [dict(zip(ORDER_COLUMNS + ('city',), row)) for row in cursor.fetchall()]
+                    if not rows:
+                        break
+                    last_key = (rows[-1]['created_at'], rows[-1]['id'])
+
+                    updates = []
+                    batch_changes = []
+                    for before in rows:
+                        agent_id = chooser.choose(before, loads, zones)
+                        if agent_id is None:
+                            stats['skipped'] += 1
+                            continue
+                        loads[agent_id] += 1
+                        after = dict(before, status='assigned', agent_id=agent_id)
+                        updates.append((agent_id, assigned_at, before['id']))
+                        batch_changes.append((before, after))
+
+                    cursor.executemany('''
+                        UPDATE orders SET agent_id = ?, status = 'assigned', updated_at = ?
+                        WHERE id = ?
+                    ''', updates)
+                for before, after in batch_changes:
+                    self.tracker.apply(before, after)
+                changes.extend(batch_changes)
+                stats['assigned'] += len(updates)
+                stats['batches'] += 1
+
+                if not updates:
+                    # كل المناديب وصلوا للحد الأقصى
+                    break
+        return stats, changes
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = Dispatcher(EgyptianKnowledgeBase().shipping_info.keys())
+    return _dispatcher
@@ -0,0 +1,249 @@
+"""
+نشر واشتراك لإشعارات المناديب عبر جدول events في SQLite
+أي عملية (ويب أو عامل) تكتب الحدث، وكل عملية ويب تقرأ الجديد بخيط واحد وتوزعه على اتصالات SSE عندها
+موضوع لكل مندوب (agent:<id>) - معرف الحدث هو تسلسله في الجدول فيُستكمل البث من Last-Event-ID في أي عملية
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from dbpool import get_connection, transaction
+from db import add_log
+
+# مدة الاحتفاظ بالأحداث لاستكمال البث - ما قبلها يُحذف مع تنظيف السجلات
+EVENT_RETENTION = float(os.environ.get('EVENT_RETENTION', 24 * 3600))
+EVENT_POLL_INTERVAL = float(os.environ.get('EVENT_POLL_INTERVAL', 0.5))
+EVENT_POLL_BATCH = 1000
+EVENT_HEARTBEAT = float(os.environ.get('EVENT_HEARTBEAT', 15))
+EVENT_SUBSCRIBER_BUFFER = int(os.environ.get('EVENT_SUBSCRIBER_BUFFER', 500))
+# كل اتصال SSE يحجز خيط طلب طوال عمره - حد لكل عملية حتى تبقى خيوط الـ webhooks متاحة
+EVENT_MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', 4))
+# البث يُغلق بعد هذه المدة والمتصفح يعيد الاتصال بـ Last-Event-ID فلا يضيع شيء
+EVENT_STREAM_MAX_AGE = float(os.environ.get('EVENT_STREAM_MAX_AGE', 300))
+# مهلة إعادة المحاولة (ثوانٍ) للمتصفح عندما تكون كل خانات البث مشغولة
+EVENT_BUSY_RETRY = float(os.environ.get('EVENT_BUSY_RETRY', 30))
+
+
+def agent_topic(agent_id):
+    return f'agent:{agent_id}'
+
+
+class Subscription:
+    """اشتراك مستمع واحد (اتصال SSE) في موضوع"""
+
+    def __init__(self, broker, topic):
+        self.broker = broker
+        self.topic = topic
+        self._events = deque()
+        self._condition = threading.Condition()
+        self.overflowed = False
+        # آخر تسلسل عند الاشتراك - يُرسل للاتصال الجديد حتى تستكمل إعادة الاتصال منه
+        self.start_id = None
+
+    def _push(self, event):
+        with self._condition:
+            if len(self._events) >= EVENT_SUBSCRIBER_BUFFER:
+                # مستمع بطيء - نطلب منه إعادة التحميل بدلاً من حجز الذاكرة
+                self.overflowed = True
+                self._events.clear()
+            self._events.append(event)
+            self._condition.notify()
+
+    def get(self, timeout=EVENT_HEARTBEAT):
+        """الحدث التالي أو None بعد انتهاء المهلة (لإرسال نبضة)"""
+        with self._condition:
+            if not self._events:
+                self._condition.wait(timeout)
+            if self.overflowed:
+                self.overflowed = False
+                self._events.clear()
+                return self.broker.reset_event()
+            return self._events.popleft() if self._events else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """الأحداث في جدول مشترك بين العمليات + خيط استطلاع لكل عملية يوزع الجديد على مشتركيها"""
+
+    def __init__(self, poll_interval=EVENT_POLL_INTERVAL, max_streams=EVENT_MAX_STREAMS):
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        # آخر تسلسل وزعته هذه العملية
+        self._position = None
+        self._wake = threading.Event()
+        self._poller = None
+        self._streams = threading.BoundedSemaphore(max_streams) if max_streams > 0 else None
+
+    def publish(self, topic, event_type, data):
+        with transaction() as cursor:
+            cursor.execute('INSERT INTO events (topic, event_type, data, created_at) VALUES (?, ?, ?, ?)',
+                           (topic, event_type, json.dumps(data, ensure_ascii=False, default=str), time.time()))
+            sequence = cursor.lastrowid
+        # مشتركو نفس العملية لا ينتظرون دورة الاستطلاع
+        self._wake.set()
+        return str(sequence)
+
+    def _latest(self, cursor):
+        # sqlite_sequence يحفظ آخر تسلسل حتى لو حُذفت الأحداث كلها
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'")
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def _start(self):
+        """خيط الاستطلاع يبدأ مع أول مشترك (بعد fork في gunicorn) - يُستدعى داخل القفل"""
+        if self._position is None:
+            self._position = self._latest(get_connection().cursor())
+        if self._poller is None:
+            self._poller = threading.Thread(target=self._run, name='event-poller', daemon=True)
+            self._poller.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                if self.poll() >= EVENT_POLL_BATCH:
+                    self._wake.set()
+            except Exception as e:
+                add_log('error', f'Event poll failed: {str(e)}', 'events')
+
+    def poll(self):
+        """توزيع الأحداث الجديدة في الجدول على مشتركي هذه العملية - ترجع عدد الأحداث المقروءة"""
+        deliveries = []
+        with self._lock:
+            cursor = get_connection().cursor()
+            if self._position is None or not self._subscribers:
+                # لا أحد يستمع - نتقدم بالمؤشر فقط
+                self._position = self._latest(cursor)
+                return 0
+            cursor.execute('SELECT seq, topic, event_type, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?',
+                           (self._position, EVENT_POLL_BATCH))
+            rows = cursor.fetchall()
+            for sequence, topic, event_type, data in rows:
+                self._position = sequence
+                subscribers = self._subscribers.get(topic)
+                if subscribers:
+                    event = self._event(sequence, event_type, data)
+                    deliveries.extend((subscription, event) for subscription in subscribers)
+        for subscription, event in deliveries:
+            subscription._push(event)
+        return len(rows)
+
+    def _event(self, sequence, event_type, data):
+        return {'id': str(sequence), 'seq': sequence, 'type': event_type, 'data': json.loads(data)}
+
+    def subscribe(self, topic, last_event_id=None):
+        """اشتراك جديد - مع إعادة إرسال ما فات بعد last_event_id إن كان ما زال في الجدول"""
+        subscription = Subscription(self, topic)
+        with self._lock:
+            self._start()
+            self._subscribers.setdefault(topic, set()).add(subscription)
+            if last_event_id:
+                subscription._events.extend(self._missed(topic, last_event_id))
+            else:
+                subscription.start_id = str(self._position)
+        return subscription
+
+    def _missed(self, topic, last_event_id):
+        """الأحداث حتى موضع الاستطلاع الحالي - ما بعده يصل من poll"""
+        try:
+            sequence = int(last_event_id)
+        except ValueError:
+            # معرف من صيغة قديمة
+            return [self.reset_event()]
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT MIN(seq) FROM events')
+        oldest = cursor.fetchone()[0] or self._position + 1
+        if sequence > self._position or sequence + 1 < oldest:
+            # جزء مما فات حُذف (أو قاعدة بيانات أخرى) - الصفحة تعيد التحميل كاملة
+            return [self.reset_event()]
+        cursor.execute('''
+            SELECT seq, event_type, data FROM events WHERE topic = ? AND seq > ? AND seq <= ? ORDER BY seq
+        ''', (topic, sequence, self._position))
+        return [self._event(*row) for row in cursor.fetchall()]
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def acquire_stream(self):
+        return self._streams is None or self._streams.acquire(blocking=False)
+
+    def release_stream(self):
+        if self._streams is not None:
+            self._streams.release()
+
+    def reset_event(self):
+        return {'id': None, 'seq': None, 'type': 'reset', 'data': {}}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'topics': len(self._subscribers),
+                'subscribers': sum(len(s) for s in self._subscribers.values()),
+                'last_event_id': None if self._position is None else str(self._position)
+            }
+
+
+def purge_events(retention=EVENT_RETENTION):
+    """حذف الأحداث الأقدم من مدة الاحتفاظ - ترجع عدد الصفوف المحذوفة"""
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM events WHERE created_at < ?', (time.time() - retention,))
+        return cursor.rowcount
+
+
+def publish_order_change(before, after):
+    """إشعار المندوب الحالي بالطلب والمندوب السابق بسحبه منه"""
+    previous_agent = before.get('agent_id') if before else None
+    if previous_agent and previous_agent != after.get('agent_id'):
+        broker.publish(agent_topic(previous_agent), 'order_removed', {'order_id': after['order_id']})
+    if after.get('agent_id'):
+        broker.publish(agent_topic(after['agent_id']), 'order', after)
+
+
+def format_sse(event):
+    """تحويل حدث إلى نص Server-Sent Events"""
+    lines = []
+    if event['id']:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event['data'], ensure_ascii=False, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(subscription, heartbeat=EVENT_HEARTBEAT, max_age=EVENT_STREAM_MAX_AGE):
+    """مولّد نص SSE لاستجابة Flask - نبضة تعليق عند السكون حتى لا يغلق الوسيط الاتصال"""
+    broker = subscription.broker
+    if not broker.acquire_stream():
+        # كل خانات البث في هذه العملية مشغولة - المتصفح يعيد المحاولة لاحقاً بنفس Last-Event-ID
+        subscription.close()
+        yield f'retry: {int(EVENT_BUSY_RETRY * 1000)}\n\n'
+        return
+    try:
+        yield 'retry: 3000\n\n'
+        if subscription.start_id is not None:
+            # سطر id بدون data يحدّث Last-Event-ID في المتصفح دون إطلاق حدث
+            yield f'id: {subscription.start_id}\n\n'
+        deadline = time.monotonic() + max_age
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # إغلاق دوري يحرر خيط الطلب - المتصفح يعيد الاتصال ويستكمل من الجدول
+                return
+            event = subscription.get(min(heartbeat, remaining))
+            yield format_sse(event) if event else ': ping\n\n'
+    finally:
+        subscription.close()
+        broker.release_stream()
+
+
+broker = EventBroker()
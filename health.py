@@ -0,0 +1,160 @@
+"""
+فحص اتصال الخدمات الخارجية (فيسبوك، واتساب، جوجل شيتس، OpenAI، DeepSeek) بالتوازي
+النتائج تُحفظ في جدول service_health (الحالة، زمن الاستجابة، آخر خطأ) ويُقرأ منها فقط
+لوحة التحكم و /admin/health لا تنتظر أي اتصال خارجي - الفحص يعمل من المُجدول
+"""
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dbpool import get_connection, transaction
+from db import format_timestamp, get_service_token, get_service_config
+from core import OpenAIProvider, DeepSeekProvider
+from outbox import WHATSAPP_BASE_URL, WHATSAPP_API_VERSION
+from sheets_sync import SHEETS_BASE_URL
+
+HEALTH_CHECK_INTERVAL = float(os.environ.get('HEALTH_CHECK_INTERVAL', 5 * 60))
+HEALTH_CONNECT_TIMEOUT = float(os.environ.get('HEALTH_CONNECT_TIMEOUT', 3))
+HEALTH_READ_TIMEOUT = float(os.environ.get('HEALTH_READ_TIMEOUT', 5))
+# قراءة الجدول نفسه تُخزن مؤقتاً - طلبات لوحة التحكم المتكررة لا تلمس قاعدة البيانات
+HEALTH_CACHE_TTL = float(os.environ.get('HEALTH_CACHE_TTL', 15))
+GRAPH_BASE_URL = os.environ.get('GRAPH_BASE_URL', f'https://graph.facebook.com/{WHATSAPP_API_VERSION}')
+
+SERVICES = ('facebook', 'whatsapp', 'googlesheet', 'openai', 'deepseek')
+HEALTH_COLUMNS = ('service', 'status', 'latency_ms', 'http_status', 'checked_at', 'last_ok_at',
+                  'last_error', 'last_error_at', 'failures')
+
+
+class ProbeError(Exception):
+    """فشل الفحص - http_status إن وصل رد من الخدمة"""
+
+    def __init__(self, message, http_status=None):
+        super().__init__(message)
+        self.http_status = http_status
+
+
+_session = requests.Session()
+_session.mount('https://', HTTPAdapter(pool_connections=len(SERVICES), pool_maxsize=len(SERVICES), max_retries=0))
+_session.mount('http://', HTTPAdapter(pool_connections=len(SERVICES), pool_maxsize=len(SERVICES), max_retries=0))
+_executor = ThreadPoolExecutor(max_workers=len(SERVICES), thread_name_prefix='health')
+
+
+def _get(url, token, params=None):
+    """GET واحد بمهلة قصيرة - أي رد غير 200 فشل"""
+    try:
+        response = _session.get(url, params=params, headers={'Authorization': f'Bearer {token}'},
+                                timeout=(HEALTH_CONNECT_TIMEOUT, HEALTH_READ_TIMEOUT))
+    except requests.RequestException as e:
+        raise ProbeError(f'{type(e).__name__}: {str(e)[:200]}')
+    if response.status_code != 200:
+        raise ProbeError(f'HTTP {response.status_code}: {response.text[:200]}', response.status_code)
+    return response.status_code
+
+
+def probe_facebook(token, config):
+    return _get(f'{GRAPH_BASE_URL}/me', token, {'fields': 'id'})
+
+
+def probe_whatsapp(token, config):
+    base_url = (WHATSAPP_BASE_URL or GRAPH_BASE_URL).rstrip('/')
+    phone_number_id = config.get('phone_number_id')
+    if phone_number_id:
+        return _get(f'{base_url}/{phone_number_id}', token, {'fields': 'id'})
+    return _get(f'{base_url}/me', token, {'fields': 'id'})
+
+
+def probe_googlesheet(token, config):
+    spreadsheet_id = config.get('orders_sheet')
+    if spreadsheet_id:
+        base_url = (SHEETS_BASE_URL or 'https://sheets.googleapis.com').rstrip('/')
+        return _get(f'{base_url}/v4/spreadsheets/{spreadsheet_id}', token, {'fields': 'spreadsheetId'})
+    return _get('https://www.googleapis.com/drive/v3/files', token, {
+        'q': 'mimeType="application/vnd.google-apps.spreadsheet"', 'pageSize': 1, 'fields': 'files(id)'
+    })
+
+
+def probe_openai(token, config):
+    # قائمة النماذج لا تستهلك رموزاً من الحصة
+    return _get(f"{OpenAIProvider.default_base_url.rstrip('/')}/models", token)
+
+
+def probe_deepseek(token, config):
+    return _get(f"{DeepSeekProvider.default_base_url.rstrip('/')}/models", token)
+
+
+PROBES = {
+    'facebook': probe_facebook,
+    'whatsapp': probe_whatsapp,
+    'googlesheet': probe_googlesheet,
+    'openai': probe_openai,
+    'deepseek': probe_deepseek,
+}
+
+
+def check_service(service):
+    """فحص خدمة واحدة - ترجع (status, latency_ms, http_status, error)"""
+    token = get_service_token(service)
+    if not token:
+        return 'not_configured', None, None, None
+    started = time.perf_counter()
+    try:
+        http_status = PROBES[service](token, get_service_config(service))
+    except ProbeError as e:
+        return 'error', (time.perf_counter() - started) * 1000, e.http_status, str(e)
+    return 'ok', (time.perf_counter() - started) * 1000, http_status, None
+
+
+def run_checks(services=SERVICES):
+    """فحص كل الخدمات معاً (الزمن الكلي = أبطأ خدمة) وحفظ النتائج - ترجع قاموس الحالة"""
+    services = [service for service in services if service in PROBES]
+    results = dict(zip(services, _executor.map(check_service, services)))
+
+    now = format_timestamp()
+    with transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO service_health
+                (service, status, latency_ms, http_status, checked_at, last_ok_at, last_error, last_error_at, failures)
+            VALUES (:service, :status, :latency_ms, :http_status, :now,
+                    CASE WHEN :status = 'ok' THEN :now END, :error,
+                    CASE WHEN :status = 'error' THEN :now END, :status = 'error')
+            ON CONFLICT (service) DO UPDATE SET
+                status = excluded.status,
+                latency_ms = excluded.latency_ms,
+                http_status = excluded.http_status,
+                checked_at = excluded.checked_at,
+                last_ok_at = COALESCE(excluded.last_ok_at, last_ok_at),
+                last_error = COALESCE(excluded.last_error, last_error),
+                last_error_at = COALESCE(excluded.last_error_at, last_error_at),
+                failures = CASE WHEN excluded.status = 'error' THEN failures + 1 ELSE 0 END
+        ''', [{'service': service, 'status': status, 'latency_ms': latency, 'http_status': http_status,
+               'error': error, 'now': now} for service, (status, latency, http_status, error) in results.items()])
+    invalidate_cache()
+    return results
+
+
+_cache = {'value': None, 'expires_at': 0.0}
+_cache_lock = threading.Lock()
+
+
+def invalidate_cache():
+    with _cache_lock:
+        _cache['expires_at'] = 0.0
+
+
+def get_health():
+    """آخر نتيجة فحص لكل خدمة من الجدول - بدون أي اتصال خارجي"""
+    now = time.monotonic()
+    if _cache['value'] is not None and _cache['expires_at'] > now:
+        return _cache['value']
+    with _cache_lock:
+        if _cache['value'] is not None and _cache['expires_at'] > now:
+            return _cache['value']
+        cursor = get_connection().cursor()
+        cursor.execute(f"SELECT {', '.join(HEALTH_COLUMNS)} FROM service_health")
+        value = {row[0]: dict(zip(HEALTH_COLUMNS, row)) for row in cursor.fetchall()}
+        _cache['value'] = value
+        _cache['expires_at'] = now + HEALTH_CACHE_TTL
+        return value
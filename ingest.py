@@ -0,0 +1,203 @@
+"""
+مرحلة إدخال أحداث Webhook فيسبوك
+تحليل الحمولة كاملة (تعليقات، منشورات، رسائل ماسنجر) ثم حفظها بـ executemany في معاملة واحدة
+وترجع العناصر الجديدة أو التي ما زالت pending لإضافة مهام الرد (مفتاح منع التكرار في الطابور يمنع الرد مرتين)
+"""
+
+from dbpool import transaction
+from db import format_timestamp
+
+# عناصر feed التي تمثل منشوراً جديداً على الصفحة
+POST_ITEMS = ('status', 'post', 'photo', 'video', 'share')
+_IN_CHUNK = 500
+
+
+def _chunks(values, size=_IN_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def parse_webhook(payload):
+    """تحويل حمولة Webhook صفحة إلى قوائم posts / comments / messages بصيغة الجداول"""
+    batch = {'posts': {}, 'comments': {}, 'messages': {}}
+    if not isinstance(payload, dict) or payload.get('object') != 'page':
+        return batch
+
+    for entry in payload.get('entry') or ():
+        page_id = str(entry.get('id') or '')
+
+        for change in entry.get('changes') or ():
+            if change.get('field') != 'feed':
+                continue
+            value = change.get('value') or {}
+            if value.get('verb', 'add') != 'add':
+                continue
+            item = value.get('item')
+            sender = value.get('from') or {}
+            created_time = format_timestamp(value.get('created_time'))
+            post_id = value.get('post_id')
+
+            if item == 'comment' and value.get('comment_id'):
+                if post_id:
+                    batch['posts'].setdefault(post_id, (post_id, page_id, None, created_time))
+                if str(sender.get('id') or '') == page_id:
+                    # ردود الصفحة نفسها لا تُحفظ كتعليقات عملاء
+                    continue
+                batch['comments'][value['comment_id']] = (
+                    value['comment_id'], post_id, sender.get('id'), sender.get('name'),
+                    value.get('message') or '', created_time, page_id
+                )
+            elif item in POST_ITEMS and post_id:
+                batch['posts'][post_id] = (post_id, page_id, value.get('message') or '', created_time)
+
+        for event in entry.get('messaging') or ():
+            message = event.get('message') or {}
+            if not message.get('mid') or message.get('is_echo') or not message.get('text'):
+                # إشعارات التسليم والقراءة ورسائل الصفحة نفسها
+                continue
+            sender_id = (event.get('sender') or {}).get('id')
+            recipient_id = (event.get('recipient') or {}).get('id') or page_id
+            batch['messages'][message['mid']] = (
+                message['mid'], sender_id, None, str(recipient_id), message['text'],
+                format_timestamp(event.get('timestamp'))
+            )
+
+    return {name: list(rows.values()) for name, rows in batch.items()}
+
+
+def _existing(cursor, table, column, ids):
+    """المعرفات المحفوظة مسبقاً وحالتها {id: status}"""
+    found = {}
+    for chunk in _chunks(ids):
+        cursor.execute(f'SELECT {column}, status FROM {table} WHERE {column} IN ({",".join("?" * len(chunk))})',
+                       chunk)
+        found.update(cursor.fetchall())
+    return found
+
+
+def _first_contacts(cursor, messages):
+    """رسائل محفوظة سابقاً: أول تواصل إذا كانت هي أول رسالة في المحادثة"""
+    first = set()
+    for message_id, user_id, user_name, page_id, text, created_time in messages:
+        cursor.execute('SELECT first_seen FROM conversations WHERE user_id = ? AND page_id = ?', (user_id, page_id))
+        row = cursor.fetchone()
+        if row and row[0] == created_time:
+            first.add(message_id)
+    return first
+
+
+def _update_conversations(cursor, messages):
+    """تحديث المحادثات للدفعة كلها - ترجع أزواج (user_id, page_id) التي تواصلت لأول مرة"""
+    conversations = {}
+    for message_id, user_id, user_name, page_id, text, created_time in messages:
+        if not user_id or not page_id:
+            continue
+        key = (user_id, page_id)
+        first, last, count, last_text = conversations.get(key, (created_time, created_time, 0, text))
+        if created_time >= last:
+            last, last_text = created_time, text
+        conversations[key] = (min(first, created_time), last, count + 1, last_text)
+    if not conversations:
+        return set()
+
+    existing = set()
+    for chunk in _chunks(conversations):
+        cursor.execute(f'''
+            SELECT user_id, page_id FROM conversations
+            WHERE (user_id, page_id) IN (VALUES {','.join('(?, ?)' for _ in chunk)})
+        ''', [value for key in chunk for value in key])
+        existing.update(cursor.fetchall())
+
+    cursor.executemany('''
+        INSERT INTO conversations (user_id, page_id, first_seen, last_seen, message_count, last_message)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, page_id) DO UPDATE SET
+            last_seen = MAX(last_seen, excluded.last_seen),
+            message_count = message_count + excluded.message_count,
+            last_message = CASE WHEN excluded.last_seen >= last_seen THEN excluded.last_message ELSE last_message END
+    ''', [(user_id, page_id, first, last, count, text)
+          for (user_id, page_id), (first, last, count, text) in conversations.items()])
+    return set(conversations) - existing
+
+
+def store_batch(batch):
+    """
+    حفظ دفعة محللة في معاملة واحدة - ترجع (التعليقات، الرسائل) التي تحتاج رداً كقواميس للمهام:
+    الجديدة + المحفوظة سابقاً وما زالت pending (إعادة إرسال فيسبوك بعد رد 503 لطابور ممتلئ)
+    """
+    comments = batch.get('comments') or []
+    messages = batch.get('messages') or []
+    posts = batch.get('posts') or []
+    if not (comments or messages or posts):
+        return [], []
+
+    with transaction(immediate=True) as cursor:
+        if posts:
+            # منشور عرفناه من تعليق عليه يكتمل نصه عند وصول حدث المنشور نفسه
+            cursor.executemany('''
+                INSERT INTO posts (post_id, page_id, message, created_time) VALUES (?, ?, ?, ?)
+                ON CONFLICT (post_id) DO UPDATE SET
+                    page_id = COALESCE(posts.page_id, excluded.page_id),
+                    message = COALESCE(posts.message, excluded.message)
+            ''', posts)
+
+        new_comments = []
+        reply_comments = []
+        if comments:
+            known = _existing(cursor, 'comments', 'comment_id', [row[0] for row in comments])
+            new_comments = [row for row in comments if row[0] not in known]
+            reply_comments = [row for row in comments if known.get(row[0], 'pending') == 'pending']
+            cursor.executemany('''
+                INSERT OR IGNORE INTO comments (comment_id, post_id, user_id, user_name, message, created_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [row[:6] for row in new_comments])
+
+        reply_messages = []
+        first_contacts = set()
+        first_messages = set()
+        if messages:
+            known = _existing(cursor, 'inbox', 'message_id', [row[0] for row in messages])
+            new_messages = [row for row in messages if row[0] not in known]
+            pending_messages = [row for row in messages if known.get(row[0]) == 'pending']
+            reply_messages = new_messages + pending_messages
+            cursor.executemany('''
+                INSERT OR IGNORE INTO inbox (message_id, user_id, user_name, page_id, message, created_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', new_messages)
+            first_contacts = _update_conversations(cursor, new_messages)
+            first_messages = _first_contacts(cursor, pending_messages)
+
+    comment_jobs = [{
+        'comment_id': comment_id, 'post_id': post_id, 'user_id': user_id, 'user_name': user_name,
+        'message': message, 'page_id': page_id
+    } for comment_id, post_id, user_id, user_name, message, created_time, page_id in reply_comments]
+
+    # أول رسالة فقط من عميل جديد في الدفعة تحمل علامة أول تواصل
+    message_jobs = []
+    for message_id, user_id, user_name, page_id, text, created_time in sorted(reply_messages, key=lambda row: row[5]):
+        is_first = (user_id, page_id) in first_contacts or message_id in first_messages
+        first_contacts.discard((user_id, page_id))
+        message_jobs.append({
+            'message_id': message_id, 'user_id': user_id, 'user_name': user_name,
+            'page_id': page_id, 'message': text, 'is_first_contact': is_first
+        })
+    return comment_jobs, message_jobs
+
+
+def mark_throttled(comment_ids=(), message_ids=()):
+    """أحداث تجاوزت حد المعدل: لا رد عليها ولا يلتقطها معالج التعليقات المعلقة لاحقاً"""
+    with transaction() as cursor:
+        for table, column, ids in (('comments', 'comment_id', comment_ids), ('inbox', 'message_id', message_ids)):
+            for chunk in _chunks(ids):
+                cursor.execute(f'''
+                    UPDATE {table} SET status = 'throttled'
+                    WHERE status = 'pending' AND {column} IN ({",".join("?" * len(chunk))})
+                ''', chunk)
+
+
+def ingest(payload):
+    """تحليل + حفظ حمولة Webhook كاملة - ترجع (comment_jobs, message_jobs, عدد الأحداث)"""
+    batch = parse_webhook(payload)
+    comment_jobs, message_jobs = store_batch(batch)
+    return comment_jobs, message_jobs, sum(len(rows) for rows in batch.values())
@@ -0,0 +1,152 @@
+"""
+مصنف نوايا الرسائل العربية
+توحيد النص مرة واحدة ثم مطابقة الكلمات المفتاحية على حدود الكلمات عبر trie مجمّع
+"""
+
+import os
+import json
+import threading
+from arabic import normalize_arabic, normalize_message
+
+INTENTS_CONFIG = os.environ.get(
+    'INTENTS_CONFIG',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json')
+)
+
+# أدوات الربط الملتصقة بالكلمة: "بالسعر" و "والتوصيل" تطابق "سعر" و "توصيل"
+CLITIC_PREFIXES = ('وبال', 'وال', 'بال', 'فال', 'كال', 'لل', 'ال', 'و', 'ب', 'ف', 'ل')
+
+_TERMINAL = object()
+
+
+class KeywordMatcher:
+    """trie على مستوى الكلمات لكل العبارات المفتاحية - مسح واحد للرسالة"""
+
+    def __init__(self, phrases):
+        # phrases: {عبارة: (label, weight)}
+        self._root = {}
+        self._vocabulary = set()
+        for phrase, value in phrases.items():
+            tokens = normalize_arabic(phrase).split()
+            if not tokens:
+                continue
+            node = self._root
+            for token in tokens:
+                self._vocabulary.add(token)
+                node = node.setdefault(token, {})
+            node[_TERMINAL] = value
+        self._canonical = {}
+
+    def canonical(self, token):
+        """الكلمة كما هي إذا كانت مفتاحية، وإلا بعد حذف أداة الربط"""
+        cached = self._canonical.get(token)
+        if cached is not None:
+            return cached
+        result = token
+        if token not in self._vocabulary:
+            for prefix in CLITIC_PREFIXES:
+                stripped = token[len(prefix):]
+                if token.startswith(prefix) and len(stripped) >= 2 and stripped in self._vocabulary:
+                    result = stripped
+                    break
+        if len(self._canonical) < 100000:
+            self._canonical[token] = result
+        return result
+
+    def scan(self, tokens):
+        """إرجاع (label, weight, position) لكل عبارة مطابقة - الأطول أولاً عند نفس البداية"""
+        tokens = [self.canonical(t) for t in tokens]
+        matches = []
+        for start in range(len(tokens)):
+            node = self._root
+            best = None
+            for index in range(start, len(tokens)):
+                node = node.get(tokens[index])
+                if node is None:
+                    break
+                if _TERMINAL in node:
+                    best = node[_TERMINAL]
+            if best is not None:
+                matches.append((best[0], best[1], start))
+        return matches
+
+
+class IntentClassifier:
+    """تصنيف الرسالة إلى price / availability / shipping / product / general"""
+
+    def __init__(self, config):
+        self.min_score = float(config.get('min_score', 0.5))
+        self.intents = list(config['intents'].keys())
+        self._priority = {intent: index for index, intent in enumerate(self.intents)}
+
+        phrases = {}
+        for intent, keywords in config['intents'].items():
+            for phrase, weight in keywords.items():
+                # نفس العبارة في نيتين: الوزن الأعلى يكسب
+                key = normalize_arabic(phrase)
+                if key not in phrases or phrases[key][1] < weight:
+                    phrases[key] = (intent, float(weight))
+        self.matcher = KeywordMatcher(phrases)
+        self._intents = {}
+
+    def scores(self, message):
+        return self._scores(normalize_message(message))
+
+    def _scores(self, normalized):
+        result = {}
+        for intent, weight, _ in self.matcher.scan(normalized.split()):
+            result[intent] = result.get(intent, 0.0) + weight
+        return result
+
+    def classify(self, message):
+        return self._classify(normalize_message(message))
+
+    def _classify(self, normalized):
+        # الرسائل القصيرة تتكرر كثيراً ("بكام؟"، "متاح؟") - النتيجة تُحفظ بالنص الموحد
+        intent = self._intents.get(normalized)
+        if intent is not None:
+            return intent
+        scores = self._scores(normalized)
+        if not scores:
+            intent = 'general'
+        else:
+            intent, score = max(scores.items(), key=lambda item: (item[1], -self._priority[item[0]]))
+            if score < self.min_score:
+                intent = 'general'
+        if len(self._intents) < 100000:
+            self._intents[normalized] = intent
+        return intent
+
+    def classify_many(self, messages):
+        """تصنيف قائمة رسائل - الرسائل المكررة تُوحد وتُصنف مرة واحدة"""
+        by_message = {}
+        by_text = {}
+        results = []
+        for message in messages:
+            intent = by_message.get(message)
+            if intent is None:
+                text = normalize_message(message)
+                intent = by_text.get(text)
+                if intent is None:
+                    intent = by_text[text] = self._classify(text)
+                by_message[message] = intent
+            results.append(intent)
+        return results
+
+
+def load_intents(path=INTENTS_CONFIG):
+    with open(path, encoding='utf-8') as f:
+        return IntentClassifier(json.load(f))
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier():
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = load_intents()
+    return _classifier
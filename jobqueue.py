@@ -0,0 +1,277 @@
+"""
+طابور مهام دائم في SQLite مع مجموعة عمال ثابتة الحجم
+يستخدم للردود التلقائية حتى يرجع الـ Webhook فوراً
+"""
+
+import os
+import json
+import time
+import random
+import socket
+import threading
+import traceback
+from dbpool import get_connection, transaction
+from db import add_log
+
+MAX_PENDING = int(os.environ.get('JOB_QUEUE_MAX_PENDING', 10000))
+MAX_ATTEMPTS = int(os.environ.get('JOB_QUEUE_MAX_ATTEMPTS', 5))
+BACKOFF_BASE = float(os.environ.get('JOB_QUEUE_BACKOFF_BASE', 2.0))
+BACKOFF_MAX = float(os.environ.get('JOB_QUEUE_BACKOFF_MAX', 300.0))
+LEASE_SECONDS = float(os.environ.get('JOB_QUEUE_LEASE_SECONDS', 300.0))
+# كل كم ثانية يبحث العمال عن مهام عالقة لعامل توقف فجأة (وليس عند بدء التشغيل فقط)
+RECOVER_INTERVAL = float(os.environ.get('JOB_QUEUE_RECOVER_INTERVAL', 60.0))
+
+
+class QueueFull(Exception):
+    """الطابور ممتلئ - يجب على المرسل إعادة المحاولة لاحقاً"""
+
+
+class JobQueue:
+    """طابور مهام دائم مبني على جدول jobs"""
+
+    def __init__(self, max_pending=MAX_PENDING, max_attempts=MAX_ATTEMPTS,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """تنبيه العمال داخل نفس العملية عند إضافة مهمة"""
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+    def pending_count(self):
+        cursor = get_connection().cursor()
+        cursor.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'")
+        return cursor.fetchone()[0]
+
+    def enqueue(self, job_type, payload, dedup_key=None, delay=0):
+        """إضافة مهمة - ترجع رقم المهمة أو None إذا كانت مكررة"""
+        if self.max_pending and self.pending_count() >= self.max_pending:
+            raise QueueFull(f'Job queue is full ({self.max_pending} pending)')
+
+        if dedup_key is not None:
+            dedup_key = f'{job_type}:{dedup_key}'
+
+        with transaction() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO jobs (job_type, dedup_key, payload, max_attempts, run_after)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (job_type, dedup_key, json.dumps(payload, ensure_ascii=False),
+                  self.max_attempts, time.time() + delay))
+            job_id = cursor.lastrowid if cursor.rowcount else None
+
+        if job_id:
+            self._notify()
+        return job_id
+
+    def enqueue_many(self, job_type, items):
+        """إضافة عدة مهام من نفس النوع في معاملة واحدة - items: [(payload, dedup_key)]"""
+        items = list(items)
+        if not items:
+            return 0
+        if self.max_pending and self.pending_count() + len(items) > self.max_pending:
+            raise QueueFull(f'Job queue is full ({self.max_pending} pending)')
+
+        now = time.time()
+        with transaction() as cursor:
+            before = cursor.connection.total_changes
+            cursor.executemany('''
+                INSERT OR IGNORE INTO jobs (job_type, dedup_key, payload, max_attempts, run_after)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(job_type, f'{job_type}:{dedup_key}' if dedup_key is not None else None,
+                   json.dumps(payload, ensure_ascii=False), self.max_attempts, now)
+                  for payload, dedup_key in items])
+            added = cursor.connection.total_changes - before
+
+        if added:
+            self._notify()
+        return added
+
+    def claim(self, worker_name):
+        """حجز أقدم مهمة مستحقة بشكل ذري"""
+        now = time.time()
+        with transaction(immediate=True) as cursor:
+            cursor.execute('''
+                SELECT id, job_type, payload, attempts, max_attempts FROM jobs
+                WHERE status = 'pending' AND run_after <= ?
+                ORDER BY run_after, id LIMIT 1
+            ''', (now,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            cursor.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                    locked_by = ?, locked_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (worker_name, now, row[0]))
+
+        return {
+            'id': row[0],
+            'job_type': row[1],
+            'payload': json.loads(row[2]) if row[2] else {},
+            'attempts': row[3] + 1,
+            'max_attempts': row[4]
+        }
+
+    def complete(self, job_id):
+        with transaction() as cursor:
+            cursor.execute('''
+                UPDATE jobs SET status = 'done', locked_by = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (job_id,))
+
+    def fail(self, job, error):
+        """إعادة جدولة المهمة مع تأخير أسي أو تعليمها كفاشلة نهائياً"""
+        if job['attempts'] >= job['max_attempts']:
+            status, run_after = 'failed', None
+        else:
+            delay = min(self.backoff_max, self.backoff_base ** job['attempts'])
+            status, run_after = 'pending', time.time() + delay * random.uniform(0.8, 1.2)
+
+        with transaction() as cursor:
+            cursor.execute('''
+                UPDATE jobs SET status = ?, run_after = COALESCE(?, run_after), last_error = ?,
+                    locked_by = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, run_after, error[:2000], job['id']))
+        return status
+
+    def recover_stale(self, lease_seconds=LEASE_SECONDS):
+        """إرجاع المهام العالقة (عامل توقف فجأة) إلى الطابور"""
+        with transaction() as cursor:
+            cursor.execute('''
+                UPDATE jobs SET status = 'pending', locked_by = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'running' AND locked_at < ?
+            ''', (time.time() - lease_seconds,))
+            return cursor.rowcount
+
+    def next_due_in(self, default):
+        """عدد الثواني حتى أقرب مهمة مستحقة"""
+        cursor = get_connection().cursor()
+        cursor.execute("SELECT MIN(run_after) FROM jobs WHERE status = 'pending'")
+        result = cursor.fetchone()[0]
+        if result is None:
+            return default
+        return max(0.0, min(default, result - time.time()))
+
+    def purge_finished(self, older_than_days=7):
+        """حذف المهام المنتهية القديمة (بعد انتهاء نافذة منع التكرار)"""
+        with transaction() as cursor:
+            cursor.execute('''
+                DELETE FROM jobs
+                WHERE status IN ('done', 'failed') AND updated_at < datetime('now', ?)
+            ''', (f'-{int(older_than_days)} days',))
+            return cursor.rowcount
+
+
+class WorkerPool:
+    """عدد ثابت من العمال يسحبون المهام من JobQueue"""
+
+    def __init__(self, queue, handlers=None, size=4, poll_interval=1.0, recover_interval=RECOVER_INTERVAL):
+        self.queue = queue
+        self.handlers = dict(handlers or {})
+        self.size = size
+        self.poll_interval = poll_interval
+        self.recover_interval = recover_interval
+        self._last_recovery = None
+        self._recovery_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._drain = False
+        self._name = f'{socket.gethostname()}:{os.getpid()}'
+        queue.add_listener(self.notify)
+
+    def register(self, job_type, handler):
+        self.handlers[job_type] = handler
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        self._recover()
+        for index in range(self.size):
+            thread = threading.Thread(
+                target=self._run, args=(f'{self._name}:{index}',),
+                name=f'job-worker-{index}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain=True, timeout=30):
+        """إيقاف العمال - مع drain يتم إنهاء المهام المستحقة قبل الخروج"""
+        self._drain = drain
+        self._stopping = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+        self._threads = [t for t in self._threads if t.is_alive()]
+
+    def _recover(self):
+        """إرجاع المهام العالقة - عامل واحد كل recover_interval والباقون لا ينتظرونه"""
+        now = time.monotonic()
+        if self._last_recovery is not None and now - self._last_recovery < self.recover_interval:
+            return
+        if not self._recovery_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_recovery = now
+            recovered = self.queue.recover_stale()
+            if recovered:
+                add_log('warning', f'Recovered {recovered} stale jobs', 'jobs')
+        except Exception as e:
+            add_log('error', f'Stale job recovery failed: {str(e)}', 'jobs')
+        finally:
+            self._recovery_lock.release()
+
+    def _run(self, worker_name):
+        while True:
+            if self._stopping and not self._drain:
+                return
+
+            self._recover()
+            try:
+                job = self.queue.claim(worker_name)
+            except Exception as e:
+                add_log('error', f'Job claim failed: {str(e)}', 'jobs')
+                job = None
+
+            if job is None:
+                if self._stopping:
+                    return
+                with self._wakeup:
+                    self._wakeup.wait(self.queue.next_due_in(self.poll_interval))
+                continue
+
+            self._execute(job)
+
+    def _execute(self, job):
+        handler = self.handlers.get(job['job_type'])
+        if handler is None:
+            self.queue.fail(dict(job, attempts=job['max_attempts']),
+                            f"No handler for job type {job['job_type']}")
+            return
+
+        try:
+            handler(job['payload'])
+        except Exception as e:
+            status = self.queue.fail(job, traceback.format_exc())
+            if status == 'failed':
+                add_log('error', f"Job {job['id']} ({job['job_type']}) failed: {str(e)}", 'jobs')
+            return
+
+        self.queue.complete(job['id'])
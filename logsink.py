@@ -0,0 +1,164 @@
+"""
+سجل أحداث غير متزامن
+الكتابة في جدول logs على دفعات من خيط خلفي بدلاً من اتصال لكل سطر
+"""
+
+import os
+import queue
+import atexit
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from dbpool import transaction
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'critical': 50}
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'info').lower()
+LOG_FLUSH_SIZE = int(os.environ.get('LOG_FLUSH_SIZE', 200))
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 1.0))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_RING_SIZE = int(os.environ.get('LOG_RING_SIZE', 1000))
+LOG_OVERLOAD_SAMPLE_RATE = float(os.environ.get('LOG_OVERLOAD_SAMPLE_RATE', 0.1))
+LOG_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', 30))
+LOG_RETENTION_INTERVAL = float(os.environ.get('LOG_RETENTION_INTERVAL', 6 * 3600))
+
+
+class LogSink:
+    """طابور محدود + خيط كتابة على دفعات + ذاكرة حلقية لآخر السجلات"""
+
+    def __init__(self, min_level=LOG_LEVEL, flush_size=LOG_FLUSH_SIZE, flush_interval=LOG_FLUSH_INTERVAL,
+                 max_queue=LOG_QUEUE_SIZE, ring_size=LOG_RING_SIZE, sample_rate=LOG_OVERLOAD_SAMPLE_RATE):
+        self.min_level = LEVELS.get(min_level, LEVELS['info'])
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._recent = deque(maxlen=ring_size)
+        self._counters = {'written': 0, 'dropped': 0, 'sampled_out': 0, 'write_errors': 0}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def emit(self, level, message, service='', details=''):
+        level = (level or 'info').lower()
+        severity = LEVELS.get(level, LEVELS['info'])
+        record = (level, message, service, details, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+        # الذاكرة الحلقية تحتفظ بكل شيء (حتى ما تحت الحد الأدنى) للتشخيص السريع
+        self._recent.append(record)
+        if severity < self.min_level:
+            return
+
+        # تحت الضغط: الرسائل الأقل من warning تؤخذ كعينة فقط
+        if severity < LEVELS['warning'] and self._queue.qsize() >= self._queue.maxsize * 0.8:
+            if random.random() >= self.sample_rate:
+                self._count('sampled_out')
+                return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._count('dropped')
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._collect()
+            if batch:
+                self._write(batch)
+
+    def _collect(self):
+        """تجميع دفعة حتى flush_size أو انتهاء flush_interval"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self._flush_lock:
+            try:
+                with transaction() as cursor:
+                    cursor.executemany('''
+                        INSERT INTO logs (level, message, service, details, created_at)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', batch)
+                self._count('written', len(batch))
+            except Exception:
+                self._count('write_errors')
+                self._count('dropped', len(batch))
+
+    def flush(self):
+        """كتابة كل ما في الطابور الآن (عند الإيقاف)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_interval + 1)
+        self.flush()
+
+    def recent(self, limit=100, level=None):
+        records = list(self._recent)
+        if level:
+            threshold = LEVELS.get(level.lower(), 0)
+            records = [r for r in records if LEVELS.get(r[0], 0) >= threshold]
+        return [
+            dict(zip(('level', 'message', 'service', 'details', 'created_at'), r))
+            for r in records[-limit:]
+        ]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters['queued'] = self._queue.qsize()
+        return counters
+
+
+def prune_logs(retention_days=LOG_RETENTION_DAYS):
+    """تجميع السجلات الأقدم من retention_days في log_rollups ثم حذفها"""
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime('%Y-%m-%d 00:00:00')
+    with transaction(immediate=True) as cursor:
+        cursor.execute('''
+            INSERT INTO log_rollups (day, level, service, count)
+            SELECT SUBSTR(created_at, 1, 10) AS day, level, COALESCE(service, ''), COUNT(*)
+            FROM logs WHERE created_at < ?
+            GROUP BY day, level, COALESCE(service, '')
+            ON CONFLICT (day, level, service) DO UPDATE SET count = count + excluded.count
+        ''', (cutoff,))
+        cursor.execute('DELETE FROM logs WHERE created_at < ?', (cutoff,))
+        return cursor.rowcount
+
+
+log_sink = LogSink()
+atexit.register(log_sink.stop)
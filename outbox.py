@@ -0,0 +1,361 @@
+"""
+صندوق الرسائل الصادرة لواتساب (WhatsApp Cloud API)
+الرسائل تُحفظ في جدول outbox مرتبطة بصف في reports ثم تُرسل على دفعات متوازية
+بمعدل محدود (token bucket) وإعادة محاولة مع تأخير عشوائي، وحالة التسليم تُحدث في reports
+"""
+
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+from requests.adapters import HTTPAdapter
+from dbpool import get_connection, transaction
+from db import add_log, format_timestamp, get_service_token, get_service_config
+
+WHATSAPP_API_VERSION = os.environ.get('WHATSAPP_API_VERSION', 'v18.0')
+# لتوجيه الإرسال إلى خادم محلي وهمي أثناء التجربة
+WHATSAPP_BASE_URL = os.environ.get('WHATSAPP_BASE_URL', '')
+WHATSAPP_TIMEOUT = float(os.environ.get('WHATSAPP_TIMEOUT', 15))
+# Cloud API: حتى 80 رسالة/ثانية لكل رقم افتراضياً
+WHATSAPP_RATE = float(os.environ.get('WHATSAPP_RATE', 80))
+WHATSAPP_BURST = int(os.environ.get('WHATSAPP_BURST', 80))
+# مستوى الحساب: عدد المستلمين المختلفين المسموح خلال 24 ساعة (0 = بلا حد)
+WHATSAPP_TIERS = {'1': 1000, '2': 10000, '3': 100000, 'unlimited': 0}
+WHATSAPP_TIER = os.environ.get('WHATSAPP_TIER', '1')
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 16))
+OUTBOX_BATCH = int(os.environ.get('OUTBOX_BATCH', 200))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 5))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', 2.0))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', 300.0))
+# رسالة محجوزة (sending) أطول من هذه المدة تعود للطابور - عملية توقفت أثناء الإرسال
+OUTBOX_LEASE = float(os.environ.get('OUTBOX_LEASE', 120))
+
+# أكواد أخطاء Graph API المؤقتة (تجاوز المعدل/الضغط) - غيرها فشل نهائي
+RETRYABLE_CODES = {4, 80007, 130429, 131000, 131016, 131048, 131056}
+
+# ترتيب حالات التسليم - الويب هوك قد يصل بترتيب مختلف فلا نرجع لحالة أقدم
+DELIVERY_ORDER = {'pending': 0, 'sending': 1, 'sent': 2, 'delivered': 3, 'read': 4}
+
+
+class WhatsAppSendError(Exception):
+    """فشل إرسال رسالة - retryable يحدد إن كانت تستحق إعادة المحاولة"""
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """محدد معدل: rate رمز في الثانية بحد أقصى capacity - آمن بين الخيوط"""
+
+    def __init__(self, rate=WHATSAPP_RATE, capacity=WHATSAPP_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """الانتظار حتى يتوفر رمز - ترجع مدة الانتظار"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        """إفراغ الرموز بعد رد 429 حتى يهدأ الإرسال لكل الخيوط"""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class WhatsAppClient:
+    """عميل رسائل Cloud API بجلسة HTTP مشتركة بين خيوط الإرسال"""
+
+    def __init__(self, phone_number_id, access_token, base_url=None, pool_size=OUTBOX_WORKERS,
+                 timeout=WHATSAPP_TIMEOUT):
+        base_url = base_url or WHATSAPP_BASE_URL or f'https://graph.facebook.com/{WHATSAPP_API_VERSION}'
+        self.messages_url = f"{base_url.rstrip('/')}/{phone_number_id}/messages"
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {access_token}',
+            'Content-Type': 'application/json'
+        })
+
+    def send_text(self, recipient, body):
+        """إرسال رسالة نصية - ترجع معرف الرسالة (wamid)"""
+        try:
+            response = self.session.post(self.messages_url, json={
+                'messaging_product': 'whatsapp',
+                'recipient_type': 'individual',
+                'to': recipient,
+                'type': 'text',
+                'text': {'preview_url': False, 'body': body}
+            }, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise WhatsAppSendError(str(e), retryable=True)
+
+        if response.status_code == 200:
+            try:
+                return response.json()['messages'][0]['id']
+            except (ValueError, KeyError, IndexError):
+                raise WhatsAppSendError(f'unexpected response: {response.text[:200]}')
+
+        try:
+            error = response.json().get('error', {})
+        except ValueError:
+            error = {}
+        retry_after = response.headers.get('Retry-After')
+        raise WhatsAppSendError(
+            f"{response.status_code}: {error.get('message') or response.text[:200]}",
+            retryable=response.status_code == 429 or response.status_code >= 500 or error.get('code') in RETRYABLE_CODES,
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+        )
+
+
+def backoff_delay(attempts, base=OUTBOX_BACKOFF_BASE, limit=OUTBOX_BACKOFF_MAX):
+    """تأخير أسي مع jitter كامل حتى لا تعود كل الرسائل الفاشلة في نفس اللحظة"""
+    return random.uniform(base, min(limit, base * (2 ** attempts)))
+
+
+def queue_messages(report_type, title, messages, content=''):
+    """حفظ تقرير ورسائله [(رقم، نص)] في معاملة واحدة - ترجع رقم التقرير"""
+    messages = [(recipient, body) for recipient, body in messages if recipient]
+    now = time.time()
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO reports (report_type, title, content, recipients, status, total_count)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (report_type, title, content, ','.join(recipient for recipient, _ in messages),
+              'pending' if messages else 'sent', len(messages)))
+        report_id = cursor.lastrowid
+        cursor.executemany('''
+            INSERT INTO outbox (report_id, recipient, body, next_attempt_at) VALUES (?, ?, ?, ?)
+        ''', ((report_id, recipient, body, now) for recipient, body in messages))
+    return report_id
+
+
+def _refresh_reports(cursor, report_ids):
+    """إعادة حساب عدادات وحالة التقارير من صفوف outbox (استعلام مجمّع واحد)"""
+    if not report_ids:
+        return
+    placeholders = ','.join('?' * len(report_ids))
+    cursor.execute(f'''
+        UPDATE reports SET
+            sent_count = (SELECT COUNT(*) FROM outbox o WHERE o.report_id = reports.id
+                          AND o.status IN ('sent', 'delivered', 'read')),
+            failed_count = (SELECT COUNT(*) FROM outbox o WHERE o.report_id = reports.id AND o.status = 'failed')
+        WHERE id IN ({placeholders})
+    ''', tuple(report_ids))
+    cursor.execute(f'''
+        UPDATE reports SET
+            status = CASE
+                WHEN sent_count + failed_count < total_count THEN 'sending'
+                WHEN failed_count = 0 THEN 'sent'
+                WHEN sent_count = 0 THEN 'failed'
+                ELSE 'partial' END,
+            sent_at = CASE WHEN sent_count + failed_count >= total_count
+                           THEN COALESCE(sent_at, ?) ELSE sent_at END
+        WHERE id IN ({placeholders})
+    ''', (format_timestamp(), *report_ids))
+
+
+class OutboxSender:
+    """سحب الرسائل المستحقة على دفعات وإرسالها بالتوازي ضمن حد المعدل"""
+
+    def __init__(self, client, bucket=None, workers=OUTBOX_WORKERS, batch_size=OUTBOX_BATCH,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS, daily_limit=None):
+        self.client = client
+        self.bucket = bucket or TokenBucket()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.daily_limit = WHATSAPP_TIERS.get(WHATSAPP_TIER, 1000) if daily_limit is None else daily_limit
+
+    def _claim(self, report_id):
+        now = time.time()
+        with transaction(immediate=True) as cursor:
+            cursor.execute('''
+                UPDATE outbox SET status = 'pending' WHERE status = 'sending' AND next_attempt_at <= ?
+            ''', (now,))
+            cursor.execute(f'''
+                SELECT id, report_id, recipient, body, attempts FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ? {'AND report_id = ?' if report_id else ''}
+                ORDER BY next_attempt_at, id LIMIT ?
+            ''', (now, report_id, self.batch_size) if report_id else (now, self.batch_size))
+            rows = cursor.fetchall()
+            cursor.executemany('''
+                UPDATE outbox SET status = 'sending', next_attempt_at = ? WHERE id = ?
+            ''', ((now + OUTBOX_LEASE, row[0]) for row in rows))
+        return rows
+
+    def _remaining_quota(self):
+        """عدد المستلمين الجدد المسموح بهم حتى نهاية نافذة الـ 24 ساعة"""
+        if not self.daily_limit:
+            return None
+        since = format_timestamp(datetime.now() - timedelta(days=1))
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT COUNT(DISTINCT recipient) FROM outbox WHERE sent_at >= ?
+        ''', (since,))
+        return max(0, self.daily_limit - cursor.fetchone()[0])
+
+    def _send(self, row):
+        message_id, report_id, recipient, body, attempts = row
+        self.bucket.acquire()
+        try:
+            return row, self.client.send_text(recipient, body), None
+        except WhatsAppSendError as e:
+            if e.retry_after:
+                self.bucket.pause(e.retry_after)
+            return row, None, e
+
+    def drain(self, report_id=None, limit=None):
+        """إرسال كل المستحق الآن - ترجع إحصائيات وموعد أقرب إعادة محاولة (أو None)"""
+        stats = {'sent': 0, 'retry': 0, 'failed': 0, 'deferred': 0, 'batches': 0}
+        quota = self._remaining_quota()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbox') as executor:
+            while limit is None or stats['sent'] + stats['failed'] < limit:
+                rows = self._claim(report_id)
+                if not rows:
+                    break
+                deferred = []
+                if quota is not None:
+                    rows, deferred = rows[:quota], rows[quota:]
+                    quota -= len(rows)
+
+                results = list(executor.map(self._send, rows))
+                self._record(results, deferred, stats)
+                stats['batches'] += 1
+                if deferred:
+                    # وصلنا لحد المستوى اليومي - الباقي ينتظر النافذة التالية
+                    add_log('warning', f'WhatsApp tier limit reached, {len(deferred)} messages deferred', 'whatsapp')
+                    break
+
+        cursor = get_connection().cursor()
+        cursor.execute(f'''
+            SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending' {'AND report_id = ?' if report_id else ''}
+        ''', (report_id,) if report_id else ())
+        return stats, cursor.fetchone()[0]
+
+    def _record(self, results, deferred, stats):
+        now = time.time()
+        sent_at = format_timestamp()
+        sent, retry, failed = [], [], []
+        for (message_id, report_id, recipient, body, attempts), provider_id, error in results:
+            attempts += 1
+            if error is None:
+                sent.append((attempts, provider_id, sent_at, message_id))
+            elif error.retryable and attempts < self.max_attempts:
+                delay = max(error.retry_after or 0, backoff_delay(attempts))
+                retry.append((attempts, now + delay, str(error)[:500], message_id))
+            else:
+                failed.append((attempts, str(error)[:500], message_id))
+
+        with transaction() as cursor:
+            cursor.executemany('''
+                UPDATE outbox SET status = 'sent', attempts = ?, provider_id = ?, sent_at = ?, error = NULL
+                WHERE id = ?
+            ''', sent)
+            cursor.executemany('''
+                UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, error = ? WHERE id = ?
+            ''', retry)
+            cursor.executemany('''
+                UPDATE outbox SET status = 'failed', attempts = ?, error = ? WHERE id = ?
+            ''', failed)
+            cursor.executemany('''
+                UPDATE outbox SET status = 'pending', next_attempt_at = ? WHERE id = ?
+            ''', ((now + 3600, row[0]) for row in deferred))
+            _refresh_reports(cursor, {row[1] for row, _, _ in results} | {row[1] for row in deferred})
+
+        stats['sent'] += len(sent)
+        stats['retry'] += len(retry)
+        stats['failed'] += len(failed)
+        stats['deferred'] += len(deferred)
+
+
+def record_statuses(statuses):
+    """تحديث حالة التسليم من ويب هوك واتساب (statuses: sent/delivered/read/failed)"""
+    updates = []
+    failures = []
+    for status in statuses:
+        provider_id = status.get('id')
+        state = status.get('status')
+        if not provider_id:
+            continue
+        if state == 'failed':
+            errors = status.get('errors') or [{}]
+            failures.append((str(errors[0].get('title') or errors[0].get('message') or 'failed')[:500], provider_id))
+        elif state in DELIVERY_ORDER:
+            updates.append((state, provider_id, DELIVERY_ORDER[state]))
+    if not updates and not failures:
+        return 0
+
+    with transaction() as cursor:
+        # لا نرجع لحالة أقدم لو وصل "delivered" بعد "read"
+        cursor.executemany('''
+            UPDATE outbox SET status = ?
+            WHERE provider_id = ? AND COALESCE(CASE status
+                WHEN 'pending' THEN 0 WHEN 'sending' THEN 1 WHEN 'sent' THEN 2
+                WHEN 'delivered' THEN 3 WHEN 'read' THEN 4 END, 0) < ?
+        ''', updates)
+        cursor.executemany("UPDATE outbox SET status = 'failed', error = ? WHERE provider_id = ?", failures)
+        provider_ids = [u[1] for u in updates] + [f[1] for f in failures]
+        cursor.execute(f'''
+            SELECT DISTINCT report_id FROM outbox WHERE provider_id IN ({','.join('?' * len(provider_ids))})
+        ''', provider_ids)
+        _refresh_reports(cursor, [row[0] for row in cursor.fetchall()])
+    return len(updates) + len(failures)
+
+
+def get_delivery_status(report_id):
+    """حالة تقرير وعدد رسائله في كل حالة"""
+    cursor = get_connection().cursor()
+    cursor.execute('''
+        SELECT id, report_type, title, status, total_count, sent_count, failed_count, created_at, sent_at
+        FROM reports WHERE id = ?
+    ''', (report_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    report = dict(zip(('id', 'report_type', 'title', 'status', 'total', 'sent', 'failed',
+                       'created_at', 'sent_at'), row))
+    cursor.execute('SELECT status, COUNT(*) FROM outbox WHERE report_id = ? GROUP BY status', (report_id,))
+    report['messages'] = dict(cursor.fetchall())
+    return report
+
+
+_sender = None
+_sender_key = None
+_sender_lock = threading.Lock()
+
+
+def get_sender():
+    """مُرسل بجلسة واحدة - يعاد إنشاؤه فقط عند تغيير بيانات الربط"""
+    global _sender, _sender_key
+    token = get_service_token('whatsapp')
+    phone_number_id = get_service_config('whatsapp').get('phone_number_id')
+    if not token or not phone_number_id:
+        return None
+    with _sender_lock:
+        if _sender is None or _sender_key != (phone_number_id, token):
+            _sender = OutboxSender(WhatsAppClient(phone_number_id, token))
+            _sender_key = (phone_number_id, token)
+        return _sender
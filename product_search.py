@@ -0,0 +1,270 @@
+"""
+بحث المنتجات لسياق الردود
+فهرس مقلوب في الذاكرة فوق shopify_products مع ترتيب BM25 وتحديث تزايدي حسب updated_at
+"""
+
+import os
+import re
+import math
+import time
+import heapq
+import threading
+from dbpool import get_connection
+from db import add_log
+from arabic import tokenize, message_tokens
+from intents import CLITIC_PREFIXES
+
+PRODUCT_SEARCH_TOP_K = int(os.environ.get('PRODUCT_SEARCH_TOP_K', 3))
+PRODUCT_INDEX_REFRESH = float(os.environ.get('PRODUCT_INDEX_REFRESH', 5))
+PRODUCT_INDEX_BATCH = int(os.environ.get('PRODUCT_INDEX_BATCH', 5000))
+# أقصى عدد منتجات يُقرأ من كل كلمة (الأعلى أثراً أولاً) - يبقي البحث ثابت الزمن مع الكلمات الشائعة
+PRODUCT_SEARCH_DEPTH = int(os.environ.get('PRODUCT_SEARCH_DEPTH', 1000))
+
+# وزن كل حقل في تكرار الكلمة داخل المستند
+FIELD_WEIGHTS = (('title', 3), ('category', 2), ('description', 1))
+DESCRIPTION_MAX_TOKENS = 200
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_HTML_TAGS = re.compile(r'<[^>]+>')
+
+PRODUCT_QUERY = '''
+    SELECT id, product_id, title, description, price, category,
+           availability, inventory_quantity, updated_at
+    FROM shopify_products
+'''
+
+
+def _product_terms(row):
+    """تكرار الكلمات الموزون لمنتج: {كلمة: tf}, الطول"""
+    terms = {}
+    length = 0
+    for field, weight in FIELD_WEIGHTS:
+        text = row[field] or ''
+        if field == 'description':
+            tokens = tokenize(_HTML_TAGS.sub(' ', text))[:DESCRIPTION_MAX_TOKENS]
+        else:
+            tokens = tokenize(text)
+        for token in tokens:
+            terms[token] = terms.get(token, 0) + weight
+        length += len(tokens) * weight
+    return terms, length
+
+
+class ProductIndex:
+    """فهرس مقلوب: كلمة -> {id: tf} مع بيانات العرض لكل منتج"""
+
+    def __init__(self, refresh_interval=PRODUCT_INDEX_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # تحديث واحد في كل مرة (خيط الخلفية أو مزامنة Shopify) - البحث لا ينتظره
+        self._refresh_lock = threading.Lock()
+        self._postings = {}
+        self._docs = {}
+        self._total_length = 0
+        # مؤشر keyset: آخر (updated_at, id) تمت فهرسته
+        self._watermark = None
+        self._last_id = 0
+        self._last_refresh = 0.0
+        self._refresher = None
+        # كلمة -> [(أثر BM25, id)] مرتبة تنازلياً، تُحسب عند أول بحث وتُلغى عند تعديل الكلمة
+        self._impacts = {}
+        # عدد المنتجات ومتوسط الطول اللذان حُسبت بهما الآثار - أي تغير فيهما يغير IDF لكل الكلمات
+        self._impacts_stats = None
+
+    # ---- البناء والتحديث ----
+
+    def start(self):
+        """خيط التحديث الدوري في الخلفية - يبدأ مرة واحدة لكل عملية (بعد fork في gunicorn)
+        الفترة 0 تعطله - التحديث حينها بعد مزامنة Shopify فقط"""
+        if self._refresher is None and self.refresh_interval > 0:
+            with self._refresh_lock:
+                if self._refresher is None:
+                    self._refresher = threading.Thread(target=self._run, name='product-index', daemon=True)
+                    self._refresher.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh(force=True)
+            except Exception as e:
+                add_log('error', f'Product index refresh failed: {str(e)}', 'shopify')
+            time.sleep(self.refresh_interval)
+
+    def refresh(self, force=False):
+        """قراءة المنتجات المعدلة منذ آخر تحديث فقط - ترجع عدد المنتجات المعاد فهرستها"""
+        if not force and time.monotonic() - self._last_refresh < self.refresh_interval:
+            return 0
+        with self._refresh_lock:
+            if not force and time.monotonic() - self._last_refresh < self.refresh_interval:
+                return 0
+
+            cursor = get_connection().cursor()
+            # حذف منتجات من الجدول لا يغير updated_at - نكتشفه بفرق العدد
+            total = cursor.execute('SELECT COUNT(*) FROM shopify_products').fetchone()[0]
+            if self._watermark is not None and total < len(self._docs):
+                existing = {row[0] for row in cursor.execute('SELECT id FROM shopify_products')}
+                with self._lock:
+                    for doc_id in [doc_id for doc_id in self._docs if doc_id not in existing]:
+                        self._remove(doc_id)
+
+            changed = 0
+            while True:
+                if self._watermark is None:
+                    # التحميل الأول بترتيب id - ثم يبدأ المؤشر من أحدث (updated_at, id)
+                    cursor.execute(PRODUCT_QUERY + 'WHERE id > ? ORDER BY id LIMIT ?',
+                                   (self._last_id, PRODUCT_INDEX_BATCH))
+                else:
+                    # مقارنة صارمة - لا يُعاد إلا المنتج الذي تقدم updated_at له بعد المؤشر
+                    cursor.execute(PRODUCT_QUERY + 'WHERE (updated_at, id) > (?, ?) ORDER BY updated_at, id LIMIT ?',
+                                   (self._watermark, self._last_id, PRODUCT_INDEX_BATCH))
+                columns = [c[0] for c in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                if rows:
+                    # القفل لكل دفعة فقط - البحث يتخلل الدفعات بدل انتظار التحديث كله
+                    with self._lock:
+                        for row in rows:
+                            self._index(row)
+                    changed += len(rows)
+                if self._watermark is not None:
+                    if not rows:
+                        break
+                    self._watermark, self._last_id = rows[-1]['updated_at'], rows[-1]['id']
+                elif len(rows) == PRODUCT_INDEX_BATCH:
+                    self._last_id = rows[-1]['id']
+                else:
+                    cursor.execute('SELECT updated_at, id FROM shopify_products ORDER BY updated_at DESC, id DESC LIMIT 1')
+                    newest = cursor.fetchone()
+                    self._watermark, self._last_id = (newest[0] or '', newest[1]) if newest else ('', 0)
+                    break
+
+            self._last_refresh = time.monotonic()
+            return changed
+
+    def _index(self, row):
+        doc_id = row['id']
+        self._remove(doc_id)
+        terms, length = _product_terms(row)
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+            self._impacts.pop(term, None)
+        self._docs[doc_id] = {
+            'product_id': row['product_id'],
+            'title': row['title'],
+            'price': row['price'],
+            'category': row['category'],
+            'available': bool(row['availability']),
+            'stock': row['inventory_quantity'],
+            'terms': tuple(terms),
+            'length': length,
+        }
+        self._total_length += length
+
+    def _remove(self, doc_id):
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc['length']
+        for term in doc['terms']:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                self._impacts.pop(term, None)
+                if not postings:
+                    del self._postings[term]
+
+    # ---- البحث ----
+
+    def _query_terms(self, query):
+        terms = []
+        for token in message_tokens(query):
+            if token not in self._postings:
+                # "بالقميص" و "والفستان" تبحث عن "قميص" و "فستان" أو "الفستان"
+                for prefix in CLITIC_PREFIXES:
+                    stripped = token[len(prefix):]
+                    if token.startswith(prefix) and len(stripped) >= 2 and stripped in self._postings:
+                        token = stripped
+                        break
+            if token in self._postings and token not in terms:
+                terms.append(token)
+        return terms
+
+    def _term_impacts(self, term, count, avg_length):
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            postings = self._postings[term]
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            docs = self._docs
+            scored = (
+                (idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * docs[doc_id]['length'] / avg_length)), doc_id)
+                for doc_id, tf in postings.items()
+            )
+            impacts = self._impacts[term] = heapq.nlargest(PRODUCT_SEARCH_DEPTH, scored)
+        return impacts
+
+    def search(self, query, k=PRODUCT_SEARCH_TOP_K, available_only=False):
+        """أفضل k منتجات للرسالة: [{title, price, category, available, stock, score}]"""
+        self.start()
+        with self._lock:
+            count = len(self._docs)
+            if not count:
+                return []
+            avg_length = self._total_length / count or 1
+            if self._impacts_stats != (count, avg_length):
+                self._impacts.clear()
+                self._impacts_stats = (count, avg_length)
+            scores = {}
+            for term in self._query_terms(query):
+                for impact, doc_id in self._term_impacts(term, count, avg_length):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + impact
+
+            if available_only:
+                scores = {doc_id: score for doc_id, score in scores.items() if self._docs[doc_id]['available']}
+
+            results = []
+            for doc_id, score in heapq.nlargest(k, scores.items(), key=lambda item: item[1]):
+                doc = self._docs[doc_id]
+                results.append({
+                    'product_id': doc['product_id'],
+                    'title': doc['title'],
+                    'price': doc['price'],
+                    'category': doc['category'],
+                    'available': doc['available'],
+                    'stock': doc['stock'],
+                    'score': round(score, 3),
+                })
+            return results
+
+    def stats(self):
+        with self._lock:
+            return {'products': len(self._docs), 'terms': len(self._postings),
+                    'watermark': self._watermark, 'last_id': self._last_id}
+
+
+def format_products(products):
+    """سطر لكل منتج لإدراجه في سياق النموذج"""
+    lines = []
+    for product in products:
+        if not product['available']:
+            stock = 'غير متوفر حالياً'
+        elif product['stock'] is not None:
+            stock = f"متوفر ({product['stock']} قطعة)"
+        else:
+            stock = 'متوفر'
+        price = f"{product['price']} جنيه" if product['price'] else 'السعر غير محدد'
+        lines.append(f"- {product['title']}: {price}، {stock}")
+    return '\n'.join(lines)
+
+
+_product_index = None
+_product_index_lock = threading.Lock()
+
+
+def get_product_index():
+    global _product_index
+    if _product_index is None:
+        with _product_index_lock:
+            if _product_index is None:
+                _product_index = ProductIndex()
+    return _product_index
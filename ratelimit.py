@@ -0,0 +1,243 @@
+"""
+تحديد معدل الردود التلقائية واستدعاءات الذكاء الاصطناعي (نافذة منزلقة)
+المفاتيح: الصفحة، المستخدم داخل الصفحة، عنوان IP - والحدود من متغيرات البيئة بصيغة "عدد/ثوانٍ"
+الحالة في الذاكرة لكل عملية، أو في SQLite لتكون مشتركة بين عمليات الويب والعمال
+"""
+
+import os
+import time
+import threading
+from dbpool import get_connection, transaction
+
+# الحدود الافتراضية - "0" يلغي الحد
+RATE_LIMITS = {
+    'user': os.environ.get('RATE_LIMIT_USER', '5/60'),     # ردود لنفس العميل على نفس الصفحة
+    'page': os.environ.get('RATE_LIMIT_PAGE', '300/60'),   # ردود الصفحة كلها
+    'ip': os.environ.get('RATE_LIMIT_IP', '30/60'),        # طلبات /api/ask لكل عنوان
+}
+# memory: لكل عملية على حدة، sqlite: مشتركة بين كل العمليات (serve.py بعدة عمال)
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# تنظيف مفاتيح الذاكرة المنتهية كل عدد من الطلبات
+_PRUNE_EVERY = 4096
+
+
+def parse_quota(spec):
+    """'5/60' -> (5, 60.0) - و '0' أو فارغ -> None (بلا حد)"""
+    spec = (spec or '').strip()
+    if not spec or spec == '0':
+        return None
+    limit, _, period = spec.partition('/')
+    limit, period = int(limit), float(period or 60)
+    if limit <= 0 or period <= 0:
+        return None
+    return limit, period
+
+
+def _estimate(now, window_start, period, current, previous):
+    """عدد الطلبات في آخر period ثانية: النافذة الحالية + جزء النافذة السابقة الذي ما زال داخل المدى"""
+    return current + previous * (1 - (now - window_start) / period)
+
+
+def _retry_after(now, window_start, period, limit, current, previous):
+    """الثواني حتى يسمح الحد بطلب جديد"""
+    if current + 1 > limit or not previous:
+        return window_start + period - now
+    # وزن النافذة السابقة يتناقص خطياً حتى يتسع لطلب واحد
+    fraction = 1 - (limit - current - 1) / previous
+    return max(window_start + period * fraction - now, 0.0)
+
+
+class MemoryStore:
+    """عدادات النافذة الحالية والسابقة لكل مفتاح في الذاكرة"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._hits = 0
+
+    def hit_many(self, requests, quotas, now):
+        with self._lock:
+            results = [self._hit(keys, quotas, now) for keys in requests]
+            self._hits += len(requests)
+            if self._hits >= _PRUNE_EVERY:
+                self._hits = 0
+                self._prune(quotas, now)
+            return results
+
+    def _window(self, scope, key, period, now):
+        window_start = now - now % period
+        entry = self._windows.get((scope, key))
+        if entry is None or entry[0] < window_start - period:
+            entry = [window_start, 0, 0]
+        elif entry[0] < window_start:
+            entry = [window_start, 0, entry[1]]
+        self._windows[(scope, key)] = entry
+        return entry
+
+    def _hit(self, keys, quotas, now):
+        entries = []
+        for scope, key in keys:
+            limit, period = quotas[scope]
+            entry = self._window(scope, key, period, now)
+            if _estimate(now, entry[0], period, entry[1], entry[2]) + 1 > limit:
+                return False, scope, _retry_after(now, entry[0], period, limit, entry[1], entry[2])
+            entries.append(entry)
+        # الطلب المرفوض لا يُحتسب - وإلا ظل المرسل المستمر محجوباً للأبد
+        for entry in entries:
+            entry[1] += 1
+        return True, None, 0.0
+
+    def _prune(self, quotas, now):
+        for (scope, key), entry in list(self._windows.items()):
+            quota = quotas.get(scope)
+            if quota is None or entry[0] < now - now % quota[1] - quota[1]:
+                del self._windows[(scope, key)]
+
+    def active_keys(self):
+        with self._lock:
+            return len(self._windows)
+
+
+class SQLiteStore:
+    """نفس الخوارزمية في جدول rate_limits - كل دفعة في معاملة IMMEDIATE واحدة"""
+
+    name = 'sqlite'
+
+    def hit_many(self, requests, quotas, now):
+        results = []
+        with transaction(immediate=True) as cursor:
+            counts = self._load(cursor, requests, quotas, now)
+            increments = {}
+            for keys in requests:
+                result = None
+                for scope, key in keys:
+                    limit, period = quotas[scope]
+                    window_start = now - now % period
+                    current, previous = counts.get((scope, key), (0, 0))
+                    current += increments.get((scope, key), 0)
+                    if _estimate(now, window_start, period, current, previous) + 1 > limit:
+                        result = (False, scope, _retry_after(now, window_start, period, limit, current, previous))
+                        break
+                if result is None:
+                    for scope_key in keys:
+                        increments[scope_key] = increments.get(scope_key, 0) + 1
+                    result = (True, None, 0.0)
+                results.append(result)
+
+            if increments:
+                rows = []
+                for (scope, key), count in increments.items():
+                    period = quotas[scope][1]
+                    window_start = now - now % period
+                    rows.append((scope, key, window_start, count, window_start + 2 * period))
+                cursor.executemany('''
+                    INSERT INTO rate_limits (scope, key, window_start, count, expires_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (scope, key, window_start) DO UPDATE SET count = count + excluded.count
+                ''', rows)
+        return results
+
+    def _load(self, cursor, requests, quotas, now):
+        """(النافذة الحالية، السابقة) لكل مفتاح في الدفعة - استعلام واحد لكل نطاق"""
+        by_scope = {}
+        for keys in requests:
+            for scope, key in keys:
+                by_scope.setdefault(scope, set()).add(key)
+
+        counts = {}
+        for scope, keys in by_scope.items():
+            period = quotas[scope][1]
+            window_start = now - now % period
+            keys = list(keys)
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                cursor.execute(f'''
+                    SELECT key, window_start, count FROM rate_limits
+                    WHERE scope = ? AND window_start >= ? AND key IN ({','.join('?' * len(chunk))})
+                ''', [scope, window_start - period] + chunk)
+                for key, start_at, count in cursor.fetchall():
+                    current, previous = counts.get((scope, key), (0, 0))
+                    if start_at >= window_start:
+                        current += count
+                    else:
+                        previous += count
+                    counts[(scope, key)] = (current, previous)
+        return counts
+
+    def active_keys(self):
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT COUNT(DISTINCT scope || key) FROM rate_limits WHERE expires_at >= ?', (time.time(),))
+        return cursor.fetchone()[0]
+
+
+def purge_rate_limits():
+    """حذف النوافذ المنتهية من الجدول المشترك - ترجع عدد الصفوف المحذوفة"""
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM rate_limits WHERE expires_at < ?', (time.time(),))
+        return cursor.rowcount
+
+
+class RateLimiter:
+    """
+    allow_many([[('user', 'page:user'), ('page', 'page')], ...]) -> [(allowed, scope, retry_after), ...]
+    الطلب مسموح فقط إذا سمحت كل مفاتيحه، وعندها يُحتسب على كل المفاتيح
+    """
+
+    def __init__(self, limits=None, backend=None):
+        limits = RATE_LIMITS if limits is None else limits
+        self.quotas = {scope: quota for scope, quota in
+                       ((scope, parse_quota(spec)) for scope, spec in limits.items()) if quota}
+        backend = backend or RATE_LIMIT_BACKEND
+        self.store = SQLiteStore() if backend == 'sqlite' else MemoryStore()
+        self._lock = threading.Lock()
+        self.counters = {scope: {'allowed': 0, 'throttled': 0} for scope in limits}
+
+    def allow_many(self, requests, now=None):
+        now = time.time() if now is None else now
+        # مفاتيح بلا حد أو بلا قيمة (مستخدم مجهول) لا تدخل الحساب
+        requests = [[(scope, str(key)) for scope, key in keys if key and scope in self.quotas]
+                    for keys in requests]
+        results = self.store.hit_many(requests, self.quotas, now)
+
+        with self._lock:
+            for keys, (allowed, scope, retry_after) in zip(requests, results):
+                if allowed:
+                    for key_scope, key in keys:
+                        self.counters[key_scope]['allowed'] += 1
+                else:
+                    self.counters[scope]['throttled'] += 1
+        return results
+
+    def allow(self, *keys):
+        return self.allow_many([keys])[0]
+
+    def status(self):
+        with self._lock:
+            counters = {scope: dict(values) for scope, values in self.counters.items()}
+        return {
+            'backend': self.store.name,
+            'quotas': {scope: {'limit': limit, 'period': period} for scope, (limit, period) in self.quotas.items()},
+            'counters': counters,
+            'active_keys': self.store.active_keys(),
+        }
+
+
+def event_keys(job):
+    """مفاتيح حدث فيسبوك (تعليق أو رسالة): العميل داخل الصفحة ثم الصفحة"""
+    page_id = job.get('page_id')
+    user_id = job.get('user_id')
+    return [('user', f'{page_id}:{user_id}' if user_id else None), ('page', page_id)]
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
@@ -0,0 +1,312 @@
+"""
+محرك التقارير الإدارية
+مؤشرات الطلبات والعملاء والمناديب من استعلامات مجمّعة (GROUP BY) بمرور واحد
+الأيام المنتهية تُخزن وتُسقط عند تعديل طلباتها، واليوم الحالي يعاد حسابه كل دقيقة
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from dbpool import get_connection
+from db import TIMESTAMP_FORMAT
+
+REPORT_TODAY_TTL = float(os.environ.get('REPORT_TODAY_TTL', 60))
+REPORT_CACHE_DAYS = int(os.environ.get('REPORT_CACHE_DAYS', 400))
+# الطلبات القديمة تتغير حالتها أيضاً - التعديلات من عمليات أخرى تظهر بعد هذه المدة
+REPORT_PAST_TTL = float(os.environ.get('REPORT_PAST_TTL', 900))
+
+PERIODS = {'daily': 'يومي', 'weekly': 'أسبوعي', 'monthly': 'شهري'}
+
+# عدادات الطلبات لكل مندوب في اليوم: الإجمالي، المكتملة، الملغاة، المفتوحة، الجديدة، القطع
+_ORDER_FIELDS = ('total', 'completed', 'cancelled', 'open', 'new', 'items')
+
+
+def report_window(period, day=None):
+    """(البداية، النهاية غير الشاملة) كتواريخ: اليوم، آخر 7 أيام، أو الشهر حتى اليوم"""
+    day = day or date.today()
+    if period == 'daily':
+        start = day
+    elif period == 'weekly':
+        start = day - timedelta(days=6)
+    elif period == 'monthly':
+        start = day.replace(day=1)
+    else:
+        raise ValueError(f'unknown report period: {period}')
+    return start, day + timedelta(days=1)
+
+
+def _stamp(day):
+    return datetime(day.year, day.month, day.day).strftime(TIMESTAMP_FORMAT)
+
+
+def _rate(part, whole):
+    return round(part / whole * 100, 1) if whole else 0.0
+
+
+class ReportEngine:
+    """حساب التقارير مع ذاكرة لكل يوم (للأجزاء القابلة للجمع) ولكل نافذة (للعملاء)"""
+
+    def __init__(self, today_ttl=REPORT_TODAY_TTL, past_ttl=REPORT_PAST_TTL, max_days=REPORT_CACHE_DAYS):
+        self.today_ttl = today_ttl
+        self.past_ttl = past_ttl
+        self.max_days = max_days
+        self._days = OrderedDict()
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    # ---- الأيام (طلبات، تعليقات، رسائل) ----
+
+    def _cached_day(self, day, today):
+        entry = self._days.get(day)
+        if entry is None:
+            return None
+        data, computed_at = entry
+        ttl = self.today_ttl if day >= today else self.past_ttl
+        if time.monotonic() - computed_at >= ttl:
+            return None
+        return data
+
+    def _load_days(self, start, end):
+        """كل الأيام في [start, end) باستعلام واحد لكل جدول مجمّعاً حسب اليوم"""
+        days = {}
+        current = start
+        while current < end:
+            days[current.isoformat()] = {'orders': {}, 'comments': {}, 'messages': 0}
+            current += timedelta(days=1)
+
+        cursor = get_connection().cursor()
+        params = (_stamp(start), _stamp(end))
+        cursor.execute('''
+            SELECT SUBSTR(created_at, 1, 10) AS day, agent_id,
+                   COUNT(*),
+                   SUM(status = 'completed'),
+                   SUM(status = 'cancelled'),
+                   SUM(status IN ('assigned', 'in_progress')),
+                   SUM(status = 'new'),
+                   COALESCE(SUM(quantity), 0)
+            FROM orders
+            WHERE created_at >= ? AND created_at < ?
+            GROUP BY day, agent_id
+        ''', params)
+        for day, agent_id, *counts in cursor.fetchall():
+            if day in days:
+                days[day]['orders'][agent_id] = counts
+
+        cursor.execute('''
+            SELECT SUBSTR(created_time, 1, 10) AS day, status, COUNT(*)
+            FROM comments
+            WHERE created_time >= ? AND created_time < ?
+            GROUP BY day, status
+        ''', params)
+        for day, status, count in cursor.fetchall():
+            if day in days:
+                days[day]['comments'][status or 'pending'] = count
+
+        cursor.execute('''
+            SELECT day, inbox_count FROM daily_stats WHERE day >= ? AND day < ?
+        ''', (start.isoformat(), end.isoformat()))
+        for day, count in cursor.fetchall():
+            if day in days:
+                days[day]['messages'] = count or 0
+        return days
+
+    def _days_for(self, start, end):
+        today = date.today().isoformat()
+        result = {}
+        missing = []
+        with self._lock:
+            current = start
+            while current < end:
+                key = current.isoformat()
+                data = self._cached_day(key, today)
+                if data is None:
+                    missing.append(current)
+                else:
+                    result[key] = data
+                    self._days.move_to_end(key)
+                current += timedelta(days=1)
+
+        if missing:
+            # نطاق واحد يغطي كل الأيام الناقصة (عادة اليوم فقط)
+            loaded = self._load_days(missing[0], missing[-1] + timedelta(days=1))
+            now = time.monotonic()
+            with self._lock:
+                for key, data in loaded.items():
+                    if key in result:
+                        continue
+                    result[key] = data
+                    self._days[key] = (data, now)
+                    self._days.move_to_end(key)
+                while len(self._days) > self.max_days:
+                    self._days.popitem(last=False)
+        return result
+
+    # ---- العملاء (غير قابلة للجمع بين الأيام - تحسب للنافذة كاملة) ----
+
+    def _customers(self, start, end):
+        key = (start, end)
+        includes_today = end > date.today()
+        with self._lock:
+            entry = self._windows.get(key)
+            ttl = self.today_ttl if includes_today else self.past_ttl
+            if entry and time.monotonic() - entry[1] < ttl:
+                return entry[0]
+
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(c.first_seen >= :start), 0),
+                   COALESCE(SUM(c.first_seen < :start), 0)
+            FROM (
+                SELECT DISTINCT user_id, page_id FROM inbox
+                WHERE created_time >= :start AND created_time < :end
+            ) AS active
+            JOIN conversations c ON c.user_id = active.user_id AND c.page_id = active.page_id
+        ''', {'start': _stamp(start), 'end': _stamp(end)})
+        active, new, returning = cursor.fetchone()
+        data = {'active': active, 'new': new, 'returning': returning}
+
+        with self._lock:
+            self._windows[key] = (data, time.monotonic())
+            while len(self._windows) > 64:
+                self._windows.popitem(last=False)
+        return data
+
+    # ---- التقرير ----
+
+    def build(self, period='daily', day=None):
+        started = time.perf_counter()
+        start, end = report_window(period, day)
+        days = self._days_for(start, end)
+
+        per_agent = {}
+        comments = {}
+        messages = 0
+        for data in days.values():
+            messages += data['messages']
+            for status, count in data['comments'].items():
+                comments[status] = comments.get(status, 0) + count
+            for agent_id, counts in data['orders'].items():
+                totals = per_agent.setdefault(agent_id, [0] * len(_ORDER_FIELDS))
+                for index, value in enumerate(counts):
+                    totals[index] += value or 0
+
+        orders = dict(zip(_ORDER_FIELDS, [sum(c[i] for c in per_agent.values()) for i in range(len(_ORDER_FIELDS))]))
+        orders['completion_rate'] = _rate(orders['completed'], orders['total'])
+        orders['cancel_rate'] = _rate(orders['cancelled'], orders['total'])
+
+        customers = dict(self._customers(start, end))
+        customers['messages'] = messages
+        customers['comments'] = sum(comments.values())
+        customers['replied_comments'] = comments.get('replied', 0)
+        customers['conversion_rate'] = _rate(orders['total'], customers['active'])
+
+        agents = self._agents(per_agent)
+
+        return {
+            'period': period,
+            'title': PERIODS[period],
+            'start': start.isoformat(),
+            'end': (end - timedelta(days=1)).isoformat(),
+            'orders': orders,
+            'customers': customers,
+            'agents': agents,
+            'generated_in_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    def _agents(self, per_agent):
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT agent_id, name, status FROM agents')
+        names = {}
+        active = 0
+        for agent_id, name, status in cursor.fetchall():
+            names[agent_id] = name
+            active += 1 if status else 0
+
+        ranking = []
+        for agent_id, counts in per_agent.items():
+            if agent_id is None:
+                continue
+            stats = dict(zip(_ORDER_FIELDS, counts))
+            ranking.append({
+                'agent_id': agent_id,
+                'name': names.get(agent_id, agent_id),
+                'assigned': stats['total'],
+                'completed': stats['completed'],
+                'cancelled': stats['cancelled'],
+                'completion_rate': _rate(stats['completed'], stats['total'])
+            })
+        ranking.sort(key=lambda item: (-item['completed'], -item['completion_rate'], item['agent_id']))
+        return {
+            'active': active,
+            'best': ranking[0]['name'] if ranking and ranking[0]['completed'] else None,
+            'ranking': ranking
+        }
+
+    def invalidate(self, day=None):
+        """إسقاط يوم واحد (YYYY-MM-DD) بعد تعديل طلب من ذلك اليوم، أو كل الذاكرة"""
+        with self._lock:
+            if day is None:
+                self._days.clear()
+                self._windows.clear()
+            else:
+                self._days.pop(day, None)
+
+
+def render_report(report):
+    """نص التقرير بالعربية (لواجهة المساعد وواتساب)"""
+    orders = report['orders']
+    customers = report['customers']
+    agents = report['agents']
+    window = report['start'] if report['start'] == report['end'] else f"{report['start']} → {report['end']}"
+
+    lines = [
+        f"📊 التقرير ال{report['title']} - {window}",
+        '',
+        '📈 أداء الطلبات:',
+        f"• إجمالي الطلبات: {orders['total']} ({orders['items']} قطعة)",
+        f"• الطلبات المكتملة: {orders['completed']} ({orders['completion_rate']}%)",
+        f"• قيد التنفيذ: {orders['open']} - بانتظار الإسناد: {orders['new']}",
+        f"• الطلبات الملغاة: {orders['cancelled']} ({orders['cancel_rate']}%)",
+        '',
+        '👥 العملاء:',
+        f"• عملاء جدد: {customers['new']}",
+        f"• عملاء عائدون: {customers['returning']}",
+        f"• الرسائل: {customers['messages']} - التعليقات: {customers['comments']} (تم الرد على {customers['replied_comments']})",
+        f"• معدل التحويل: {customers['conversion_rate']}%",
+        '',
+        '🚚 المناديب:',
+        f"• مناديب نشطون: {agents['active']}",
+        f"• أفضل مندوب: {agents['best'] or 'لا يوجد'}",
+    ]
+    for position, agent in enumerate(agents['ranking'][:3], 1):
+        lines.append(f"  {position}. {agent['name']}: {agent['completed']}/{agent['assigned']} مكتمل")
+
+    recommendations = []
+    if customers['new'] > customers['returning']:
+        recommendations.append('متابعة العملاء الجدد لتحويلهم إلى عملاء دائمين')
+    if orders['cancel_rate'] >= 10:
+        recommendations.append('مراجعة أسباب إلغاء الطلبات')
+    if orders['new']:
+        recommendations.append(f"إسناد {orders['new']} طلب جديد للمناديب")
+    if customers['comments'] > customers['replied_comments']:
+        recommendations.append('الرد على التعليقات المعلقة')
+    if recommendations:
+        lines += ['', '💡 توصيات:'] + [f'• {item}' for item in recommendations]
+
+    return '\n'.join(lines)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_report_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ReportEngine()
+    return _engine
@@ -0,0 +1,220 @@
+"""
+ذاكرة تخزين مؤقت لردود الذكاء الاصطناعي
+مستويان: مطابقة حرفية ثم مطابقة بعد توحيد النص العربي
+مع LRU في الذاكرة و TTL وحفظ دائم في SQLite
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dbpool import get_connection, transaction
+from arabic import normalize_message, normalize_whitespace
+
+CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 24 * 3600))
+CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 5000))
+CACHE_MAX_ROWS = int(os.environ.get('RESPONSE_CACHE_MAX_ROWS', 100000))
+# تحديث last_used_at للصفوف المقروءة من القاعدة يُجمع ويُكتب دفعة واحدة بدل معاملة لكل قراءة
+CACHE_TOUCH_BATCH = int(os.environ.get('RESPONSE_CACHE_TOUCH_BATCH', 100))
+CACHE_TOUCH_INTERVAL = float(os.environ.get('RESPONSE_CACHE_TOUCH_INTERVAL', 60))
+
+# متغيرات خاصة بكل عميل - لا تدخل في المفتاح ويتم تخزينها كقالب {name}
+PERSONAL_VARIABLES = ('name',)
+
+TIERS = ('exact', 'normalized')
+
+
+class ResponseCache:
+    """تخزين مؤقت للردود حسب (الرسالة، نوع السياق، السياق، المتغيرات)"""
+
+    def __init__(self, max_entries=CACHE_SIZE, ttl=CACHE_TTL, persist=True,
+                 max_rows=CACHE_MAX_ROWS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._puts = 0
+        # cache_key -> [آخر استخدام, عدد القراءات] بانتظار الكتابة
+        self._touched = {}
+        self._touched_since = time.monotonic()
+
+    # ---- المفاتيح ----
+
+    def _keys(self, message, context_type, context, variables):
+        relevant = {
+            key: value for key, value in (variables or {}).items()
+            if key not in PERSONAL_VARIABLES and value not in (None, '', {}, [])
+        }
+        base = json.dumps(
+            [context_type, hashlib.sha1((context or '').encode('utf-8')).hexdigest(), relevant],
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        messages = (normalize_whitespace(message), normalize_message(message))
+        return [
+            (tier, hashlib.sha1(f'{tier}|{text}|{base}'.encode('utf-8')).hexdigest())
+            for tier, text in zip(TIERS, messages)
+        ]
+
+    def _record(self, context_type, outcome):
+        with self._lock:
+            stats = self._stats.setdefault(context_type, {
+                'hits': 0, 'misses': 0, 'exact_hits': 0, 'normalized_hits': 0, 'db_hits': 0
+            })
+            if outcome == 'miss':
+                stats['misses'] += 1
+            else:
+                stats['hits'] += 1
+                stats[f'{outcome}_hits'] += 1
+
+    # ---- القراءة والكتابة ----
+
+    def get(self, message, context_type, context='', variables=None):
+        """إرجاع الرد المخزن (كقالب) أو None"""
+        keys = self._keys(message, context_type, context, variables)
+        now = time.time()
+
+        with self._lock:
+            for tier, key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                response, expires_at = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                hit = (tier, response)
+                break
+            else:
+                hit = None
+
+        if hit:
+            self._record(context_type, hit[0])
+            return hit[1]
+
+        if self.persist:
+            response = self._load(keys, now)
+            if response is not None:
+                self._store_memory(keys, response, now + self.ttl)
+                self._record(context_type, 'db')
+                return response
+
+        self._record(context_type, 'miss')
+        return None
+
+    def _template(self, response, variables):
+        """تحويل المتغيرات الشخصية في الرد إلى {name} - أو None إذا تعذر ذلك بأمان"""
+        for key in PERSONAL_VARIABLES:
+            value = str((variables or {}).get(key) or '').strip()
+            if not value:
+                continue
+            # الاسم ككلمة مستقلة فقط - "نور" داخل "منور" أو "أمل" داخل "الأمل" لا يُمس
+            response = re.sub(rf'(?<!\w){re.escape(value)}(?!\w)', f'{{{key}}}', response)
+            if value in response:
+                # بقي الاسم ملتصقاً بكلمة ("لمحمد") - تخزينه يسرب اسم العميل لغيره
+                return None
+        return response
+
+    def put(self, message, context_type, context, variables, response):
+        """تخزين الرد مع تحويل المتغيرات الشخصية إلى قوالب"""
+        response = self._template(response, variables)
+        if response is None:
+            return
+
+        keys = self._keys(message, context_type, context, variables)
+        now = time.time()
+        self._store_memory(keys, response, now + self.ttl)
+
+        if self.persist:
+            with transaction() as cursor:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO response_cache
+                        (cache_key, tier, context_type, response, created_at, expires_at, last_used_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(key, tier, context_type, response, now, now + self.ttl, now) for tier, key in keys])
+
+            self._puts += 1
+            if self._puts % 500 == 0:
+                self.prune()
+
+    def _store_memory(self, keys, response, expires_at):
+        with self._lock:
+            for _, key in keys:
+                self._entries[key] = (response, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, keys, now):
+        cursor = get_connection().cursor()
+        cursor.execute('''
+            SELECT cache_key, response FROM response_cache
+            WHERE cache_key IN (?, ?) AND expires_at > ?
+        ''', (keys[0][1], keys[1][1], now))
+        rows = dict(cursor.fetchall())
+        for _, key in keys:
+            if key in rows:
+                self._touch(key, now)
+                return rows[key]
+        return None
+
+    def _touch(self, key, now):
+        with self._lock:
+            touched = self._touched.setdefault(key, [now, 0])
+            touched[0] = now
+            touched[1] += 1
+            due = (len(self._touched) >= CACHE_TOUCH_BATCH
+                   or time.monotonic() - self._touched_since >= CACHE_TOUCH_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """كتابة last_used_at وعدد القراءات المتراكمة في معاملة واحدة"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_since = time.monotonic()
+        if not touched:
+            return
+        with transaction() as cursor:
+            cursor.executemany('''
+                UPDATE response_cache SET last_used_at = MAX(COALESCE(last_used_at, 0), ?), hits = hits + ?
+                WHERE cache_key = ?
+            ''', [(last_used, hits, key) for key, (last_used, hits) in touched.items()])
+
+    # ---- الصيانة ----
+
+    def prune(self):
+        """حذف المنتهي وتقليص الجدول للحد الأقصى (الأقل استخداماً أولاً)"""
+        self.flush()
+        with transaction() as cursor:
+            cursor.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),))
+            cursor.execute('''
+                DELETE FROM response_cache WHERE cache_key IN (
+                    SELECT cache_key FROM response_cache
+                    ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_rows,))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._touched = {}
+        if self.persist:
+            with transaction() as cursor:
+                cursor.execute('DELETE FROM response_cache')
+
+    def stats(self):
+        """عدد مرات النجاح والفشل لكل نوع سياق"""
+        with self._lock:
+            result = {context: dict(values) for context, values in self._stats.items()}
+            size = len(self._entries)
+        for values in result.values():
+            total = values['hits'] + values['misses']
+            values['hit_rate'] = round(values['hits'] / total, 3) if total else 0.0
+        return {'contexts': result, 'memory_entries': size}
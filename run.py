@@ -7,7 +7,6 @@
 import os
 import sys
 import subprocess
-import sqlite3
 from pathlib import Path
 
 def setup_environment():
@@ -56,7 +55,7 @@ def install_requirements():
             print(f"📥 تثبيت {req}...")
             subprocess.check_call([sys.executable, '-m', 'pip', 'install', req])
 
-def initialize_database():
+def initialize_database(sample_data=True):
     """تهيئة قاعدة البيانات"""
     
     print("🗄️  تهيئة قاعدة البيانات...")
@@ -68,7 +67,8 @@ def initialize_database():
         print("✅ تم تهيئة قاعدة البيانات بنجاح")
         
         # إضافة بيانات تجريبية
-        add_sample_data()
+        if sample_data:
+            add_sample_data()
         
     except Exception as e:
         print(f"❌ خطأ في تهيئة قاعدة البيانات: {e}")
@@ -79,53 +79,47 @@ def initialize_database():
 def add_sample_data():
     """إضافة بيانات تجريبية للاختبار"""
     
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
+    from db import transaction
     
     try:
-        # التحقق من وجود بيانات
-        cursor.execute('SELECT COUNT(*) FROM agents')
-        if cursor.fetchone()[0] == 0:
-            # إضافة مندوب تجريبي
-            cursor.execute('''
-                INSERT INTO agents (agent_id, name, phone, email, password, status)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', ('demo_agent', 'أحمد محمد', '01012345678', 'ahmed@example.com', 'demo123', 1))
-            
-            # إضافة طلبات تجريبية
-            sample_orders = [
-                ('ORD001', 'سارة أحمد', '01123456789', 'فستان سهرة أسود', 1, 'new', '', '2024-01-15 10:30:00'),
-                ('ORD002', 'محمود علي', '01234567890', 'بنطلون جينز', 2, 'assigned', 'demo_agent', '2024-01-15 11:45:00'),
-                ('ORD003', 'نورا حسن', '01098765432', 'بلوزة قطنية', 3, 'in_progress', 'demo_agent', '2024-01-15 12:15:00'),
-            ]
-            
-            for order in sample_orders:
+        with transaction() as cursor:
+            # التحقق من وجود بيانات
+            cursor.execute('SELECT COUNT(*) FROM agents')
+            if cursor.fetchone()[0] == 0:
+                # إضافة مندوب تجريبي
                 cursor.execute('''
+                    INSERT INTO agents (agent_id, name, phone, email, password, status)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', ('demo_agent', 'أحمد محمد', '01012345678', 'ahmed@example.com', 'demo123', 1))
+                
+                # إضافة طلبات تجريبية
+                sample_orders = [
+                    ('ORD001', 'سارة أحمد', '01123456789', 'فستان سهرة أسود', 1, 'new', '', '2024-01-15 10:30:00'),
+                    ('ORD002', 'محمود علي', '01234567890', 'بنطلون جينز', 2, 'assigned', 'demo_agent', '2024-01-15 11:45:00'),
+                    ('ORD003', 'نورا حسن', '01098765432', 'بلوزة قطنية', 3, 'in_progress', 'demo_agent', '2024-01-15 12:15:00'),
+                ]
+                
+                cursor.executemany('''
                     INSERT INTO orders (order_id, customer_name, customer_phone, product, quantity, status, agent_id, created_at)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', order)
-            
-            # إضافة منتجات تجريبية من Shopify
-            sample_products = [
-                ('PROD001', 'فستان سهرة أسود', 'فستان سهرة أنيق باللون الأسود، مناسب للمناسبات الخاصة', '350', 'ملابس', 'https://via.placeholder.com/300', 1),
-                ('PROD002', 'بنطلون جينز كلاسيك', 'بنطلون جينز عالي الجودة بقصة كلاسيكية', '280', 'ملابس', 'https://via.placeholder.com/300', 1),
-                ('PROD003', 'بلوزة قطنية بيضاء', 'بلوزة قطنية مريحة باللون الأبيض', '150', 'ملابس', 'https://via.placeholder.com/300', 1),
-            ]
-            
-            for product in sample_products:
-                cursor.execute('''
+                ''', sample_orders)
+                
+                # إضافة منتجات تجريبية من Shopify
+                sample_products = [
+                    ('PROD001', 'فستان سهرة أسود', 'فستان سهرة أنيق باللون الأسود، مناسب للمناسبات الخاصة', '350', 'ملابس', 'https://via.placeholder.com/300', 1),
+                    ('PROD002', 'بنطلون جينز كلاسيك', 'بنطلون جينز عالي الجودة بقصة كلاسيكية', '280', 'ملابس', 'https://via.placeholder.com/300', 1),
+                    ('PROD003', 'بلوزة قطنية بيضاء', 'بلوزة قطنية مريحة باللون الأبيض', '150', 'ملابس', 'https://via.placeholder.com/300', 1),
+                ]
+                
+                cursor.executemany('''
                     INSERT INTO shopify_products (product_id, title, description, price, category, image_url, availability)
                     VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', product)
-            
-            conn.commit()
-            print("✅ تم إضافة بيانات تجريبية مصرية")
+                ''', sample_products)
+                
+                print("✅ تم إضافة بيانات تجريبية مصرية")
         
     except Exception as e:
         print(f"⚠️  لم يتم إضافة بيانات تجريبية: {e}")
-    
-    finally:
-        conn.close()
 
 def check_python_version():
     """التحقق من إصدار بايثون"""
@@ -151,15 +145,19 @@ def main():
     # إعداد البيئة
     setup_environment()
     
+    # --fast: بدون فحص/تثبيت المتطلبات والبيانات التجريبية (للتشغيل المتكرر)
+    fast = '--fast' in sys.argv or os.environ.get('FAST_START') == '1'
+    
     # تثبيت المتطلبات
-    try:
-        install_requirements()
-    except Exception as e:
-        print(f"⚠️  تحذير: لم يتم تثبيت جميع المتطلبات: {e}")
-        print("   يمكنك تثبيتهم يدوياً باستخدام: pip install -r requirements.txt")
+    if not fast:
+        try:
+            install_requirements()
+        except Exception as e:
+            print(f"⚠️  تحذير: لم يتم تثبيت جميع المتطلبات: {e}")
+            print("   يمكنك تثبيتهم يدوياً باستخدام: pip install -r requirements.txt")
     
     # تهيئة قاعدة البيانات
-    if not initialize_database():
+    if not initialize_database(sample_data=not fast):
         print("❌ فشل تهيئة قاعدة البيانات")
         return
     
@@ -168,6 +166,7 @@ def main():
     print("📱 لوحة التحكم: http://localhost:5000/admin/dashboard")
     print("📱 دخول المندوب: http://localhost:5000/agent")
     print("🔑 كلمة مرور المسؤول:", os.environ.get('ADMIN_PASS', 'admin123'))
+    print("🏭 للإنتاج: python serve.py (gunicorn/waitress بدون وضع التطوير)")
     print("\n⚡ بدء تشغيل الخادم...")
     
     # تشغيل التطبيق
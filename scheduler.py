@@ -0,0 +1,251 @@
+"""
+مُجدول المهام الدورية (التقارير، مزامنة Shopify، تنظيف السجلات، إعادة حساب الإحصائيات)
+المواعيد محفوظة في جدول scheduled_jobs، والتنفيذ نفسه يتم عبر طابور المهام
+قفل مؤجر في SQLite يضمن أن عملية واحدة فقط تطلق المهام مهما كان عدد العمال
+"""
+
+import os
+import re
+import time
+import socket
+import threading
+from datetime import datetime, timedelta
+from dbpool import get_connection, transaction
+from db import add_log
+
+SCHEDULER_LEASE = float(os.environ.get('SCHEDULER_LEASE', 60))
+SCHEDULER_POLL = float(os.environ.get('SCHEDULER_POLL', 30))
+# موعد فائت أقدم من هذه المدة يُتجاوز بدلاً من تشغيله متأخراً (للمهام التي تسمح بذلك)
+SCHEDULER_MISFIRE_GRACE = float(os.environ.get('SCHEDULER_MISFIRE_GRACE', 6 * 3600))
+STATS_REBUILD_AT = os.environ.get('STATS_REBUILD_AT', '03:30')
+STATS_REBUILD_DAYS = int(os.environ.get('STATS_REBUILD_DAYS', 7))
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+_TIME = r'(\d{1,2}):(\d{2})'
+
+
+class Schedule:
+    """موعد مثل '09:00' أو 'monday 10:00' أو '1st 09:00' أو 'every 900' (ثوانٍ)"""
+
+    def __init__(self, spec):
+        self.spec = spec.strip().lower()
+        self.interval = None
+        self.weekday = None
+        self.monthday = None
+
+        match = re.fullmatch(r'every\s+(\d+)', self.spec)
+        if match:
+            self.interval = int(match.group(1))
+            if self.interval <= 0:
+                raise ValueError(f'invalid schedule interval: {spec}')
+            return
+
+        match = re.fullmatch(r'(?:(\w+)\s+)?' + _TIME, self.spec)
+        if not match:
+            raise ValueError(f'invalid schedule: {spec}')
+        prefix, hour, minute = match.groups()
+        self.hour, self.minute = int(hour), int(minute)
+        if self.hour > 23 or self.minute > 59:
+            raise ValueError(f'invalid schedule time: {spec}')
+        if prefix in WEEKDAYS:
+            self.weekday = WEEKDAYS.index(prefix)
+        elif prefix:
+            day = re.fullmatch(r'(\d{1,2})(?:st|nd|rd|th)?', prefix)
+            if not day or not 1 <= int(day.group(1)) <= 28:
+                raise ValueError(f'invalid schedule day: {spec}')
+            self.monthday = int(day.group(1))
+
+    def next_after(self, moment):
+        """أول موعد بعد moment (datetime محلي)"""
+        if self.interval:
+            # حدود ثابتة من بداية العصر - نفس الموعد في كل العمليات
+            return datetime.fromtimestamp((int(moment.timestamp()) // self.interval + 1) * self.interval)
+
+        candidate = moment.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if self.monthday:
+            candidate = candidate.replace(day=self.monthday)
+            if candidate <= moment:
+                month = candidate.replace(day=1) + timedelta(days=32)
+                candidate = month.replace(day=self.monthday)
+            return candidate
+
+        if candidate <= moment:
+            candidate += timedelta(days=1)
+        if self.weekday is not None:
+            candidate += timedelta(days=(self.weekday - candidate.weekday()) % 7)
+        return candidate
+
+    def last_due(self, first_missed, now):
+        """آخر موعد فائت بين first_missed و now (timestamps) - التشغيل المدمج يمثل أحدثها"""
+        if self.interval:
+            return max(first_missed, (int(now) // self.interval) * self.interval)
+        last = first_missed
+        following = self.next_after(datetime.fromtimestamp(last)).timestamp()
+        while following <= now:
+            last = following
+            following = self.next_after(datetime.fromtimestamp(last)).timestamp()
+        return last
+
+
+class ScheduledJob:
+    def __init__(self, name, spec, job_type, payload=None, catch_up=True):
+        self.name = name
+        self.schedule = Schedule(spec)
+        self.job_type = job_type
+        self.payload = payload or {}
+        # catch_up: تشغيل واحد بعد التوقف مهما فات من مواعيد، وإلا يُتجاوز ما فات المهلة
+        self.catch_up = catch_up
+
+
+class Scheduler:
+    """خيط واحد لكل عملية - فقط صاحب القفل يضيف المهام المستحقة إلى الطابور"""
+
+    def __init__(self, queue, lease=SCHEDULER_LEASE, poll_interval=SCHEDULER_POLL,
+                 misfire_grace=SCHEDULER_MISFIRE_GRACE):
+        self.queue = queue
+        self.lease = lease
+        self.poll_interval = min(poll_interval, lease / 2)
+        self.misfire_grace = misfire_grace
+        self.jobs = {}
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._next_due = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def add(self, name, spec, job_type=None, payload=None, catch_up=True):
+        self.jobs[name] = ScheduledJob(name, spec, job_type or name, payload, catch_up)
+
+    # ---- القفل ----
+
+    def _acquire(self, cursor, now):
+        """أخذ القفل أو تجديده - ينجح إذا كنا أصحابه أو انتهت مدة صاحبه"""
+        cursor.execute('''
+            INSERT INTO scheduler_lock (name, owner, expires_at) VALUES ('scheduler', ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE scheduler_lock.owner = excluded.owner OR scheduler_lock.expires_at < ?
+        ''', (self.owner, now + self.lease, now))
+        return cursor.rowcount > 0
+
+    def release(self):
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM scheduler_lock WHERE name = 'scheduler' AND owner = ?", (self.owner,))
+
+    # ---- التشغيل ----
+
+    def tick(self):
+        """دورة واحدة: ترجع عدد المهام التي أضيفت للطابور أو None إذا لم نكن أصحاب القفل"""
+        now = time.time()
+        due = []
+        with transaction(immediate=True) as cursor:
+            if not self._acquire(cursor, now):
+                return None
+
+            cursor.execute('SELECT name, schedule, next_run_at FROM scheduled_jobs')
+            stored = {name: (spec, next_run) for name, spec, next_run in cursor.fetchall()}
+            moment = datetime.fromtimestamp(now)
+            upcoming = []
+
+            for job in self.jobs.values():
+                spec, next_run = stored.get(job.name, (None, None))
+                if spec != job.schedule.spec or next_run is None:
+                    # مهمة جديدة أو تغير موعدها
+                    next_run = job.schedule.next_after(moment).timestamp()
+                    cursor.execute('''
+                        INSERT INTO scheduled_jobs (name, schedule, next_run_at) VALUES (?, ?, ?)
+                        ON CONFLICT (name) DO UPDATE SET schedule = excluded.schedule, next_run_at = excluded.next_run_at
+                    ''', (job.name, job.schedule.spec, next_run))
+                    upcoming.append(next_run)
+                    continue
+                if next_run > now:
+                    upcoming.append(next_run)
+                    continue
+
+                # المواعيد الفائتة (بعد توقف العملية) تُدمج في تشغيل واحد لأحدثها
+                scheduled_for = job.schedule.last_due(next_run, now)
+                following = job.schedule.next_after(moment).timestamp()
+                if not job.catch_up and now - scheduled_for > self.misfire_grace:
+                    cursor.execute('''
+                        UPDATE scheduled_jobs SET next_run_at = ?, last_run_at = ?, last_status = 'skipped'
+                        WHERE name = ?
+                    ''', (following, now, job.name))
+                    upcoming.append(following)
+                    continue
+                due.append((job, next_run, scheduled_for, following))
+
+        # الإضافة للطابور أولاً ثم تقديم الموعد - لو فشلت يبقى الموعد مستحقاً ويُعاد في الدورة التالية
+        # ولو توقفت العملية بينهما فمفتاح الموعد يمنع تكرار المهمة عند إعادة المحاولة
+        queued = 0
+        for job, next_run, scheduled_for, following in due:
+            payload = dict(job.payload, scheduled=True, scheduled_for=scheduled_for)
+            try:
+                # مفتاح الموعد يمنع التكرار لو انتقل القفل بين عمليتين في نفس اللحظة
+                self.queue.enqueue(job.job_type, payload, dedup_key=f'{job.name}:{int(scheduled_for)}')
+            except Exception as e:
+                add_log('error', f'Scheduled job {job.name} could not be queued: {str(e)}', 'scheduler')
+                with transaction() as cursor:
+                    cursor.execute('''
+                        UPDATE scheduled_jobs SET last_run_at = ?, last_status = 'failed' WHERE name = ?
+                    ''', (now, job.name))
+                upcoming.append(now + self.poll_interval)
+                continue
+            with transaction() as cursor:
+                # الشرط على الموعد القديم - لا نكتب فوق عملية أخذت القفل وسبقتنا بعد انتهاء مدتنا
+                cursor.execute('''
+                    UPDATE scheduled_jobs SET next_run_at = ?, last_run_at = ?, last_status = 'queued', runs = runs + 1
+                    WHERE name = ? AND next_run_at = ?
+                ''', (following, now, job.name, next_run))
+            upcoming.append(following)
+            queued += 1
+
+        self._next_due = min(upcoming) if upcoming else None
+        return queued
+
+    def next_wakeup(self):
+        """الانتظار حتى أقرب موعد - بحد أقصى poll_interval لتجديد القفل في الوقت"""
+        if self._next_due is None:
+            return self.poll_interval
+        return max(0.5, min(self.poll_interval, self._next_due - time.time()))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        try:
+            self.release()
+        except Exception:
+            pass
+
+    def _run(self):
+        while not self._stopping.is_set():
+            wait = self.poll_interval
+            try:
+                if self.tick() is not None:
+                    wait = self.next_wakeup()
+            except Exception as e:
+                add_log('error', f'Scheduler tick failed: {str(e)}', 'scheduler')
+            self._stopping.wait(wait)
+
+    def status(self):
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT owner, expires_at FROM scheduler_lock WHERE name = ?', ('scheduler',))
+        lock = cursor.fetchone()
+        cursor.execute('SELECT name, schedule, next_run_at, last_run_at, last_status, runs FROM scheduled_jobs ORDER BY name')
+        return {
+            'owner': lock[0] if lock and lock[1] > time.time() else None,
+            'is_leader': bool(lock and lock[0] == self.owner and lock[1] > time.time()),
+            'jobs': [{
+                'name': name,
+                'schedule': spec,
+                'next_run_at': datetime.fromtimestamp(next_run).isoformat(' ', 'seconds') if next_run else None,
+                'last_run_at': datetime.fromtimestamp(last_run).isoformat(' ', 'seconds') if last_run else None,
+                'last_status': last_status,
+                'runs': runs
+            } for name, spec, next_run, last_run, last_status, runs in cursor.fetchall()]
+        }
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+تشغيل الإنتاج بدلاً من خادم Flask التجريبي
+بدون فحص المتطلبات أو البيانات التجريبية - قاعدة البيانات تُهيأ مرة واحدة عند تحميل التطبيق
+
+    python serve.py            # الويب + العمال (all)
+    python serve.py web        # طلبات HTTP فقط
+    python serve.py worker     # طابور المهام + المُجدول فقط
+
+الخادم: gunicorn (عمليات × خيوط مع تحميل مسبق) ثم waitress ثم خادم werkzeug متعدد الخيوط
+"""
+
+import os
+import sys
+import signal
+import threading
+
+WEB_HOST = os.environ.get('WEB_HOST', '0.0.0.0')
+WEB_PORT = int(os.environ.get('WEB_PORT', os.environ.get('PORT', 5000)))
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 2))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 60))
+WEB_SERVER = os.environ.get('WEB_SERVER', 'auto')
+
+ROLES = ('all', 'web', 'worker')
+
+
+def load_app():
+    """استيراد التطبيق بدون تشغيل العمال - الدور يحدد أين ومتى يبدأون"""
+    os.environ['APP_START_WORKERS'] = '0'
+    import app as app_module
+    return app_module
+
+
+def _gunicorn_available():
+    try:
+        import gunicorn  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def serve_gunicorn(app_module, role):
+    from gunicorn.app.base import BaseApplication
+    import dbpool
+
+    def post_fork(server, worker):
+        # كل عملية ويب تحمل عمالها الخاصين - الطابور والقفل في SQLite مشتركان
+        if role == 'all':
+            app_module.start_workers()
+
+    class Application(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                'bind': f'{WEB_HOST}:{WEB_PORT}',
+                'workers': WEB_WORKERS,
+                'threads': WEB_THREADS,
+                'worker_class': 'gthread',
+                'timeout': WEB_TIMEOUT,
+                'preload_app': True,
+                'post_fork': post_fork,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app_module.app
+
+    # اتصالات SQLite لا تُنقل عبر fork - العمليات الفرعية تفتح اتصالاتها
+    dbpool.close_all()
+    Application().run()
+
+
+def serve_single(app_module, role):
+    """عملية واحدة متعددة الخيوط (waitress إن وجد)"""
+    if role == 'all':
+        app_module.start_workers()
+    if WEB_SERVER in ('auto', 'waitress'):
+        try:
+            from waitress import serve
+            print(f'waitress on {WEB_HOST}:{WEB_PORT} ({WEB_THREADS} threads)')
+            serve(app_module.app, host=WEB_HOST, port=WEB_PORT, threads=WEB_THREADS)
+            return
+        except ImportError:
+            if WEB_SERVER == 'waitress':
+                raise
+    from werkzeug.serving import run_simple
+    print(f'werkzeug (threaded) on {WEB_HOST}:{WEB_PORT}')
+    run_simple(WEB_HOST, WEB_PORT, app_module.app, threaded=True,
+               use_reloader=False, use_debugger=False)
+
+
+def run_worker(app_module):
+    """عملية خلفية: طابور المهام + المُجدول حتى إشارة الإيقاف"""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    signal.signal(signal.SIGINT, lambda *args: stopping.set())
+    app_module.start_workers()
+    print(f'worker started ({app_module.worker_pool.size} job threads)')
+    stopping.wait()
+    # الإيقاف المنظم (إنهاء المهام الجارية) مسجل في atexit
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    role = argv[0] if argv else os.environ.get('APP_ROLE', 'all')
+    if role not in ROLES:
+        print(f'usage: serve.py [{"|".join(ROLES)}]')
+        return 2
+
+    app_module = load_app()
+    if role == 'worker':
+        run_worker(app_module)
+    elif WEB_SERVER in ('auto', 'gunicorn') and WEB_WORKERS > 1 and _gunicorn_available():
+        serve_gunicorn(app_module, role)
+    else:
+        serve_single(app_module, role)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""
+مزامنة الطلبات مع جدول Google Sheets في الاتجاهين
+السحب: قراءة الجدول بـ values:batchGet وتطبيق تعديلات الصفوف التي تغير hash-ها منذ آخر مزامنة
+الدفع: الطلبات المعدلة بعد مؤشر updated_at فقط، والصفوف المتغيرة فعلاً تُكتب بـ values:batchUpdate
+مع تجميع الصفوف المتتالية في نطاق واحد ومعدل طلبات ضمن حصة Sheets API
+"""
+
+import os
+import random
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from dbpool import get_connection, transaction
+from db import (
+    add_log, format_timestamp, get_service_token, get_service_config, get_sync_state, save_sync_state,
+    ORDER_COLUMNS, ORDER_STATUSES
+)
+from outbox import TokenBucket
+
+SHEETS_TAB = os.environ.get('SHEETS_TAB', 'Orders')
+# لتوجيه الطلبات إلى خادم محلي وهمي أثناء التجربة
+SHEETS_BASE_URL = os.environ.get('SHEETS_BASE_URL', '')
+SHEETS_TIMEOUT = float(os.environ.get('SHEETS_TIMEOUT', 30))
+SHEETS_MAX_RETRIES = int(os.environ.get('SHEETS_MAX_RETRIES', 5))
+# حصة Sheets API الافتراضية: 60 طلب قراءة و 60 طلب كتابة في الدقيقة لكل مستخدم
+SHEETS_REQUESTS_PER_MINUTE = float(os.environ.get('SHEETS_REQUESTS_PER_MINUTE', 60))
+# عدد الصفوف في كل نطاق قراءة، وعدد النطاقات في كل طلب batchGet
+SHEETS_READ_CHUNK = int(os.environ.get('SHEETS_READ_CHUNK', 5000))
+SHEETS_READ_RANGES = int(os.environ.get('SHEETS_READ_RANGES', 4))
+# أقصى عدد صفوف في طلب batchUpdate واحد (الحمولة تبقى أقل بكثير من حد 10MB)
+SHEETS_WRITE_ROWS = int(os.environ.get('SHEETS_WRITE_ROWS', 5000))
+SHEETS_SYNC_INTERVAL = float(os.environ.get('SHEETS_SYNC_INTERVAL', 5 * 60))
+
+SYNC_NAME = 'sheets_orders'
+
+# ترتيب الأعمدة في الجدول - الصف 1 عناوين
+SHEET_COLUMNS = ('order_id', 'customer_name', 'customer_phone', 'product', 'quantity',
+                 'status', 'agent_id', 'city', 'created_at', 'updated_at')
+# الأعمدة التي يُسمح بتعديلها من الجدول
+EDITABLE_COLUMNS = ('customer_name', 'customer_phone', 'product', 'quantity', 'status', 'agent_id', 'city')
+# updated_at يتغير مع كل مزامنة فلا يدخل في المقارنة
+HASHED_COLUMNS = SHEET_COLUMNS[:-1]
+LAST_COLUMN = chr(ord('A') + len(SHEET_COLUMNS) - 1)
+
+
+class SheetsSyncError(Exception):
+    """فشل الاتصال بـ Sheets API أو رد غير متوقع"""
+
+
+def row_values(order):
+    """صف الجدول لطلب - كل القيم نصوص كما تعيدها القراءة بـ FORMATTED_VALUE"""
+    return ['' if order.get(column) is None else str(order[column]) for column in SHEET_COLUMNS]
+
+
+def row_hash(values):
+    values = list(values) + [''] * (len(SHEET_COLUMNS) - len(values))
+    return hashlib.sha1('\x1f'.join(values[:len(HASHED_COLUMNS)]).encode()).hexdigest()
+
+
+def _a1(tab, first_row, last_row):
+    return f"'{tab}'!A{first_row}:{LAST_COLUMN}{last_row}"
+
+
+class SheetsClient:
+    """عميل values API بجلسة HTTP واحدة ومعدل طلبات محدود"""
+
+    def __init__(self, spreadsheet_id, access_token, base_url=None, timeout=SHEETS_TIMEOUT,
+                 requests_per_minute=SHEETS_REQUESTS_PER_MINUTE):
+        base_url = base_url or SHEETS_BASE_URL or 'https://sheets.googleapis.com'
+        self.values_url = f"{base_url.rstrip('/')}/v4/spreadsheets/{spreadsheet_id}/values"
+        self.timeout = timeout
+        self.bucket = TokenBucket(requests_per_minute / 60.0, max(1, int(requests_per_minute / 6)))
+        self.requests = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Authorization': f'Bearer {access_token}', 'Accept': 'application/json'})
+
+    def _request(self, method, url, **kwargs):
+        """طلب ضمن الحصة مع إعادة المحاولة عند 429 و 5xx (تأخير أسي عشوائي)"""
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            self.bucket.acquire()
+            self.requests += 1
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                error = SheetsSyncError(f'Sheets request failed: {str(e)}')
+            else:
+                if response.status_code == 200:
+                    try:
+                        return response.json()
+                    except ValueError:
+                        raise SheetsSyncError('Sheets returned invalid JSON')
+                error = SheetsSyncError(f'Sheets API error: {response.status_code} {response.text[:200]}')
+                if response.status_code != 429 and response.status_code < 500:
+                    raise error
+            if attempt < SHEETS_MAX_RETRIES:
+                delay = min(64, 2 ** attempt) * random.uniform(0.5, 1.0)
+                # كل الطلبات التالية تنتظر أيضاً - تجاوز الحصة يخص المستخدم كله
+                self.bucket.pause(delay)
+        raise error
+
+    def batch_get(self, ranges):
+        """قيم كل نطاق كقائمة صفوف (الصفوف الفارغة في النهاية لا تُرجع)"""
+        data = self._request('GET', f'{self.values_url}:batchGet', params={
+            'ranges': ranges, 'majorDimension': 'ROWS', 'valueRenderOption': 'FORMATTED_VALUE'
+        })
+        return [value_range.get('values', []) for value_range in data.get('valueRanges', [])]
+
+    def batch_update(self, data):
+        """كتابة عدة نطاقات في طلب واحد - ترجع عدد الخلايا المكتوبة"""
+        result = self._request('POST', f'{self.values_url}:batchUpdate', json={
+            'valueInputOption': 'RAW', 'data': data
+        })
+        return result.get('totalUpdatedCells', 0)
+
+
+def _load_orders(cursor, where, params):
+    columns = ', '.join(('id',) + SHEET_COLUMNS)
+    cursor.execute(f'SELECT {columns} FROM orders WHERE {where}', params)
+    names = ('id',) + SHEET_COLUMNS
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+class OrderSheetSync:
+    """مزامنة واحدة: سحب تعديلات الجدول ثم دفع تعديلات قاعدة البيانات"""
+
+    def __init__(self, client, tab=SHEETS_TAB, name=SYNC_NAME):
+        self.client = client
+        self.tab = tab
+        self.name = name
+        # آخر صف مشغول في الجدول (حتى صفوف لم نتعرف عليها) - الإضافة تبدأ بعده
+        self.last_row = 1
+
+    def run(self, full=False):
+        state = get_sync_state(self.name)
+        since = None if full else state['cursor']
+        stats = {'read_rows': 0, 'imported': 0, 'created': 0, 'conflicts': 0, 'invalid': 0,
+                 'candidates': 0, 'written_rows': 0, 'written_cells': 0, 'requests': 0}
+        started_requests = self.client.requests
+        try:
+            changes = self.pull(stats)
+            # تعديلات السحب نفسها تحرك updated_at - نقرأ المؤشر بعدها حتى تُدفع قيمها المنسقة
+            watermark = self.push(since, stats)
+        except Exception as e:
+            save_sync_state(self.name, 'error', stats['written_rows'], details=str(e)[:500])
+            raise
+        stats['requests'] = self.client.requests - started_requests
+        save_sync_state(self.name, 'ok', stats['written_rows'] + stats['imported'] + stats['created'],
+                        cursor_value=watermark or since)
+        stats['cursor'] = watermark or since
+        return stats, changes
+
+    # ---------- السحب ----------
+
+    def read_sheet(self):
+        """كل صفوف البيانات (من الصف 2) على دفعات من النطاقات - ترجع [(رقم الصف، القيم)]"""
+        rows = []
+        first = 2
+        while True:
+            ranges = []
+            for index in range(SHEETS_READ_RANGES):
+                start = first + index * SHEETS_READ_CHUNK
+                ranges.append((start, _a1(self.tab, start, start + SHEETS_READ_CHUNK - 1)))
+            results = self.client.batch_get([a1 for start, a1 in ranges])
+            for (start, a1), values in zip(ranges, results):
+                rows.extend((start + offset, row) for offset, row in enumerate(values))
+            # نطاق غير ممتلئ = نهاية الجدول
+            if not results or len(results[-1]) < SHEETS_READ_CHUNK:
+                return rows
+            first += SHEETS_READ_RANGES * SHEETS_READ_CHUNK
+
+    def pull(self, stats):
+        """تطبيق الصفوف التي عُدلت في الجدول - ترجع [(قبل، بعد)] لتغييرات الحالة/المندوب"""
+        rows = self.read_sheet()
+        stats['read_rows'] = len(rows)
+        self.last_row = max([row_number for row_number, values in rows if values] or [1])
+        cursor = get_connection().cursor()
+        cursor.execute('SELECT order_id, row_number, row_hash FROM sheet_rows')
+        known = {order_id: (row_number, stored) for order_id, row_number, stored in cursor.fetchall()}
+
+        positions = {}
+        edited = {}
+        for row_number, values in rows:
+            order_id = (values[0] if values else '').strip()
+            if not order_id or order_id in positions:
+                continue
+            positions[order_id] = row_number
+            digest = row_hash(values)
+            if known.get(order_id, (None, None))[1] != digest:
+                edited[order_id] = (row_number, values, digest)
+
+        changes = []
+        now = format_timestamp()
+        with transaction(immediate=True) as cursor:
+            # ترتيب الجدول أو حذف صفوف منه: الموقع الفعلي هو المرجع، والمفقود يُكتب من جديد
+            moved = [(positions[order_id], order_id) for order_id, (row_number, stored) in known.items()
+                     if order_id in positions and positions[order_id] != row_number]
+            missing = [(order_id,) for order_id in known if order_id not in positions]
+            cursor.executemany('UPDATE sheet_rows SET row_number = ? WHERE order_id = ?', moved)
+            cursor.executemany('UPDATE sheet_rows SET row_number = NULL, row_hash = NULL WHERE order_id = ?',
+                               missing)
+            if edited:
+                changes = self._apply_edits(cursor, edited, known, now, stats)
+        return changes
+
+    def _apply_edits(self, cursor, edited, known, now, stats):
+        current = {}
+        ids = list(edited)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            for order in _load_orders(cursor, f'order_id IN ({",".join("?" * len(chunk))})', chunk):
+                current[order['order_id']] = order
+
+        updates, inserts, synced, changes = [], [], [], []
+        for order_id, (row_number, values, digest) in edited.items():
+            values = list(values) + [''] * (len(SHEET_COLUMNS) - len(values))
+            sheet = dict(zip(SHEET_COLUMNS, (value.strip() for value in values)))
+            if sheet['status'] not in ORDER_STATUSES or (sheet['quantity'] and not sheet['quantity'].isdigit()):
+                stats['invalid'] += 1
+                continue
+            fields = {column: sheet[column] or None for column in EDITABLE_COLUMNS}
+            fields['quantity'] = int(sheet['quantity']) if sheet['quantity'] else None
+
+            order = current.get(order_id)
+            if order is None:
+                inserts.append(dict(fields, order_id=order_id, created_at=sheet['created_at'] or now,
+                                    updated_at=now))
+                synced.append((order_id, row_number, digest))
+                stats['created'] += 1
+                continue
+            if order_id in known and row_hash(row_values(order)) != known[order_id][1]:
+                # تعدل الطلب في الجدول وفي قاعدة البيانات معاً: قاعدة البيانات تكسب والدفع يعيد كتابة الصف
+                stats['conflicts'] += 1
+                continue
+            if all(order[column] == fields[column] for column in EDITABLE_COLUMNS):
+                synced.append((order_id, row_number, digest))
+                continue
+            updates.append(dict(fields, id=order['id'], updated_at=now))
+            synced.append((order_id, row_number, digest))
+            stats['imported'] += 1
+            if order['status'] != fields['status'] or order['agent_id'] != fields['agent_id']:
+                before = {column: order.get(column) for column in ORDER_COLUMNS}
+                changes.append((before, dict(before, status=fields['status'], agent_id=fields['agent_id'])))
+
+        assignments = ', '.join(f'{column} = :{column}' for column in EDITABLE_COLUMNS)
+        cursor.executemany(f'UPDATE orders SET {assignments}, updated_at = :updated_at WHERE id = :id', updates)
+        cursor.executemany(f'''
+            INSERT INTO orders (order_id, {', '.join(EDITABLE_COLUMNS)}, created_at, updated_at)
+            VALUES (:order_id, {', '.join(':' + column for column in EDITABLE_COLUMNS)}, :created_at, :updated_at)
+        ''', inserts)
+        # hash الجدول يُحفظ كما هو - الدفع يقارن بعدها قيم قاعدة البيانات المنسقة ويكتب عند الاختلاف فقط
+        cursor.executemany('''
+            INSERT INTO sheet_rows (order_id, row_number, row_hash, synced_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (order_id) DO UPDATE SET
+                row_number = excluded.row_number, row_hash = excluded.row_hash, synced_at = excluded.synced_at
+        ''', [(order_id, row_number, digest, now) for order_id, row_number, digest in synced])
+        # الطلبات المضافة من الجدول تُعامل كتغيير من لا شيء (حمل المناديب، إشعارهم، كاش التقارير)
+        for start in range(0, len(inserts), 500):
+            chunk = [order['order_id'] for order in inserts[start:start + 500]]
+            for order in _load_orders(cursor, f'order_id IN ({",".join("?" * len(chunk))})', chunk):
+                changes.append((None, {column: order.get(column) for column in ORDER_COLUMNS}))
+        return changes
+
+    # ---------- الدفع ----------
+
+    def push(self, since, stats):
+        """كتابة الطلبات المتغيرة منذ المؤشر - ترجع أحدث updated_at تمت كتابته"""
+        cursor = get_connection().cursor()
+        if since:
+            # >= وليس > : تعديلات في نفس الثانية بعد آخر مزامنة لا تضيع، والـ hash يمنع التكرار
+            orders = _load_orders(cursor, 'updated_at >= ?', (since,))
+        else:
+            orders = _load_orders(cursor, '1', ())
+        cursor.execute('SELECT order_id FROM sheet_rows WHERE row_hash IS NULL')
+        missing = [row[0] for row in cursor.fetchall()]
+        seen = {order['order_id'] for order in orders}
+        missing = [order_id for order_id in missing if order_id not in seen]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            orders.extend(_load_orders(cursor, f'order_id IN ({",".join("?" * len(chunk))})', chunk))
+        stats['candidates'] = len(orders)
+        watermark = max((str(order['updated_at']) for order in orders if order['updated_at']), default=since)
+        if not orders:
+            return watermark
+
+        cursor.execute('SELECT order_id, row_number, row_hash FROM sheet_rows')
+        known = {order_id: (row_number, stored) for order_id, row_number, stored in cursor.fetchall()}
+        cursor.execute('SELECT COALESCE(MAX(row_number), 1) FROM sheet_rows')
+        next_row = max(cursor.fetchone()[0], self.last_row) + 1
+
+        pending = []
+        for order in sorted(orders, key=lambda order: order['id']):
+            values = row_values(order)
+            digest = row_hash(values)
+            row_number, stored = known.get(order['order_id'], (None, None))
+            if stored == digest and row_number:
+                continue
+            if not row_number:
+                row_number, next_row = next_row, next_row + 1
+            pending.append((row_number, order['order_id'], values, digest))
+
+        if not known:
+            self._write([{'range': _a1(self.tab, 1, 1), 'values': [list(SHEET_COLUMNS)]}], stats)
+        for start in range(0, len(pending), SHEETS_WRITE_ROWS):
+            chunk = pending[start:start + SHEETS_WRITE_ROWS]
+            self._write(self._ranges(chunk), stats)
+            now = format_timestamp()
+            with transaction() as cursor:
+                cursor.executemany('''
+                    INSERT INTO sheet_rows (order_id, row_number, row_hash, synced_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (order_id) DO UPDATE SET
+                        row_number = excluded.row_number, row_hash = excluded.row_hash, synced_at = excluded.synced_at
+                ''', [(order_id, row_number, digest, now) for row_number, order_id, values, digest in chunk])
+            stats['written_rows'] += len(chunk)
+        return watermark
+
+    def _ranges(self, rows):
+        """الصفوف المتتالية تُدمج في نطاق واحد بدلاً من نطاق لكل صف"""
+        data = []
+        for row_number, order_id, values, digest in sorted(rows, key=lambda row: row[0]):
+            if data and data[-1]['last'] == row_number - 1:
+                data[-1]['values'].append(values)
+                data[-1]['last'] = row_number
+            else:
+                data.append({'first': row_number, 'last': row_number, 'values': [values]})
+        return [{'range': _a1(self.tab, item['first'], item['last']), 'values': item['values']} for item in data]
+
+    def _write(self, data, stats):
+        stats['written_cells'] += self.client.batch_update(data)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """عميل من الإعدادات المحفوظة (settings: googlesheet) أو None - الجلسة تبقى مفتوحة بين المزامنات"""
+    token = get_service_token('googlesheet')
+    spreadsheet_id = get_service_config('googlesheet').get('orders_sheet')
+    if not token or not spreadsheet_id:
+        return None
+    with _clients_lock:
+        client = _clients.get((spreadsheet_id, token))
+        if client is None:
+            _clients.clear()
+            client = _clients[(spreadsheet_id, token)] = SheetsClient(spreadsheet_id, token)
+        return client
+
+
+def sync_orders(full=False):
+    """ترجع (الإحصائيات، تغييرات الحالة/المندوب القادمة من الجدول) أو None إذا لم يتم الربط"""
+    client = get_client()
+    if client is None:
+        return None
+    tab = get_service_config('googlesheet').get('orders_tab') or SHEETS_TAB
+    stats, changes = OrderSheetSync(client, tab=tab).run(full=full)
+    add_log('info', f"Sheets sync: {stats['imported'] + stats['created']} rows imported, "
+                    f"{stats['written_rows']} rows written in {stats['requests']} requests", 'googlesheet')
+    return stats, changes
@@ -0,0 +1,203 @@
+"""
+مزامنة كتالوج Shopify مع جدول shopify_products
+صفحات متتالية عبر مولّد (Link / page_info) وإدخال كل صفحة في معاملة واحدة
+مع مؤشر updated_at حتى تجلب المزامنات التالية التعديلات فقط
+"""
+
+import os
+import time
+import random
+from datetime import datetime
+import requests
+from requests.adapters import HTTPAdapter
+from dbpool import transaction
+from db import (
+    add_log, get_service_token, get_service_config, get_sync_state, save_sync_state
+)
+
+SHOPIFY_API_VERSION = os.environ.get('SHOPIFY_API_VERSION', '2023-10')
+SHOPIFY_PAGE_SIZE = int(os.environ.get('SHOPIFY_PAGE_SIZE', 250))
+SHOPIFY_TIMEOUT = float(os.environ.get('SHOPIFY_TIMEOUT', 30))
+SHOPIFY_MAX_RETRIES = int(os.environ.get('SHOPIFY_MAX_RETRIES', 4))
+SHOPIFY_SYNC_INTERVAL = float(os.environ.get('SHOPIFY_SYNC_INTERVAL', 15 * 60))
+# لتوجيه الطلبات إلى خادم محلي وهمي أثناء التجربة
+SHOPIFY_BASE_URL = os.environ.get('SHOPIFY_BASE_URL', '')
+
+SYNC_NAME = 'shopify_products'
+
+PRODUCT_FIELDS = 'id,title,body_html,product_type,status,variants,image,updated_at'
+
+
+class ShopifySyncError(Exception):
+    """فشل الاتصال بـ Shopify أو رد غير متوقع"""
+
+
+def parse_product(item):
+    """تحويل منتج Shopify إلى صف shopify_products"""
+    variants = item.get('variants') or [{}]
+    image = item.get('image') or {}
+    stock = [v.get('inventory_quantity') for v in variants if v.get('inventory_quantity') is not None]
+    return {
+        'product_id': str(item.get('id')),
+        'title': item.get('title', ''),
+        'description': item.get('body_html') or '',
+        'price': variants[0].get('price', ''),
+        'category': item.get('product_type', ''),
+        'image_url': image.get('src', ''),
+        'availability': item.get('status') == 'active',
+        'inventory_quantity': sum(stock) if stock else None
+    }
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+
+
+class ShopifyClient:
+    """عميل REST لـ Shopify بجلسة HTTP واحدة"""
+
+    def __init__(self, store_url, access_token, base_url=None, api_version=SHOPIFY_API_VERSION,
+                 page_size=SHOPIFY_PAGE_SIZE, timeout=SHOPIFY_TIMEOUT):
+        store = store_url.replace('https://', '').replace('http://', '').strip('/')
+        base_url = base_url or SHOPIFY_BASE_URL or f'https://{store}'
+        self.api_url = f"{base_url.rstrip('/')}/admin/api/{api_version}"
+        self.page_size = min(page_size, 250)
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(max_retries=0))
+        self.session.mount('https://', HTTPAdapter(max_retries=0))
+        self.session.headers.update({
+            'X-Shopify-Access-Token': access_token,
+            'Accept': 'application/json'
+        })
+
+    def _get(self, url, params=None):
+        """GET مع إعادة المحاولة عند 429 و 5xx"""
+        for attempt in range(SHOPIFY_MAX_RETRIES + 1):
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = ShopifySyncError(f'Shopify request failed: {str(e)}')
+            else:
+                if response.status_code == 200:
+                    return response
+                error = ShopifySyncError(f'Shopify API error: {response.status_code}')
+                if response.status_code != 429 and response.status_code < 500:
+                    raise error
+                retry_after = response.headers.get('Retry-After')
+                if retry_after:
+                    try:
+                        time.sleep(float(retry_after))
+                        continue
+                    except ValueError:
+                        pass
+            if attempt < SHOPIFY_MAX_RETRIES:
+                time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+        raise error
+
+    def count_products(self):
+        response = self._get(f'{self.api_url}/products/count.json')
+        return response.json().get('count', 0)
+
+    def iter_pages(self, updated_at_min=None):
+        """مولّد صفحات: كل عنصر قائمة منتجات Shopify خام - صفحة واحدة في الذاكرة فقط"""
+        params = {'limit': self.page_size, 'fields': PRODUCT_FIELDS}
+        if updated_at_min:
+            params['updated_at_min'] = updated_at_min
+        url = f'{self.api_url}/products.json'
+
+        while url:
+            response = self._get(url, params)
+            try:
+                products = response.json().get('products', [])
+            except ValueError:
+                raise ShopifySyncError('Shopify returned invalid JSON')
+            if products:
+                yield products
+            # رابط الصفحة التالية يحمل page_info ولا يقبل باقي الفلاتر
+            url = response.links.get('next', {}).get('url')
+            params = None
+
+
+def upsert_products(cursor, products):
+    """إدخال أو تحديث دفعة - الصفوف غير المتغيرة لا تُلمس حتى لا يعاد فهرستها"""
+    cursor.executemany('''
+        INSERT INTO shopify_products
+            (product_id, title, description, price, category, image_url, availability, inventory_quantity)
+        VALUES (:product_id, :title, :description, :price, :category, :image_url, :availability, :inventory_quantity)
+        ON CONFLICT (product_id) DO UPDATE SET
+            title = excluded.title,
+            description = excluded.description,
+            price = excluded.price,
+            category = excluded.category,
+            image_url = excluded.image_url,
+            availability = excluded.availability,
+            inventory_quantity = excluded.inventory_quantity,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE title IS NOT excluded.title
+           OR description IS NOT excluded.description
+           OR price IS NOT excluded.price
+           OR category IS NOT excluded.category
+           OR image_url IS NOT excluded.image_url
+           OR availability IS NOT excluded.availability
+           OR inventory_quantity IS NOT excluded.inventory_quantity
+    ''', products)
+
+
+class CatalogSync:
+    """تشغيل مزامنة واحدة: صفحات -> upsert -> حفظ المؤشر عند النجاح فقط"""
+
+    def __init__(self, client, name=SYNC_NAME):
+        self.client = client
+        self.name = name
+
+    def run(self, full=False):
+        state = get_sync_state(self.name)
+        since = None if full else state['cursor']
+        stats = {'pages': 0, 'products': 0, 'full': since is None}
+
+        newest = _parse_time(since) if since else None
+        newest_raw = since
+        try:
+            for page in self.client.iter_pages(updated_at_min=since):
+                rows = [parse_product(item) for item in page]
+                with transaction() as cursor:
+                    upsert_products(cursor, rows)
+                stats['pages'] += 1
+                stats['products'] += len(rows)
+
+                for item in page:
+                    updated = _parse_time(item.get('updated_at'))
+                    if updated and (newest is None or updated > newest):
+                        newest, newest_raw = updated, item['updated_at']
+        except Exception as e:
+            # المؤشر يبقى كما هو - الصفحات المكتوبة آمنة لأن الإدخال idempotent
+            save_sync_state(self.name, 'error', stats['products'], details=str(e)[:500])
+            raise
+
+        # الصفحات مرتبة بالمعرف وليس بالتعديل، لذلك يتقدم المؤشر بعد اكتمال كل الصفحات فقط
+        save_sync_state(self.name, 'ok', stats['products'], cursor_value=newest_raw)
+        stats['cursor'] = newest_raw
+        return stats
+
+
+def get_client():
+    """عميل من الإعدادات المحفوظة (settings: shopify) أو None إذا لم يتم الربط"""
+    token = get_service_token('shopify')
+    store_url = get_service_config('shopify').get('store_url')
+    if not token or not store_url:
+        return None
+    return ShopifyClient(store_url, token)
+
+
+def sync_catalog(full=False):
+    client = get_client()
+    if client is None:
+        return None
+    stats = CatalogSync(client).run(full=full)
+    add_log('info', f"Shopify sync: {stats['products']} products in {stats['pages']} pages", 'shopify')
+    return stats
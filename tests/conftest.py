@@ -0,0 +1,97 @@
+"""
+إعداد مشترك للاختبارات: قاعدة بيانات مؤقتة لكل جلسة وبدون تشغيل العمال عند استيراد app
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix='app-tests-')
+os.environ['DATABASE_PATH'] = os.path.join(_tmp, 'test.db')
+os.environ['APP_START_WORKERS'] = '0'
+
+import pytest  # noqa: E402
+import db  # noqa: E402
+
+db.init_database()
+
+
+@pytest.fixture
+def app_module():
+    import app as app_module
+    return app_module
+
+
+@pytest.fixture
+def client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+    return client
+
+
+class StubAPI:
+    """خادم HTTP محلي وهمي: routes(method, path, query, body) -> (status, payload[, headers])"""
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self, method):
+                parts = urllib.parse.urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                body = json.loads(raw) if raw else None
+                query = urllib.parse.parse_qs(parts.query)
+                stub.requests.append((method, parts.path, query, body))
+                status, payload, *headers = stub.routes(method, parts.path, query, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_PUT(self):
+                self._handle('PUT')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_api():
+    servers = []
+
+    def start(routes):
+        servers.append(StubAPI(routes))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.close()
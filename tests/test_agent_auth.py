@@ -0,0 +1,44 @@
+import pytest
+
+from dbpool import get_connection, transaction
+
+
+@pytest.fixture
+def agent_client(app_module):
+    with transaction() as cursor:
+        cursor.executemany('INSERT OR IGNORE INTO agents (agent_id, name, password, status) VALUES (?, ?, ?, 1)',
+                           [('AGT_AUTH', 'مندوب', 'كلمة-سر'), ('AGT_OTHER', 'مندوب آخر', 'other')])
+        cursor.execute('''
+            INSERT OR IGNORE INTO orders (order_id, customer_name, status, created_at)
+            VALUES ('ORD_AUTH', 'عميل', 'new', '2024-03-02 10:00:00')
+        ''')
+    return app_module.app.test_client()
+
+
+def order_agent(order_id):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT agent_id, status FROM orders WHERE order_id = ?', (order_id,))
+    return cursor.fetchone()
+
+
+def test_agent_endpoints_require_session(agent_client):
+    response = agent_client.post('/agent/orders/accept', json={'order_id': 'ORD_AUTH', 'agent_id': 'AGT_AUTH'})
+    assert response.status_code == 302
+    assert order_agent('ORD_AUTH') == (None, 'new')
+    assert agent_client.get('/agent/events?agent_id=AGT_AUTH').status_code == 302
+
+
+def test_wrong_password_is_rejected(agent_client):
+    agent_client.post('/agent', data={'agent_id': 'AGT_AUTH', 'password': 'خطأ'})
+    with agent_client.session_transaction() as session:
+        assert 'agent_id' not in session
+
+
+def test_agent_id_comes_from_session(agent_client):
+    response = agent_client.post('/agent', data={'agent_id': 'AGT_AUTH', 'password': 'كلمة-سر'})
+    assert response.status_code == 302 and response.location.endswith('/agent/dashboard')
+
+    # معرف مندوب آخر في الجسم لا يغير شيئاً
+    response = agent_client.post('/agent/orders/accept', json={'order_id': 'ORD_AUTH', 'agent_id': 'AGT_OTHER'})
+    assert response.get_json()['status'] == 'success'
+    assert order_agent('ORD_AUTH') == ('AGT_AUTH', 'assigned')
@@ -0,0 +1,22 @@
+from arabic import normalize_arabic
+from response_cache import ResponseCache
+
+
+def test_repeated_arabic_letters_collapse():
+    assert normalize_arabic('بكاااام؟') == normalize_arabic('بِكَام') == 'بكام'
+
+
+def test_digits_are_not_collapsed():
+    assert normalize_arabic('عايز 1000 قطعة') == 'عايز 1000 قطعه'
+    assert normalize_arabic('طلب رقم ١٠٠٠٢') == 'طلب رقم 10002'
+
+
+def test_different_quantities_have_different_cache_keys():
+    cache = ResponseCache(persist=False)
+    first = dict(cache._keys('عايز 1000 قطعة بكام', 'customer', '', {}))
+    second = dict(cache._keys('عايز 10 قطعة بكام', 'customer', '', {}))
+    assert first['normalized'] != second['normalized']
+
+    cache.put('عايز 1000 قطعة بكام', 'customer', '', {}, 'سعر الألف قطعة')
+    assert cache.get('عايز 1000 قطعة بكام', 'customer', '', {}) == 'سعر الألف قطعة'
+    assert cache.get('عايز 10 قطعة بكام', 'customer', '', {}) is None
@@ -0,0 +1,26 @@
+from dbpool import transaction
+from core import get_response_manager
+from response_cache import ResponseCache
+
+
+def test_returning_customers_share_cache_key(monkeypatch):
+    with transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO conversations (user_id, page_id, first_seen, last_seen, message_count)
+            VALUES (?, 'ctx_page', ?, ?, ?)
+        ''', [('ctx_a', '2024-01-01 10:00:00', '2024-05-01 10:00:00', 3),
+              ('ctx_b', '2024-02-07 18:30:00', '2024-05-02 11:00:00', 41)])
+
+    manager = get_response_manager()
+    calls = []
+    monkeypatch.setattr(manager.ai, 'generate_response',
+                        lambda message, context, variables, context_type: calls.append((message, context)) or '')
+
+    for user_id in ('ctx_a', 'ctx_b'):
+        manager.process_message({'user_id': user_id, 'page_id': 'ctx_page', 'message': 'بكام الفستان؟',
+                                 'is_first_contact': False})
+
+    cache = ResponseCache(persist=False)
+    keys = [cache._keys(message, 'customer', context, {}) for message, context in calls]
+    assert len(keys) == 2 and keys[0] == keys[1]
+    assert 'عميل عائد' in calls[0][1]
@@ -0,0 +1,33 @@
+from datetime import date
+
+from dbpool import transaction
+from dispatch import get_dispatcher
+from reports import get_report_engine
+
+
+def test_dispatch_invalidates_report_day_and_counts_load_once(client):
+    with transaction() as cursor:
+        cursor.execute("INSERT INTO agents (agent_id, name, status) VALUES ('AGT_DISPATCH', 'مندوب', 1)")
+        cursor.execute('''
+            INSERT INTO orders (order_id, customer_name, product, quantity, status, created_at)
+            VALUES ('ORD_DISPATCH', 'عميل', 'فستان', 1, 'new', '2024-03-01 10:00:00')
+        ''')
+    dispatcher = get_dispatcher()
+    dispatcher.tracker.sync(force=True)
+    engine = get_report_engine()
+    assert engine.build('daily', date(2024, 3, 1))['orders']['new'] == 1
+
+    response = client.post('/admin/orders/dispatch', json={'strategy': 'least_loaded'})
+    assert response.get_json()['assigned'] == 1
+
+    # تقرير اليوم المخزن يُسقط بعد الإسناد، وحمل المندوب يُحتسب مرة واحدة
+    orders = engine.build('daily', date(2024, 3, 1))['orders']
+    assert orders['new'] == 0 and orders['open'] == 1
+    assert dispatcher.tracker.snapshot()[0]['AGT_DISPATCH'] == 1
+
+
+def test_dispatch_rejects_bad_limit(client):
+    for limit in ('abc', -5, 0, [3], True):
+        response = client.post('/admin/orders/dispatch', json={'limit': limit})
+        assert response.status_code == 400, limit
+    assert client.post('/admin/orders/dispatch', json={'limit': '2'}).status_code == 200
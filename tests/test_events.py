@@ -0,0 +1,46 @@
+from events import EventBroker, stream, agent_topic, EVENT_BUSY_RETRY
+
+
+def test_event_from_another_process_reaches_subscriber():
+    # عامل مستقل (مزامنة الجدول مثلاً) ينشر، وعملية الويب تستقبل من الجدول المشترك
+    worker, web = EventBroker(), EventBroker()
+    subscription = web.subscribe(agent_topic('AGT_EVT'))
+    event_id = worker.publish(agent_topic('AGT_EVT'), 'order', {'order_id': 'ORD_EVT'})
+    web.poll()
+    event = subscription.get(1)
+    assert event['id'] == event_id and event['data'] == {'order_id': 'ORD_EVT'}
+    subscription.close()
+
+
+def test_resume_from_last_event_id_in_any_process():
+    publisher = EventBroker()
+    first = publisher.publish(agent_topic('AGT_RESUME'), 'order', {'order_id': 'A'})
+    publisher.publish(agent_topic('AGT_OTHER_RESUME'), 'order', {'order_id': 'X'})
+    publisher.publish(agent_topic('AGT_RESUME'), 'order', {'order_id': 'B'})
+
+    subscription = EventBroker().subscribe(agent_topic('AGT_RESUME'), first)
+    assert subscription.get(0)['data'] == {'order_id': 'B'}
+    assert subscription.get(0) is None
+    subscription.close()
+
+    # معرف من الصيغة القديمة (داخل العملية) يطلب إعادة التحميل
+    subscription = EventBroker().subscribe(agent_topic('AGT_RESUME'), '18c2f-4')
+    assert subscription.get(0)['type'] == 'reset'
+    subscription.close()
+
+
+def test_streams_are_capped_and_recycled():
+    broker = EventBroker(max_streams=1)
+    first = stream(broker.subscribe(agent_topic('AGT_STREAM')), heartbeat=0.01, max_age=0.05)
+    assert next(first) == 'retry: 3000\n\n'
+    assert next(first).startswith('id: ')
+
+    # الخانة مشغولة - الاتصال الثاني يُطلب منه إعادة المحاولة لاحقاً ولا يحجز خيطاً
+    second = stream(broker.subscribe(agent_topic('AGT_STREAM')))
+    assert list(second) == [f'retry: {int(EVENT_BUSY_RETRY * 1000)}\n\n']
+
+    # البث الأول ينتهي بعد max_age ويحرر خانته
+    assert all(chunk == ': ping\n\n' for chunk in first)
+    third = stream(broker.subscribe(agent_topic('AGT_STREAM')), max_age=0)
+    assert list(third)[0] == 'retry: 3000\n\n'
+    assert broker.stats()['subscribers'] == 0
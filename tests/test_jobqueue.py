@@ -0,0 +1,111 @@
+import time
+import threading
+
+import pytest
+
+from dbpool import get_connection, transaction
+from jobqueue import JobQueue, QueueFull, WorkerPool
+
+
+@pytest.fixture
+def queue():
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM jobs')
+    return JobQueue(max_pending=0, max_attempts=3, backoff_base=10, backoff_max=60)
+
+
+def job_row(job_id):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT status, attempts, run_after, locked_by FROM jobs WHERE id = ?', (job_id,))
+    return cursor.fetchone()
+
+
+def test_enqueue_claim_complete(queue):
+    job_id = queue.enqueue('test_job', {'n': 1})
+    job = queue.claim('worker-a')
+    assert job['id'] == job_id and job['payload'] == {'n': 1} and job['attempts'] == 1
+    assert job_row(job_id)[0] == 'running'
+    # المهمة المحجوزة لا يأخذها عامل آخر
+    assert queue.claim('worker-b') is None
+
+    queue.complete(job_id)
+    assert job_row(job_id)[0] == 'done'
+
+
+def test_delayed_job_not_claimed_early(queue):
+    queue.enqueue('test_job', {}, delay=60)
+    assert queue.claim('worker-a') is None
+    assert 0 < queue.next_due_in(120) <= 60
+
+
+def test_retry_with_backoff_then_failed(queue):
+    job_id = queue.enqueue('test_job', {})
+    job = queue.claim('worker-a')
+    before = time.time()
+    assert queue.fail(job, 'boom') == 'pending'
+    status, attempts, run_after, locked_by = job_row(job_id)
+    # التأخير base ** attempts مع تذبذب ±20%
+    assert status == 'pending' and locked_by is None
+    assert before + 10 * 0.8 <= run_after <= time.time() + 10 * 1.2
+
+    with transaction() as cursor:
+        cursor.execute('UPDATE jobs SET run_after = 0 WHERE id = ?', (job_id,))
+    job = queue.claim('worker-a')
+    assert job['attempts'] == 2
+    queue.fail(job, 'boom')
+    status, _, run_after, _ = job_row(job_id)
+    assert run_after >= time.time() + 60 * 0.8 - 1
+
+    with transaction() as cursor:
+        cursor.execute('UPDATE jobs SET run_after = 0 WHERE id = ?', (job_id,))
+    job = queue.claim('worker-a')
+    assert queue.fail(job, 'boom') == 'failed'
+    assert job_row(job_id)[0] == 'failed'
+
+
+def test_dedup_key(queue):
+    first = queue.enqueue('test_job', {}, dedup_key='msg-1')
+    assert first is not None
+    assert queue.enqueue('test_job', {}, dedup_key='msg-1') is None
+    # المفتاح خاص بنوع المهمة
+    assert queue.enqueue('other_job', {}, dedup_key='msg-1') is not None
+    assert queue.enqueue_many('test_job', [({}, 'msg-1'), ({}, 'msg-2')]) == 1
+
+
+def test_queue_full(queue):
+    queue.max_pending = 2
+    queue.enqueue('test_job', {})
+    queue.enqueue('test_job', {})
+    with pytest.raises(QueueFull):
+        queue.enqueue('test_job', {})
+    with pytest.raises(QueueFull):
+        queue.enqueue_many('test_job', [({}, None)])
+
+
+def test_recover_stale(queue):
+    job_id = queue.enqueue('test_job', {})
+    queue.claim('worker-a')
+    assert queue.recover_stale(lease_seconds=60) == 0
+
+    with transaction() as cursor:
+        cursor.execute('UPDATE jobs SET locked_at = ? WHERE id = ?', (time.time() - 120, job_id))
+    assert queue.recover_stale(lease_seconds=60) == 1
+    assert job_row(job_id)[0] == 'pending'
+    assert queue.claim('worker-b')['attempts'] == 2
+
+
+def test_worker_pool_recovers_stale_jobs_while_running(queue):
+    done = threading.Event()
+    pool = WorkerPool(queue, {'test_job': lambda payload: done.set()}, size=1,
+                      poll_interval=0.05, recover_interval=0.05)
+    pool.start()
+    try:
+        # عامل في عملية أخرى حجز المهمة ثم توقف بعد بدء هذا العامل
+        job_id = queue.enqueue('test_job', {}, delay=3600)
+        with transaction() as cursor:
+            cursor.execute("UPDATE jobs SET status = 'running', locked_by = 'dead', locked_at = 0, run_after = 0 "
+                           "WHERE id = ?", (job_id,))
+        assert done.wait(5)
+    finally:
+        pool.stop(drain=False, timeout=5)
+    assert job_row(job_id)[0] == 'done'
@@ -0,0 +1,142 @@
+import time
+from datetime import date, datetime
+
+import pytest
+
+from dbpool import get_connection, transaction
+from db import format_timestamp, TIMESTAMP_FORMAT, list_orders, encode_cursor, decode_cursor
+
+
+@pytest.fixture
+def cairo_time(monkeypatch):
+    # توقيت محلي مختلف عن UTC حتى يظهر أي خلط بين التوقيتين
+    monkeypatch.setenv('TZ', 'Africa/Cairo')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def updated_at(order_id):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT updated_at FROM orders WHERE order_id = ?', (order_id,))
+    return datetime.strptime(cursor.fetchone()[0], TIMESTAMP_FORMAT)
+
+
+def test_updated_at_uses_local_time(cairo_time):
+    now = datetime.strptime(format_timestamp(), TIMESTAMP_FORMAT)
+    with transaction() as cursor:
+        cursor.execute("INSERT INTO orders (order_id, customer_name, status) VALUES ('ORD_LOCAL', 'عميل', 'new')")
+    assert abs((updated_at('ORD_LOCAL') - now).total_seconds()) < 60
+
+    with transaction() as cursor:
+        cursor.execute("UPDATE orders SET customer_name = 'عميل آخر' WHERE order_id = 'ORD_LOCAL'")
+    assert abs((updated_at('ORD_LOCAL') - now).total_seconds()) < 60
+
+
+@pytest.fixture
+def paged_orders():
+    """خمسة طلبات بنفس created_at لثلاثة منها - حدود الصفحات تقع داخل التعادل"""
+    rows = [
+        ('PG1', 'سارة', '0101', 'new', None, '2026-01-01 10:00:00'),
+        ('PG2', 'منى', '0102', 'assigned', 'AG_PG', '2026-01-02 10:00:00'),
+        ('PG3', 'هند', '0103', 'assigned', 'AG_PG', '2026-01-02 10:00:00'),
+        ('PG4', 'ليلى', '0104', 'delivered', 'AG_PG', '2026-01-02 10:00:00'),
+        ('PG5', 'ريم', '0105', 'new', None, '2026-01-03 10:00:00'),
+    ]
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM orders WHERE product = 'منتج_صفحات'")
+        for order_id, name, phone, status, agent, created_at in rows:
+            cursor.execute('''
+                INSERT INTO orders (order_id, customer_name, customer_phone, product, status, agent_id, created_at)
+                VALUES (?, ?, ?, 'منتج_صفحات', ?, ?, ?)
+            ''', (order_id, name, phone, status, agent, created_at))
+    return [row[0] for row in rows]
+
+
+def all_pages(limit, **filters):
+    """كل الصفحات بتتبع next_cursor"""
+    pages, cursor = [], None
+    while True:
+        page = list_orders(search='منتج_صفحات', after=cursor, limit=limit, **filters)
+        pages.append([order['order_id'] for order in page['orders']])
+        cursor = page['next_cursor']
+        if not cursor:
+            return pages
+
+
+def test_pages_split_equal_created_at_without_gaps(paged_orders):
+    pages = all_pages(2)
+    assert pages == [['PG5', 'PG4'], ['PG3', 'PG2'], ['PG1']]
+
+
+def test_oldest_sort_reverses_order(paged_orders):
+    pages = all_pages(2, sort='oldest')
+    assert pages == [['PG1', 'PG2'], ['PG3', 'PG4'], ['PG5']]
+
+
+def test_filters(paged_orders):
+    assert all_pages(10, status='assigned') == [['PG3', 'PG2']]
+    assert all_pages(10, agent_id='AG_PG') == [['PG4', 'PG3', 'PG2']]
+    assert all_pages(10, date_from=date(2026, 1, 2)) == [['PG5', 'PG4', 'PG3', 'PG2']]
+    assert all_pages(10, date_to=date(2026, 1, 2)) == [['PG4', 'PG3', 'PG2', 'PG1']]
+
+
+def test_search_covers_unloaded_pages(paged_orders):
+    assert list_orders(search='ليلى', limit=1)['orders'][0]['order_id'] == 'PG4'
+    assert list_orders(search='0101')['orders'][0]['order_id'] == 'PG1'
+    # % و _ تُطابق حرفياً وليس كأحرف بدل
+    assert list_orders(search='منتج%')['orders'] == []
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', encode_cursor(['2026-01-01']), encode_cursor({'a': 1}),
+                                   encode_cursor(['2026-01-01', 'x'])])
+def test_malformed_cursor(token, client):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+    if token:
+        response = client.get('/api/orders', query_string={'cursor': token})
+        assert response.status_code == 400
+
+
+def test_api_search_param(paged_orders, client):
+    response = client.get('/api/orders', query_string={'q': 'هند'})
+    assert [order['order_id'] for order in response.get_json()['orders']] == ['PG3']
+
+
+@pytest.fixture
+def far_east_time(monkeypatch):
+    # UTC+14 - تاريخ UTC يختلف عن التاريخ المحلي في معظم ساعات اليوم
+    monkeypatch.setenv('TZ', 'Pacific/Kiritimati')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def orders_created(day):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT orders_created FROM daily_stats WHERE day = ?', (day,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def test_created_at_default_and_daily_stats_use_local_day(far_east_time):
+    local_day = date.today().isoformat()
+    utc_day = datetime.utcnow().date().isoformat()
+    before_local, before_utc = orders_created(local_day), orders_created(utc_day)
+    with transaction() as cursor:
+        cursor.execute("INSERT INTO orders (order_id, customer_name, status) VALUES ('ORD_CLOCK', 'عميل', 'new')")
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT created_at FROM orders WHERE order_id = 'ORD_CLOCK'")
+    assert cursor.fetchone()[0][:10] == local_day
+    assert orders_created(local_day) == before_local + 1
+    if utc_day != local_day:
+        assert orders_created(utc_day) == before_utc
+
+
+def test_format_timestamp_converts_offsets_to_local(cairo_time):
+    # القاهرة UTC+2 في يناير
+    assert format_timestamp('2026-01-10T10:00:00+0000') == '2026-01-10 12:00:00'
+    assert format_timestamp('2026-01-10T10:00:00Z') == '2026-01-10 12:00:00'
+    assert format_timestamp('2026-01-10 10:00:00') == '2026-01-10 10:00:00'
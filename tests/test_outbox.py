@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+import outbox
+from dbpool import get_connection
+from db import get_service_config, save_service_config
+
+
+def outbox_rows(report_id):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT recipient, status, attempts, provider_id FROM outbox WHERE report_id = ? ORDER BY id',
+                   (report_id,))
+    return cursor.fetchall()
+
+
+@pytest.fixture
+def cloud_api(stub_api):
+    """Cloud API وهمي: الأرقام المنتهية بـ 9 ترد 429 مرة واحدة"""
+    throttled = set()
+
+    def routes(method, path, query, body):
+        recipient = body['to']
+        if recipient.endswith('9') and recipient not in throttled:
+            throttled.add(recipient)
+            return 429, {'error': {'code': 130429, 'message': 'Rate limit hit'}}, {'Retry-After': '1'}
+        return 200, {'messages': [{'id': f'wamid.{recipient}'}]}
+    return stub_api(routes)
+
+
+def make_sender(api, **kwargs):
+    client = outbox.WhatsAppClient('123', 'token', base_url=api.url, pool_size=4)
+    return outbox.OutboxSender(client, bucket=outbox.TokenBucket(1000, 1000), workers=4, **kwargs)
+
+
+def test_connect_keeps_webhook_secrets(client):
+    save_service_config('whatsapp', {'app_secret': 'secret', 'verify_token': 'token', 'phone_number_id': '42'})
+    client.post('/admin/whatsapp/connect', json={'phone_number': '201000000000', 'access_token': 'access'})
+    config = get_service_config('whatsapp')
+    assert config['app_secret'] == 'secret' and config['verify_token'] == 'token'
+    assert config['phone_number_id'] == '42' and config['report_phone'] == '201000000000'
+
+
+def test_token_bucket_limits_rate():
+    bucket = outbox.TokenBucket(rate=50, capacity=2)
+    assert bucket.acquire() == 0 and bucket.acquire() == 0
+    started = time.monotonic()
+    assert bucket.acquire() > 0
+    assert time.monotonic() - started >= 0.015
+
+    # بعد 429 ينتظر كل المرسلين مدة الإيقاف
+    bucket.pause(0.05)
+    started = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.04
+
+
+def test_drain_sends_and_retries_throttled(cloud_api):
+    report_id = outbox.queue_messages('test', 'إرسال', [('2011000001', 'أ'), ('2011000009', 'ب')])
+    stats, next_attempt = make_sender(cloud_api, daily_limit=0).drain(report_id)
+    assert stats['sent'] == 1 and stats['retry'] == 1
+    assert next_attempt >= time.time() + 0.5
+    assert outbox_rows(report_id) == [('2011000001', 'sent', 1, 'wamid.2011000001'),
+                                      ('2011000009', 'pending', 1, None)]
+    assert outbox.get_delivery_status(report_id)['status'] == 'sending'
+
+
+def test_daily_quota_defers_new_recipients(cloud_api):
+    sender = make_sender(cloud_api, daily_limit=10 ** 6)
+    sender.daily_limit = 10 ** 6 - sender._remaining_quota() + 2
+    report_id = outbox.queue_messages('test', 'حد', [(f'2012000{i:03d}', 'نص') for i in range(3)])
+    stats, _ = sender.drain(report_id)
+    assert stats['sent'] == 2 and stats['deferred'] == 1
+    assert [row[1] for row in outbox_rows(report_id)] == ['sent', 'sent', 'pending']
+
+
+def test_status_webhook_never_goes_backwards(cloud_api):
+    report_id = outbox.queue_messages('test', 'حالة', [('2013000001', 'أ'), ('2013000002', 'ب')])
+    make_sender(cloud_api, daily_limit=0).drain(report_id)
+
+    outbox.record_statuses([{'id': 'wamid.2013000001', 'status': 'read'},
+                            {'id': 'wamid.2013000001', 'status': 'delivered'},
+                            {'id': 'wamid.2013000002', 'status': 'failed', 'errors': [{'title': 'blocked'}]}])
+    assert [row[1] for row in outbox_rows(report_id)] == ['read', 'failed']
+    report = outbox.get_delivery_status(report_id)
+    assert (report['status'], report['sent'], report['failed']) == ('partial', 1, 1)
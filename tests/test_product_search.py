@@ -0,0 +1,67 @@
+import pytest
+
+from dbpool import transaction
+from product_search import ProductIndex
+
+PRODUCTS = [
+    ('P1', 'فستان أحمر', 'فساتين'),
+    ('P2', 'فستان أسود', 'فساتين'),
+    ('P3', 'قميص أبيض', 'قمصان'),
+]
+
+
+def add_product(product_id, title, category, updated_at='2026-01-01 10:00:00'):
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO shopify_products (product_id, title, description, price, category, updated_at)
+            VALUES (?, ?, '', '100', ?, ?)
+        ''', (product_id, title, category, updated_at))
+
+
+@pytest.fixture
+def index():
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM shopify_products')
+    for product in PRODUCTS:
+        # نفس updated_at للكل - حالة إعادة الفهرسة القديمة مع >=
+        add_product(*product)
+    # بدون خيط خلفية - التحديث يدوي في الاختبار
+    index = ProductIndex(refresh_interval=0)
+    assert index.refresh(force=True) == 3
+    return index
+
+
+def test_refresh_skips_unchanged_rows(index):
+    assert index.refresh(force=True) == 0
+    assert index.refresh(force=True) == 0
+
+
+def test_refresh_picks_up_updates_and_inserts(index):
+    with transaction() as cursor:
+        cursor.execute("UPDATE shopify_products SET title = 'فستان كحلي', updated_at = '2026-01-02 10:00:00' "
+                       "WHERE product_id = 'P2'")
+    add_product('P4', 'بنطلون جينز', 'بناطيل', '2026-01-02 10:00:00')
+    assert index.refresh(force=True) == 2
+    assert index.refresh(force=True) == 0
+    assert [p['product_id'] for p in index.search('كحلي')] == ['P2']
+    assert [p['product_id'] for p in index.search('جينز')] == ['P4']
+
+
+def test_refresh_drops_deleted_products(index):
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM shopify_products WHERE product_id = 'P3'")
+    index.refresh(force=True)
+    assert index.search('قميص') == []
+
+
+def test_impacts_follow_corpus_stats(index):
+    before = index.search('فستان')[0]['score']
+    # منتج لا يحتوي "فستان" يغير IDF وطول المتوسط دون أن يمس قائمة الكلمة
+    add_product('P5', 'حذاء رياضي جلد طبيعي مقاس كبير', 'أحذية', '2026-01-03 10:00:00')
+    index.refresh(force=True)
+    after = index.search('فستان')[0]['score']
+
+    fresh = ProductIndex(refresh_interval=0)
+    fresh.refresh(force=True)
+    assert after == fresh.search('فستان')[0]['score']
+    assert after != before
@@ -0,0 +1,107 @@
+import time
+import asyncio
+
+import pytest
+
+from core import ProviderChain, ProviderError, OpenAIProvider, DeepSeekProvider
+
+
+def completion(text):
+    return {'choices': [{'message': {'content': text}}]}
+
+
+def api(stub_api, reply=None, status=200, delay=0):
+    """مزود chat/completions وهمي - delay لمحاكاة البطء"""
+    def routes(method, path, query, body):
+        if delay:
+            time.sleep(delay)
+        return status, completion(reply) if status == 200 else {'error': 'down'}
+    return stub_api(routes)
+
+
+def provider(provider_class, server, read_timeout=5):
+    return provider_class('test-key', base_url=server.url, connect_timeout=1, read_timeout=read_timeout)
+
+
+def test_falls_back_on_error(stub_api):
+    primary = api(stub_api, status=500)
+    backup = api(stub_api, 'رد البديل')
+    chain = ProviderChain([provider(OpenAIProvider, primary), provider(DeepSeekProvider, backup)], hedge_delay=0)
+
+    assert chain.generate('سلام', '', {}) == 'رد البديل'
+    assert chain.providers[0].breaker.failures == 1
+    assert chain.providers[1].breaker.failures == 0
+
+
+def test_hedges_to_next_provider(stub_api):
+    slow = api(stub_api, 'رد بطيء', delay=1)
+    fast = api(stub_api, 'رد سريع')
+    chain = ProviderChain([provider(OpenAIProvider, slow), provider(DeepSeekProvider, fast)], hedge_delay=0.1)
+
+    started = time.monotonic()
+    assert chain.generate('سلام', '', {}) == 'رد سريع'
+    assert time.monotonic() - started < 0.8
+    # الطلب الموازي ذهب للمزود التالي وليس لنفس المزود البطيء
+    assert len(slow.requests) == 1
+    assert len(fast.requests) == 1
+
+
+def test_no_hedge_when_primary_is_fast(stub_api):
+    primary = api(stub_api, 'رد أساسي')
+    backup = api(stub_api, 'رد البديل')
+    chain = ProviderChain([provider(OpenAIProvider, primary), provider(DeepSeekProvider, backup)], hedge_delay=0.5)
+    assert chain.generate('سلام', '', {}) == 'رد أساسي'
+    assert backup.requests == []
+
+
+def test_circuit_breaker_open_and_half_open(stub_api):
+    state = {'status': 500}
+    primary = stub_api(lambda *args: (state['status'], completion('رد أساسي')))
+    backup = api(stub_api, 'رد البديل')
+    chain = ProviderChain([provider(OpenAIProvider, primary), provider(DeepSeekProvider, backup)], hedge_delay=0)
+    breaker = chain.providers[0].breaker
+    breaker.reset_timeout = 0.2
+
+    for _ in range(breaker.failure_threshold):
+        assert chain.generate('سلام', '', {}) == 'رد البديل'
+    assert breaker.state == 'open'
+
+    # القاطع مفتوح - المزود لا يُستدعى أصلاً
+    calls = len(primary.requests)
+    assert chain.generate('سلام', '', {}) == 'رد البديل'
+    assert len(primary.requests) == calls
+
+    time.sleep(0.25)
+    assert breaker.state == 'half_open'
+    state['status'] = 200
+    assert chain.generate('سلام', '', {}) == 'رد أساسي'
+    assert len(primary.requests) == calls + 1
+    assert breaker.state == 'closed'
+
+
+def test_overall_deadline(stub_api):
+    slow = api(stub_api, 'متأخر', delay=1)
+    slower = api(stub_api, 'متأخر', delay=1)
+    chain = ProviderChain([provider(OpenAIProvider, slow), provider(DeepSeekProvider, slower)],
+                          hedge_delay=0.1, deadline=0.3)
+
+    started = time.monotonic()
+    with pytest.raises(ProviderError, match='timed out'):
+        chain.generate('سلام', '', {})
+    assert time.monotonic() - started < 0.6
+    assert chain.providers[0].breaker.failures == 1
+
+
+def test_read_timeout_moves_to_next_provider(stub_api):
+    stuck = api(stub_api, 'متأخر', delay=1)
+    backup = api(stub_api, 'رد البديل')
+    chain = ProviderChain([provider(OpenAIProvider, stuck, read_timeout=0.2), provider(DeepSeekProvider, backup)],
+                          hedge_delay=0)
+    assert chain.generate('سلام', '', {}) == 'رد البديل'
+
+
+def test_async_generate(stub_api):
+    slow = api(stub_api, 'رد بطيء', delay=1)
+    fast = api(stub_api, 'رد سريع')
+    chain = ProviderChain([provider(OpenAIProvider, slow), provider(DeepSeekProvider, fast)], hedge_delay=0.1)
+    assert asyncio.run(chain.agenerate('سلام', '', {})) == 'رد سريع'
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from dbpool import get_connection, transaction
+from ratelimit import RateLimiter, parse_quota, event_keys, purge_rate_limits
+
+LIMITS = {'user': '2/60', 'page': '3/60', 'ip': '0'}
+NOW = 1_700_000_000.0 - 1_700_000_000.0 % 60  # بداية نافذة
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def limiter(request):
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM rate_limits')
+    return RateLimiter(LIMITS, backend=request.param)
+
+
+def test_parse_quota():
+    assert parse_quota('5/60') == (5, 60.0)
+    assert parse_quota('10') == (10, 60.0)
+    assert parse_quota('0') is None and parse_quota('') is None and parse_quota('-1/5') is None
+
+
+def test_user_limit_then_retry_after(limiter):
+    keys = event_keys({'page_id': 'p1', 'user_id': 'u1'})
+    results = limiter.allow_many([keys, keys, keys], now=NOW + 10)
+    assert [allowed for allowed, _, _ in results] == [True, True, False]
+    allowed, scope, retry_after = results[2]
+    assert scope == 'user'
+    # النافذة الحالية ممتلئة - الانتظار حتى بدايتها التالية
+    assert retry_after == pytest.approx(50)
+
+
+def test_page_limit_covers_all_users(limiter):
+    requests = [event_keys({'page_id': 'p2', 'user_id': f'u{i}'}) for i in range(4)]
+    results = limiter.allow_many(requests, now=NOW + 1)
+    assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+    assert results[3][1] == 'page'
+    # طلب مرفوض لا يُحتسب على مفاتيحه
+    assert limiter.allow_many([event_keys({'page_id': 'p3', 'user_id': 'u3'})], now=NOW + 1)[0][0]
+
+
+def test_unlimited_scope_and_anonymous_user_are_ignored(limiter):
+    assert all(limiter.allow_many([[('ip', '1.2.3.4')]] * 50, now=NOW)[i][0] for i in range(50))
+    results = limiter.allow_many([event_keys({'page_id': 'p4'})] * 4, now=NOW)
+    assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+
+
+def test_sliding_window_weights_previous_window(limiter):
+    keys = [('user', 'p5:u5')]
+    assert all(allowed for allowed, _, _ in limiter.allow_many([keys, keys], now=NOW + 59))
+    # بعد 15 ثانية من النافذة التالية ما زال 75% من السابقة محسوباً: 2 * 0.75 + 1 > 2
+    allowed, scope, retry_after = limiter.allow_many([keys], now=NOW + 60 + 15)[0]
+    assert not allowed and scope == 'user'
+    assert retry_after == pytest.approx(15)
+    assert limiter.allow_many([keys], now=NOW + 60 + 30)[0][0]
+
+
+def test_counters_and_status(limiter):
+    keys = event_keys({'page_id': 'p6', 'user_id': 'u6'})
+    limiter.allow_many([keys] * 3, now=time.time())
+    status = limiter.status()
+    assert status['backend'] == limiter.store.name
+    assert status['counters']['user'] == {'allowed': 2, 'throttled': 1}
+    assert status['quotas'] == {'user': {'limit': 2, 'period': 60.0}, 'page': {'limit': 3, 'period': 60.0}}
+
+
+def test_allow_single_request(limiter):
+    assert limiter.allow(('user', 'p7:u7'), ('page', 'p7')) == (True, None, 0.0)
+    limiter.allow(('user', 'p7:u7'))
+    allowed, scope, retry_after = limiter.allow(('user', 'p7:u7'), ('page', 'p7'))
+    assert not allowed and scope == 'user' and retry_after > 0
+
+
+def test_purge_rate_limits_removes_expired_windows():
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM rate_limits')
+    limiter = RateLimiter(LIMITS, backend='sqlite')
+    limiter.allow_many([[('user', 'old')]], now=time.time() - 3600)
+    limiter.allow_many([[('user', 'fresh')]], now=time.time())
+    assert purge_rate_limits() == 1
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT key FROM rate_limits')
+    assert [row[0] for row in cursor.fetchall()] == ['fresh']
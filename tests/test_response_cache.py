@@ -0,0 +1,48 @@
+from dbpool import get_connection
+from response_cache import ResponseCache
+
+
+def cached(cache, response, name):
+    cache.clear()
+    cache.put('عندكم توصيل؟', 'customer', '', {'name': name}, response)
+    return cache.get('عندكم توصيل؟', 'customer', '', {'name': 'غيره'})
+
+
+def test_name_replaced_as_whole_word():
+    cache = ResponseCache(persist=False)
+    assert cached(cache, 'أهلاً محمد، التوصيل متاح', 'محمد') == 'أهلاً {name}، التوصيل متاح'
+
+
+def test_name_inside_other_words_untouched():
+    cache = ResponseCache(persist=False)
+    assert cached(cache, 'أهلاً يا نور', 'نور') == 'أهلاً يا {name}'
+    # الكلمة لا تتحول إلى "م{name}" - والرد لا يُخزن لأن الاسم بقي فيه
+    assert cached(cache, 'نورتنا، المكان منور', 'نور') is None
+    assert cached(cache, 'على الأمل نلقاك', 'أمل') is None
+
+
+def test_name_attached_to_prefix_not_cached():
+    # "لمحمد" لا يمكن تحويلها لقالب بأمان - التخزين كان سيرسل اسم العميل لغيره
+    cache = ResponseCache(persist=False)
+    assert cached(cache, 'الطلب لمحمد في الطريق', 'محمد') is None
+
+
+def hits(cache_key):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT hits FROM response_cache WHERE cache_key = ?', (cache_key,))
+    return cursor.fetchone()[0]
+
+
+def test_db_hits_are_batched():
+    writer = ResponseCache()
+    writer.clear()
+    writer.put('سعر الشحن كام', 'customer', '', {}, 'الشحن 50 جنيه')
+    key = writer._keys('سعر الشحن كام', 'customer', '', {})[0][1]
+
+    reader = ResponseCache()
+    assert reader.get('سعر الشحن كام', 'customer') == 'الشحن 50 جنيه'
+    assert reader.stats()['contexts']['customer']['db_hits'] == 1
+    # القراءة لا تفتح معاملة كتابة - التحديث ينتظر الدفعة
+    assert hits(key) == 0
+    reader.flush()
+    assert hits(key) == 1
@@ -0,0 +1,126 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from dbpool import get_connection, transaction
+from jobqueue import JobQueue
+from scheduler import Schedule, Scheduler
+
+
+@pytest.fixture(autouse=True)
+def clean_tables():
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM scheduled_jobs')
+        cursor.execute('DELETE FROM scheduler_lock')
+        cursor.execute('DELETE FROM jobs')
+
+
+def stored(name):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT next_run_at, last_status, runs FROM scheduled_jobs WHERE name = ?', (name,))
+    return cursor.fetchone()
+
+
+def set_next_run(name, next_run):
+    with transaction() as cursor:
+        cursor.execute('UPDATE scheduled_jobs SET next_run_at = ? WHERE name = ?', (next_run, name))
+
+
+def queued_payloads(job_type):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT payload FROM jobs WHERE job_type = ?', (job_type,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def test_last_due_interval_and_daily():
+    schedule = Schedule('every 60')
+    assert schedule.last_due(600, 785) == 780
+    # موعد فائت بعد آخر حد - يبقى كما هو
+    assert schedule.last_due(790, 795) == 790
+
+    daily = Schedule('09:00')
+    first = datetime(2026, 3, 1, 9, 0).timestamp()
+    now = datetime(2026, 3, 4, 12, 0).timestamp()
+    assert daily.last_due(first, now) == datetime(2026, 3, 4, 9, 0).timestamp()
+
+
+def test_new_job_is_scheduled_not_run():
+    scheduler = Scheduler(JobQueue(max_pending=0))
+    scheduler.add('sched_new', 'every 3600')
+    assert scheduler.tick() == 0
+    next_run, status, runs = stored('sched_new')
+    assert next_run > time.time() and status is None and runs == 0
+
+
+def test_catch_up_merges_missed_runs():
+    scheduler = Scheduler(JobQueue(max_pending=0))
+    scheduler.add('sched_catch', 'every 60')
+    scheduler.tick()
+    set_next_run('sched_catch', time.time() - 3600)
+
+    assert scheduler.tick() == 1
+    assert len(queued_payloads('sched_catch')) == 1
+    next_run, status, runs = stored('sched_catch')
+    assert next_run > time.time() and status == 'queued' and runs == 1
+
+
+def daily_at(seconds_ago):
+    """موعد يومي فات منذ seconds_ago تقريباً: (spec, timestamp)"""
+    moment = datetime.fromtimestamp(time.time() - seconds_ago).replace(second=0, microsecond=0)
+    return moment.strftime('%H:%M'), moment.timestamp()
+
+
+def test_misfire_grace_skips_stale_runs():
+    scheduler = Scheduler(JobQueue(max_pending=0), misfire_grace=600)
+    late_spec, late_at = daily_at(2 * 3600)
+    recent_spec, recent_at = daily_at(120)
+    scheduler.add('sched_late', late_spec, catch_up=False)
+    scheduler.add('sched_recent', recent_spec, catch_up=False)
+    scheduler.tick()
+    set_next_run('sched_late', late_at)
+    set_next_run('sched_recent', recent_at)
+
+    assert scheduler.tick() == 1
+    assert queued_payloads('sched_late') == []
+    assert len(queued_payloads('sched_recent')) == 1
+    assert stored('sched_late')[1:] == ('skipped', 0)
+    assert stored('sched_late')[0] > time.time()
+
+
+def test_failed_enqueue_keeps_run_due():
+    queue = JobQueue(max_pending=1)
+    queue.enqueue('sched_filler', {})
+    scheduler = Scheduler(queue)
+    scheduler.add('sched_full', 'every 60')
+    scheduler.tick()
+    missed = time.time() - 120
+    set_next_run('sched_full', missed)
+
+    assert scheduler.tick() == 0
+    assert stored('sched_full') == (missed, 'failed', 0)
+
+    # بعد تفريغ الطابور يُشغل الموعد نفسه في الدورة التالية
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM jobs WHERE job_type = 'sched_filler'")
+    assert scheduler.tick() == 1
+    assert stored('sched_full')[1:] == ('queued', 1)
+
+
+def test_lease_takeover():
+    leader = Scheduler(JobQueue(max_pending=0), lease=60)
+    follower = Scheduler(JobQueue(max_pending=0), lease=60)
+    follower.owner = 'other-host:1'
+    leader.add('sched_lease', 'every 3600')
+    follower.add('sched_lease', 'every 3600')
+
+    assert leader.tick() == 0
+    assert follower.tick() is None
+    assert leader.status()['is_leader'] and not follower.status()['is_leader']
+
+    # القائد توقف دون تحرير القفل - بعد انتهاء المدة يأخذه غيره
+    with transaction() as cursor:
+        cursor.execute("UPDATE scheduler_lock SET expires_at = ? WHERE name = 'scheduler'", (time.time() - 1,))
+    assert follower.tick() == 0
+    assert follower.status()['is_leader']
+    assert leader.tick() is None
@@ -0,0 +1,132 @@
+import re
+
+import pytest
+
+from dbpool import get_connection, transaction
+from db import get_service_config
+from sheets_sync import SheetsClient, OrderSheetSync, SHEET_COLUMNS
+
+RANGE_RE = re.compile(r"^'?[^'!]+'?!A(\d+):[A-Z]+(\d+)$")
+
+
+def test_config_saved_when_queue_is_full(client, app_module, monkeypatch):
+    queue = app_module.job_queue
+    queue.enqueue('test_filler', {}, dedup_key='sheets')
+    monkeypatch.setattr(queue, 'max_pending', queue.pending_count())
+    try:
+        response = client.post('/api/googlesheet/config', json={
+            'orders_sheet': 'https://docs.google.com/spreadsheets/d/sheet_full_queue/edit'
+        })
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'error'
+        assert get_service_config('googlesheet')['orders_sheet'] == 'sheet_full_queue'
+    finally:
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM jobs WHERE job_type = 'test_filler'")
+
+
+@pytest.fixture
+def sheet(stub_api):
+    """values API وهمي: الجدول في grid (رقم الصف -> القيم)"""
+    grid = {}
+
+    def routes(method, path, query, body):
+        if method == 'GET' and path.endswith(':batchGet'):
+            ranges = []
+            for a1 in query.get('ranges', []):
+                first, last = map(int, RANGE_RE.match(a1).groups())
+                rows = [grid.get(n, []) for n in range(first, last + 1)]
+                while rows and not any(rows[-1]):
+                    rows.pop()
+                ranges.append({'range': a1, 'values': rows})
+            return 200, {'valueRanges': ranges}
+        if method == 'POST' and path.endswith(':batchUpdate'):
+            cells = 0
+            for item in body['data']:
+                first = int(RANGE_RE.match(item['range']).group(1))
+                for offset, values in enumerate(item['values']):
+                    grid[first + offset] = [str(value) for value in values]
+                    cells += len(values)
+            return 200, {'totalUpdatedCells': cells}
+        return 404, {}
+
+    server = stub_api(routes)
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM orders')
+        cursor.execute('DELETE FROM sheet_rows')
+        cursor.execute("DELETE FROM sync_state WHERE name = 'sheets_test'")
+        for index in range(1, 4):
+            cursor.execute('''
+                INSERT INTO orders (order_id, customer_name, product, quantity, status, created_at, updated_at)
+                VALUES (?, ?, 'فستان', 1, 'new', '2026-01-01 10:00:00', '2026-01-01 10:00:00')
+            ''', (f'SH{index}', f'عميل {index}'))
+    client = SheetsClient('sheet_test', 'token', base_url=server.url, requests_per_minute=6000)
+    sync = OrderSheetSync(client, name='sheets_test')
+    sync.grid = grid
+    sync.server = server
+    return sync
+
+
+def column(name):
+    return SHEET_COLUMNS.index(name)
+
+
+def order_status(order_id):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT status FROM orders WHERE order_id = ?', (order_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def test_initial_export_then_nothing_to_write(sheet):
+    stats, changes = sheet.run()
+    assert stats['written_rows'] == 3
+    assert sheet.grid[1] == list(SHEET_COLUMNS)
+    assert [sheet.grid[n][0] for n in (2, 3, 4)] == ['SH1', 'SH2', 'SH3']
+
+    # بدون تغييرات: قراءة واحدة ولا كتابة - hash كل صف يطابق المحفوظ
+    stats, changes = sheet.run()
+    assert stats['written_rows'] == 0 and stats['imported'] == 0 and changes == []
+    assert [request[0] for request in sheet.server.requests[-stats['requests']:]] == ['GET']
+
+
+def test_db_change_rewrites_only_that_row(sheet):
+    sheet.run()
+    with transaction() as cursor:
+        cursor.execute("UPDATE orders SET status = 'assigned', agent_id = 'AG1' WHERE order_id = 'SH2'")
+    stats, changes = sheet.run()
+    assert stats['written_rows'] == 1
+    assert stats['written_cells'] == len(SHEET_COLUMNS)
+    assert sheet.grid[3][column('status')] == 'assigned'
+
+
+def test_sheet_edit_imported(sheet):
+    sheet.run()
+    sheet.grid[4][column('status')] = 'completed'
+    stats, changes = sheet.run()
+    assert stats['imported'] == 1
+    assert order_status('SH3') == 'completed'
+    assert [(before['status'], after['status']) for before, after in changes] == [('new', 'completed')]
+    # القيمة في الجدول مطابقة بالفعل - لا إعادة كتابة للصف
+    assert stats['written_rows'] == 0
+
+
+def test_sheet_row_added_and_invalid_rejected(sheet):
+    sheet.run()
+    sheet.grid[5] = ['SH_NEW', 'عميل جديد', '', 'قميص', '2', 'new', '', '', '', '']
+    sheet.grid[6] = ['SH_BAD', 'عميل', '', 'قميص', 'اثنين', 'new', '', '', '', '']
+    stats, changes = sheet.run()
+    assert stats['created'] == 1 and stats['invalid'] == 1
+    assert order_status('SH_NEW') == 'new'
+    assert order_status('SH_BAD') is None
+
+
+def test_conflict_database_wins(sheet):
+    sheet.run()
+    sheet.grid[2][column('status')] = 'cancelled'
+    with transaction() as cursor:
+        cursor.execute("UPDATE orders SET status = 'in_progress' WHERE order_id = 'SH1'")
+    stats, changes = sheet.run()
+    assert stats['conflicts'] == 1
+    assert order_status('SH1') == 'in_progress'
+    assert sheet.grid[2][column('status')] == 'in_progress'
@@ -0,0 +1,105 @@
+import urllib.parse
+
+import pytest
+
+from dbpool import get_connection, transaction
+from db import get_sync_state
+from shopify_sync import ShopifyClient, CatalogSync, ShopifySyncError
+
+
+def product(product_id, title, updated_at):
+    return {'id': product_id, 'title': title, 'body_html': '<p>وصف</p>', 'product_type': 'فساتين',
+            'status': 'active', 'variants': [{'price': '100', 'inventory_quantity': 3}],
+            'image': None, 'updated_at': updated_at}
+
+
+@pytest.fixture
+def store(stub_api):
+    """Shopify وهمي: صفحات بـ Link / page_info وفلترة updated_at_min مثل الـ API الحقيقي"""
+    catalog = {
+        product_id: product(product_id, f'منتج {product_id}', f'2026-01-0{product_id}T10:00:00+00:00')
+        for product_id in range(1, 6)
+    }
+    state = {'fail_page': None}
+
+    def routes(method, path, query, body):
+        if not path.endswith('/products.json'):
+            return 404, {}
+        if 'page_info' in query:
+            # Shopify يرفض باقي الفلاتر مع page_info
+            assert 'updated_at_min' not in query
+            since, offset = query['page_info'][0].split('|')
+            offset = int(offset)
+        else:
+            since, offset = query.get('updated_at_min', [''])[0], 0
+        if state['fail_page'] == offset:
+            return 404, {'errors': 'Not Found'}
+        limit = int(query['limit'][0])
+        items = [item for _, item in sorted(catalog.items()) if item['updated_at'] >= since]
+        page = items[offset:offset + limit]
+        headers = {}
+        if offset + limit < len(items):
+            page_info = urllib.parse.quote(f'{since}|{offset + limit}')
+            headers['Link'] = f'<{server.url}{path}?limit={limit}&page_info={page_info}>; rel="next"'
+        return 200, {'products': page}, headers
+
+    server = stub_api(routes)
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM shopify_products')
+        cursor.execute("DELETE FROM sync_state WHERE name = 'shopify_test'")
+    client = ShopifyClient('test-store.myshopify.com', 'token', base_url=server.url, page_size=2)
+    server.catalog = catalog
+    server.state = state
+    server.sync = CatalogSync(client, name='shopify_test')
+    return server
+
+
+def titles():
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT product_id, title FROM shopify_products ORDER BY CAST(product_id AS INTEGER)')
+    return dict(cursor.fetchall())
+
+
+def test_full_sync_follows_pages(store):
+    stats = store.sync.run()
+    assert stats['pages'] == 3 and stats['products'] == 5 and stats['full']
+    assert stats['cursor'] == '2026-01-05T10:00:00+00:00'
+    assert len(titles()) == 5
+    first = store.requests[0][2]
+    assert first['limit'] == ['2'] and 'updated_at_min' not in first
+    assert all('page_info' in request[2] for request in store.requests[1:])
+
+
+def test_incremental_sync_uses_updated_since(store):
+    store.sync.run()
+    store.requests.clear()
+    store.catalog[2] = product(2, 'منتج معدل', '2026-01-07T10:00:00+00:00')
+    store.catalog[6] = product(6, 'منتج جديد', '2026-01-08T10:00:00+00:00')
+
+    stats = store.sync.run()
+    assert not stats['full']
+    assert store.requests[0][2]['updated_at_min'] == ['2026-01-05T10:00:00+00:00']
+    # المنتج 5 يعاد (>= المؤشر) لكنه لا يتغير في الجدول
+    assert stats['products'] == 3 and stats['pages'] == 2
+    assert stats['cursor'] == '2026-01-08T10:00:00+00:00'
+    assert titles()['2'] == 'منتج معدل' and titles()['6'] == 'منتج جديد'
+
+
+def test_failed_page_keeps_cursor(store):
+    store.sync.run()
+    store.catalog[1] = product(1, 'تعديل لن يكتمل', '2026-01-09T10:00:00+00:00')
+    store.catalog[3] = product(3, 'تعديل لن يكتمل', '2026-01-09T11:00:00+00:00')
+    store.catalog[4] = product(4, 'تعديل لن يكتمل', '2026-01-09T12:00:00+00:00')
+    store.state['fail_page'] = 2
+
+    with pytest.raises(ShopifySyncError):
+        store.sync.run()
+    state = get_sync_state('shopify_test')
+    assert state['cursor'] == '2026-01-05T10:00:00+00:00'
+    assert state['last_status'] == 'error'
+
+    # المزامنة التالية تبدأ من نفس المؤشر فلا يضيع المنتج الذي لم يُقرأ
+    store.state['fail_page'] = None
+    stats = store.sync.run()
+    assert stats['cursor'] == '2026-01-09T12:00:00+00:00'
+    assert titles()['4'] == 'تعديل لن يكتمل'
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from webhook_auth import sign, verify_signature
+
+
+@pytest.fixture
+def secured(client, app_module):
+    """App Secret و Verify Token عربي محفوظان من لوحة التحكم"""
+    response = client.post('/admin/facebook/webhook', json={'app_secret': 'سر-التطبيق', 'verify_token': 'رمز'})
+    assert response.status_code == 200
+    return 'سر-التطبيق'.encode()
+
+
+def test_verify_signature_handles_non_ascii_header():
+    assert verify_signature(b'secret', b'{}', 'sha256=é') is False
+    assert verify_signature(b'secret', b'{}', sign(b'secret', b'{}')) is True
+
+
+def test_non_ascii_verify_token_is_rejected_with_403(client, secured):
+    response = client.get('/webhook/facebook', query_string={'hub.verify_token': 'ا', 'hub.challenge': '1'})
+    assert response.status_code == 403
+
+
+def test_arabic_verify_token_is_accepted(client, secured):
+    response = client.get('/webhook/facebook', query_string={'hub.verify_token': 'رمز', 'hub.challenge': '42'})
+    assert response.status_code == 200
+    assert response.data == b'42'
+
+
+def test_non_ascii_signature_is_rejected_with_403(client, secured):
+    body = json.dumps({'object': 'page', 'entry': []}).encode()
+    response = client.post('/webhook/facebook', data=body, content_type='application/json',
+                           headers={'X-Hub-Signature-256': 'sha256=é'})
+    assert response.status_code == 403
+
+
+def test_valid_signature_is_accepted(client, secured):
+    body = json.dumps({'object': 'page', 'entry': []}).encode()
+    response = client.post('/webhook/facebook', data=body, content_type='application/json',
+                           headers={'X-Hub-Signature-256': sign(secured, body)})
+    assert response.status_code == 200
@@ -0,0 +1,79 @@
+import json
+import time
+
+from dbpool import get_connection, transaction
+from db import update_service_status
+from webhook_auth import get_webhook_guard, sign
+
+
+def post_webhook(client, payload):
+    body = json.dumps(payload).encode()
+    headers = {}
+    secret = get_webhook_guard().secrets.get('facebook')[0]
+    if secret:
+        headers['X-Hub-Signature-256'] = sign(secret, body)
+    return client.post('/webhook/facebook', data=body, content_type='application/json', headers=headers)
+
+
+def dm_payload(message_id, user_id='dm_user', page_id='dm_page'):
+    return {'object': 'page', 'entry': [{'id': page_id, 'time': int(time.time()), 'messaging': [{
+        'sender': {'id': user_id}, 'recipient': {'id': page_id}, 'timestamp': int(time.time() * 1000),
+        'message': {'mid': message_id, 'text': 'بكام الفستان ده؟'}
+    }]}]}
+
+
+def inbox_status(message_id):
+    cursor = get_connection().cursor()
+    cursor.execute('SELECT status FROM inbox WHERE message_id = ?', (message_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def queued_messages(message_id):
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT payload FROM jobs WHERE job_type = 'facebook_message'")
+    return [json.loads(row[0]) for row in cursor.fetchall() if json.loads(row[0])['message_id'] == message_id]
+
+
+def test_dm_is_answered_after_queue_full(client, app_module, monkeypatch):
+    update_service_status('facebook', True)
+    queue = app_module.job_queue
+    queue.enqueue('test_filler', {})
+    monkeypatch.setattr(queue, 'max_pending', queue.pending_count())
+    try:
+        # الطابور ممتلئ: الرسالة تُحفظ لكن فيسبوك يُطلب منه إعادة الإرسال
+        response = post_webhook(client, dm_payload('m_queue_full'))
+        assert response.status_code == 503
+        assert inbox_status('m_queue_full') == 'pending'
+        assert queued_messages('m_queue_full') == []
+
+        # إعادة الإرسال بعد تفريغ الطابور تضيف مهمة الرد للرسالة المحفوظة
+        monkeypatch.setattr(queue, 'max_pending', 0)
+        response = post_webhook(client, dm_payload('m_queue_full'))
+        assert response.status_code == 200
+        jobs = queued_messages('m_queue_full')
+        assert len(jobs) == 1
+        assert jobs[0]['is_first_contact'] is True
+
+        # إعادة إرسال ثالثة لا تكرر المهمة
+        post_webhook(client, dm_payload('m_queue_full'))
+        assert len(queued_messages('m_queue_full')) == 1
+
+        app_module.process_message_reply(jobs[0])
+        assert inbox_status('m_queue_full') == 'replied'
+    finally:
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM jobs WHERE job_type IN ('test_filler', 'facebook_message')")
+
+
+def test_replied_message_is_not_queued_again(client, app_module):
+    update_service_status('facebook', True)
+    post_webhook(client, dm_payload('m_replied', user_id='other_user'))
+    jobs = queued_messages('m_replied')
+    assert len(jobs) == 1
+    app_module.process_message_reply(jobs[0])
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM jobs WHERE job_type = 'facebook_message'")
+
+    post_webhook(client, dm_payload('m_replied', user_id='other_user'))
+    assert queued_messages('m_replied') == []
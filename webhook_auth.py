@@ -0,0 +1,177 @@
+"""
+التحقق من Webhooks فيسبوك وواتساب قبل أي عمل على قاعدة البيانات أو الذكاء الاصطناعي
+التوقيع X-Hub-Signature-256 يُحسب على جسم الطلب الخام كما وصل (بدون إعادة تسلسل)
+ثم يُحلل JSON مرة واحدة فقط (orjson إن وجد)
+"""
+
+import os
+import hmac
+import json
+import time
+import hashlib
+import threading
+from db import add_log, get_service_config, get_settings_version
+
+try:
+    import orjson
+    loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    loads = json.loads
+    JSONDecodeError = ValueError
+
+# حمولات فيسبوك صغيرة - أي جسم أكبر يُرفض قبل قراءته
+WEBHOOK_MAX_BODY = int(os.environ.get('WEBHOOK_MAX_BODY', 1024 * 1024))
+# أقصى مدة قبل ملاحظة تغيير App Secret / Verify Token من لوحة التحكم
+WEBHOOK_SETTINGS_CHECK = float(os.environ.get('WEBHOOK_SETTINGS_CHECK', 5))
+# بدون App Secret محفوظ: القبول مع تحذير (0) أو الرفض (1)
+WEBHOOK_REQUIRE_SIGNATURE = os.environ.get('WEBHOOK_REQUIRE_SIGNATURE', '0') == '1'
+# تسجيل الطلبات المرفوضة مجمّعة حتى لا يتحول الهجوم إلى سيل كتابة في السجلات
+REJECT_LOG_INTERVAL = 60
+
+SIGNATURE_PREFIX = 'sha256='
+
+
+class WebhookRejected(Exception):
+    """طلب مرفوض - status هو رمز HTTP المناسب"""
+
+    def __init__(self, status, reason):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+def sign(secret, body):
+    """قيمة X-Hub-Signature-256 لجسم طلب (للاختبار والقياس)"""
+    return SIGNATURE_PREFIX + hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, body, header):
+    """مقارنة بزمن ثابت بين التوقيع المرسل و HMAC-SHA256 للجسم الخام"""
+    if not header or not header.startswith(SIGNATURE_PREFIX):
+        return False
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest().encode()
+    # compare_digest يرفض النصوص غير ASCII - المقارنة كـ bytes
+    return hmac.compare_digest(expected, header[len(SIGNATURE_PREFIX):].encode('utf-8', 'replace'))
+
+
+class WebhookSecrets:
+    """App Secret و Verify Token لكل خدمة - تُقرأ مرة واحدة ويعاد تحميلها فقط عند تغيير الإعدادات"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self._secrets = {}
+
+    def _load(self):
+        # واتساب يرسل بنفس تطبيق Meta - يكفي حفظ المفتاح في إعدادات فيسبوك
+        facebook = get_service_config('facebook')
+        whatsapp = get_service_config('whatsapp')
+        app_secret = facebook.get('app_secret') or os.environ.get('FACEBOOK_APP_SECRET') or ''
+        verify_token = facebook.get('verify_token') or os.environ.get('WEBHOOK_VERIFY_TOKEN') or ''
+        return {
+            'facebook': (app_secret.encode(), verify_token),
+            'whatsapp': ((whatsapp.get('app_secret') or app_secret).encode(),
+                         whatsapp.get('verify_token') or verify_token),
+        }
+
+    def get(self, service):
+        """(app_secret كـ bytes, verify_token) - فحص إصدار الإعدادات مرة كل بضع ثوانٍ على الأكثر"""
+        now = time.monotonic()
+        if now - self._checked_at >= WEBHOOK_SETTINGS_CHECK:
+            with self._lock:
+                if now - self._checked_at >= WEBHOOK_SETTINGS_CHECK:
+                    version = get_settings_version()
+                    if version != self._version:
+                        self._secrets = self._load()
+                        self._version = version
+                    self._checked_at = now
+        return self._secrets.get(service, (b'', ''))
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = 0.0
+            self._version = None
+
+
+class WebhookGuard:
+    """بوابة الطلبات الواردة: الحجم ثم التوقيع ثم تحليل JSON - بهذا الترتيب"""
+
+    def __init__(self, secrets=None):
+        self.secrets = secrets or WebhookSecrets()
+        self._lock = threading.Lock()
+        self._warned = set()
+        self._rejected = 0
+        self._rejected_logged_at = 0.0
+        self.stats = {'accepted': 0, 'rejected': 0, 'unsigned': 0}
+
+    def check_verify_token(self, service, token):
+        """طلب GET للتحقق من الاشتراك (hub.verify_token)"""
+        expected = self.secrets.get(service)[1]
+        return bool(expected and token) and hmac.compare_digest(expected.encode('utf-8'), token.encode('utf-8'))
+
+    def authenticate(self, service, content_length, signature, read_body):
+        """
+        ترجع الحمولة محللة أو ترفع WebhookRejected
+        read_body تُستدعى فقط إذا كان الحجم مقبولاً والتوقيع موجوداً (أو غير مطلوب)
+        """
+        secret = self.secrets.get(service)[0]
+        if content_length is not None and content_length > WEBHOOK_MAX_BODY:
+            raise self._reject(413, 'payload too large')
+        if secret and not signature:
+            # لا داعي لقراءة الجسم أصلاً
+            raise self._reject(403, 'missing signature')
+
+        body = read_body()
+        if len(body) > WEBHOOK_MAX_BODY:
+            raise self._reject(413, 'payload too large')
+        if secret:
+            if not verify_signature(secret, body, signature):
+                raise self._reject(403, 'invalid signature')
+        elif WEBHOOK_REQUIRE_SIGNATURE:
+            raise self._reject(403, 'app secret not configured')
+        else:
+            self._warn_unsigned(service)
+
+        try:
+            payload = loads(body) if body else {}
+        except JSONDecodeError:
+            raise self._reject(400, 'invalid JSON')
+        with self._lock:
+            self.stats['accepted'] += 1
+        return payload
+
+    def _warn_unsigned(self, service):
+        with self._lock:
+            self.stats['unsigned'] += 1
+            if service in self._warned:
+                return
+            self._warned.add(service)
+        add_log('warning', f'{service} webhook accepted without signature check: app secret not configured',
+                service)
+
+    def _reject(self, status, reason):
+        now = time.monotonic()
+        with self._lock:
+            self.stats['rejected'] += 1
+            self._rejected += 1
+            if now - self._rejected_logged_at < REJECT_LOG_INTERVAL:
+                return WebhookRejected(status, reason)
+            count, self._rejected = self._rejected, 0
+            self._rejected_logged_at = now
+        add_log('warning', f'Webhook rejected: {reason} ({count} since last report)', 'webhook')
+        return WebhookRejected(status, reason)
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_webhook_guard():
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = WebhookGuard()
+    return _guard